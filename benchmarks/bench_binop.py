@@ -0,0 +1,65 @@
+# binop 分派开销基准: 对比 binop() 与直接调用 NumPy 运算的耗时, 差值即为分派开销
+#   python benchmarks/bench_binop.py
+#   python benchmarks/bench_binop.py -sizes 2,100,1000 -number 2000
+import argparse
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+from cilly_array import CillyArray
+from cilly_interpreter import binop
+
+
+def cases(n):
+    rng = np.random.default_rng(0)
+    a = CillyArray(rng.standard_normal((n, n)))
+    b = CillyArray(rng.standard_normal((n, n)))
+    u = CillyArray(rng.standard_normal(n))
+    w = CillyArray(rng.standard_normal(n))
+    z = CillyArray(np.zeros((n, n)))
+    # (名称, 运算符, 左, 右, 等价的 NumPy 运算)
+    return [
+        ('mat+mat', '+', a, b, lambda: a.data + b.data),
+        ('zero+mat', '+', z, b, lambda: z.data + b.data),
+        ('mat*mat', '*', a, b, lambda: np.dot(a.data, b.data)),
+        ('mat*vec', '*', a, u, lambda: np.dot(a.data, u.data)),
+        ('vec*vec', '*', u, w, lambda: u.data * w.data),
+        ('mat*2', '*', a, 2, lambda: a.data * 2),
+        ('vec-vec', '-', u, w, lambda: u.data - w.data),
+    ]
+
+
+def best(f, number, repeat):
+    return min(timeit.repeat(f, number=number, repeat=repeat)) / number
+
+
+def main():
+    command = argparse.ArgumentParser(description='binop dispatch overhead benchmark')
+    command.add_argument('-sizes', default='2,50,500', help='comma separated matrix sizes')
+    command.add_argument('-number', type=int, default=1000, help='calls per timing, divided by size^2 / 100 for large sizes')
+    command.add_argument('-repeat', type=int, default=5)
+    args = command.parse_args()
+
+    print(f'{"scalar":>10} {"op":>6} {"binop":>10} {"python":>10} {"overhead":>10}   (us per call)')
+    for name, op, x, y, raw in [('int+int', '+', 3, 4, lambda: 3 + 4), ('int<int', '<', 3, 4, lambda: 3 < 4),
+                                ('float*', '*', 1.5, 2.0, lambda: 1.5 * 2.0)]:
+        t = best(lambda: binop(op, x, y), args.number * 100, args.repeat) * 1e6
+        r = best(raw, args.number * 100, args.repeat) * 1e6
+        print(f'{name:>10} {op:>6} {t:10.3f} {r:10.3f} {t - r:10.3f}')
+
+    print()
+    print(f'{"size":>5} {"case":>10} {"binop":>10} {"numpy":>10} {"overhead":>10}   (us per call)')
+    for n in [int(s) for s in args.sizes.split(',')]:
+        number = max(3, args.number // max(1, n * n // 100))
+        for name, op, x, y, raw in cases(n):
+            t = best(lambda: binop(op, x, y), number, args.repeat) * 1e6
+            r = best(raw, number, args.repeat) * 1e6
+            print(f'{n:5d} {name:>10} {t:10.2f} {r:10.2f} {t - r:10.2f}')
+
+
+if __name__ == '__main__':
+    main()
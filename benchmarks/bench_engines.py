@@ -0,0 +1,367 @@
+# 执行引擎基准: 用 dist/ 下的程序及其放大版本, 分阶段(lex, parse, compile, run)测量各执行引擎
+#   python benchmarks/bench_engines.py -scales 1,10 -repeat 5 -json engines.json
+# 每个 (workload, scale, engine) 先预热 -warmup 次, 再测 -repeat 次, 报告各阶段的最小值和中位数
+# 输出与树遍历解释器不一致的结果标记为 mismatch; 引擎编译不了的程序标记为 skipped
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cilly_lexer import lexer
+from cilly_parser import parser
+from cilly_ast import from_list, N_FUN
+from cilly_incremental import Document
+from cilly_interpreter import eval
+from cilly_closure import compile_ast
+from cilly_stack import compile_stack
+from cilly_vm import cilly_vm, cilly_vm_compiler
+import cilly_memo
+import zcy
+
+PHASES = ['lex', 'parse', 'compile', 'run']
+
+
+def read_dist(name):
+    with open(os.path.join(ROOT, 'dist', name), encoding='utf-8') as f:
+        return f.read()
+
+
+# dist 脚本中指定顶层函数定义的源码
+def dist_functions(name, *funs):
+    doc = Document(read_dist(name))
+    texts = {}
+    for text, node in zip(doc.texts, doc.nodes):
+        if node is not None and node.kind == N_FUN:
+            texts[node.name] = text.strip()
+    return '\n'.join(texts[f] for f in funs) + '\n'
+
+
+def repeat_loop(body, times):
+    return f'var bench_i = 0;\nwhile (bench_i < {times}) {{\n{body}\n    bench_i = bench_i + 1;\n}}\n'
+
+
+# 以下每个函数按 scale 生成一份源码, scale 为 1 时与 dist 中的程序规模相同
+
+def workload_fact(scale):
+    return dist_functions('class.cilly', 'fact') + 'var r = 0;\n' + \
+        repeat_loop('    r = fact(10);', 10 * scale) + 'print(r);\n'
+
+
+def workload_fib0(scale):
+    # 递归 fib 的代价约为 1.618^n, n 随 log(scale) 增长使耗时与 scale 成正比
+    n = 15 + int(round(math.log(scale, 1.618)))
+    return dist_functions('class.cilly', 'fib0') + f'print(fib0({n}));\n'
+
+
+# 顶层有 100 * scale 个全局变量时调用 fib0(15), 函数调用的开销不应随全局变量个数增长
+def workload_fib0_globals(scale):
+    globs = ''.join(f'var g{i} = {i};\n' for i in range(100 * scale))
+    return globs + dist_functions('class.cilly', 'fib0') + 'print(fib0(15));\n'
+
+
+def workload_fib(scale):
+    return dist_functions('class.cilly', 'fib') + 'var r = 0;\n' + \
+        repeat_loop('    r = fib(30);', 10 * scale) + 'print(r);\n'
+
+
+# sum.cilly 的非尾递归 sum(5000 * scale), 递归深度超过 Python 调用栈的引擎报 error
+def workload_sum_deep(scale):
+    return read_dist('sum.cilly').replace('sum(int(input()))', f'sum({5000 * scale})')
+
+
+def workload_sum_100(scale):
+    return read_dist('sum_100.cilly').replace('sum_num(100)', f'sum_num({100 * scale})')
+
+
+# sum_100 的顶层循环版本, 不含函数调用
+def workload_sum_loop(scale):
+    return f'var total = 0;\nvar i = 0;\nwhile (i < {100 * scale}) {{\n' \
+           f'    total = total + i;\n    i = i + 1;\n}}\nprint(total);\n'
+
+
+def workload_diamond(scale):
+    return read_dist('diamond.cilly').replace('draw_diamond(5)', f'draw_diamond({5 * scale})')
+
+
+# diamond 式的逐段追加, 拼出一个 2000 * scale 段的长字符串
+def workload_concat(scale):
+    return 'var s = "";\n' + repeat_loop('    s = s + "*";\n    s = s + " item;";', 2000 * scale) + 'print(s);\n'
+
+
+# test.cilly 中的矩阵运算, D 换成可逆矩阵
+def workload_matrix(scale):
+    src = read_dist('test.cilly')
+    src = src[src.index('var A'):]
+    src = src.replace('var D = [ [1,2,3] , [4,5,6] , [7,8,9] ];', 'var D = [ [2,0,1] , [1,3,2] , [1,1,2] ];')
+    return src * scale
+
+
+# 8x8 矩阵的 A*B+C*D 链式运算, 循环 10 * scale 次
+def workload_matrix_chain(scale):
+    def literal(k):
+        return '[' + ', '.join('[' + ', '.join(str((i * 8 + j + k) % 7 - 3) for j in range(8)) + ']'
+                               for i in range(8)) + ']'
+    mats = ''.join(f'var {n} = {literal(k)};\n' for k, n in enumerate('ABCD'))
+    return mats + 'var E = A;\n' + repeat_loop('    E = A * B + C * D - E^T * 2;', 10 * scale) + \
+        'print(E[0][0], E[7][7]);\n'
+
+
+WORKLOADS = {
+    'fact': workload_fact,
+    'fib0': workload_fib0,
+    'fib0_globals': workload_fib0_globals,
+    'fib': workload_fib,
+    'sum_100': workload_sum_100,
+    'sum_deep': workload_sum_deep,
+    'sum_loop': workload_sum_loop,
+    'diamond': workload_diamond,
+    'concat': workload_concat,
+    'matrix': workload_matrix,
+    'matrix_chain': workload_matrix_chain,
+}
+
+
+# 引擎不支持的语法, 在编译阶段抛出, 结果记为 skipped
+class Unsupported(Exception):
+    pass
+
+
+def eval_compile(ast):
+    return from_list(ast)
+
+
+def eval_run(node):
+    eval(node, {})
+
+
+def closure_compile(ast):
+    return compile_ast(ast, {})
+
+
+def closure_run(code):
+    code()
+
+
+def stack_compile(ast):
+    return compile_stack(ast, {})
+
+
+def stack_run(code):
+    code()
+
+
+def vm_compile(ast):
+    return cilly_vm_compiler(ast, [], [], [])
+
+
+def vm_run(prog):
+    code, consts, glob_syms = prog
+    cilly_vm(code, consts, list(glob_syms))
+
+
+def vm_threaded_run(prog):
+    code, consts, glob_syms = prog
+    cilly_vm(code, consts, list(glob_syms), 'threaded')
+
+
+# 把 parser() 的语法树转成 zcy.VirtualMachine 能编译的形式, 超出它支持范围的节点抛出 Unsupported
+ZCY_OPS = ['+', '-', '*', '/', '<']
+
+
+def zcy_node(a):
+    if type(a) is not list:
+        raise Unsupported(f'zcy 不支持{a}')
+
+    tag = a[0]
+    if tag == 'program' or tag == 'block':
+        return [tag, [zcy_node(s) for s in a[1]]]
+    if tag == 'var' and a[2] is not None:
+        return ['var', a[1][1], zcy_node(a[2])]
+    if tag == 'assign' and type(a[1]) is list and a[1][0] == 'id':
+        return ['assign', a[1][1], zcy_node(a[2])]
+    if tag == 'binop' and a[1] in ZCY_OPS:
+        return ['binop', a[1], zcy_node(a[2]), zcy_node(a[3])]
+    if tag == 'id' or tag == 'num':
+        return a
+    if tag == 'print':
+        return ['print', [zcy_node(e) for e in a[1]]]
+    if tag == 'while':
+        return ['while', zcy_node(a[1]), zcy_node(a[2])]
+    if tag == 'if' and a[3] is not None:
+        return ['if', zcy_node(a[1]), zcy_node(a[2]), zcy_node(a[3])]
+    raise Unsupported(f'zcy 不支持{tag}')
+
+
+def zcy_compile(ast):
+    vm = zcy.VirtualMachine()
+    vm.visit(zcy_node(ast))
+    return vm.instructions, vm.constants
+
+
+def zcy_run(prog):
+    instructions, constants = prog
+    zcy.VirtualMachineExecutor(instructions, constants).run()
+
+
+# 统一输出格式后再比较: 各引擎 print 的分隔符不同, 只比较输出的值序列
+def plain_output(out):
+    return out.split()
+
+
+# zcy 每个值输出一行 'Output: 值', 其余行是调试信息
+def zcy_output(out):
+    values = []
+    for line in out.splitlines():
+        if line.startswith('Output: '):
+            values.extend(line[len('Output: '):].split())
+    return values
+
+
+ENGINES = {
+    'eval': (eval_compile, eval_run, plain_output),
+    'closure': (closure_compile, closure_run, plain_output),
+    'stack': (stack_compile, stack_run, plain_output),
+    'vm': (vm_compile, vm_run, plain_output),
+    'vm_threaded': (vm_compile, vm_threaded_run, plain_output),
+    'zcy': (zcy_compile, zcy_run, zcy_output),
+}
+
+
+# 跑一遍完整流程, 返回 (各阶段耗时, 程序输出)
+def run_once(src, engine):
+    compile_, run, _ = ENGINES[engine]
+    times = {}
+    buf = io.StringIO()
+    with contextlib.redirect_stdout(buf):
+        t = time.perf_counter()
+        tokens = lexer(src)
+        times['lex'] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        ast = parser(tokens)
+        times['parse'] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        try:
+            prog = compile_(ast)
+        except Exception as e:
+            raise Unsupported(str(e) or type(e).__name__)
+        times['compile'] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        run(prog)
+        times['run'] = time.perf_counter() - t
+    return times, buf.getvalue()
+
+
+def measure(src, engine, expected, warmup, repeat):
+    result = {'engine': engine, 'status': 'ok', 'reason': None, 'phases': None}
+    samples = {p: [] for p in PHASES}
+    try:
+        for i in range(warmup + repeat):
+            times, out = run_once(src, engine)
+            if i == 0 and expected is not None and ENGINES[engine][2](out) != expected:
+                result['status'] = 'mismatch'
+            if i >= warmup:
+                for p in PHASES:
+                    samples[p].append(times[p])
+    except Unsupported as e:
+        result['status'] = 'skipped'
+        result['reason'] = str(e)
+        return result
+    except Exception as e:
+        result['status'] = 'error'
+        result['reason'] = f'{type(e).__name__}: {e}'
+        return result
+
+    result['phases'] = {p: {'min': min(s), 'median': statistics.median(s), 'samples': s}
+                        for p, s in samples.items()}
+    return result
+
+
+# 以树遍历解释器的输出为准; 它跑不了的程序(如递归过深)改用显式栈引擎的输出
+def reference_output(src):
+    for engine in ('eval', 'stack'):
+        try:
+            _, out = run_once(src, engine)
+        except Exception:
+            continue
+        return plain_output(out)
+    return None
+
+
+def split_arg(s, choices):
+    names = [x.strip() for x in s.split(',') if x.strip()]
+    if names == ['all']:
+        return list(choices)
+    for n in names:
+        if n not in choices:
+            raise SystemExit(f'unknown name {n}, choose from {", ".join(choices)}')
+    return names
+
+
+def main():
+    command = argparse.ArgumentParser(description='execution engine benchmark')
+    command.add_argument('-engines', default='all', help='comma separated: ' + ','.join(ENGINES))
+    command.add_argument('-workloads', default='all', help='comma separated: ' + ','.join(WORKLOADS))
+    command.add_argument('-scales', default='1,10', help='comma separated scale factors')
+    command.add_argument('-warmup', type=int, default=1)
+    command.add_argument('-repeat', type=int, default=5)
+    command.add_argument('-json', help='write results to this file')
+    command.add_argument('-memo', action='store_true', help='memoize pure functions, as cilly -memo')
+    args = command.parse_args()
+    cilly_memo.memo_enabled = args.memo
+
+    engines = split_arg(args.engines, ENGINES)
+    workloads = split_arg(args.workloads, WORKLOADS)
+    scales = [int(x) for x in args.scales.split(',')]
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 20000))
+
+    results = []
+    print(f'{"workload":>12} {"scale":>5} {"engine":>11} {"status":>8} ' +
+          ' '.join(f'{p:>9}' for p in PHASES) + f' {"total":>9}   (median ms)')
+    for name in workloads:
+        for scale in scales:
+            src = WORKLOADS[name](scale)
+            expected = reference_output(src)
+            for engine in engines:
+                r = measure(src, engine, expected, args.warmup, args.repeat)
+                r['workload'] = name
+                r['scale'] = scale
+                results.append(r)
+
+                line = f'{name:>12} {scale:5d} {engine:>11} {r["status"]:>8} '
+                if r['phases'] is not None:
+                    med = [r['phases'][p]['median'] * 1e3 for p in PHASES]
+                    line += ' '.join(f'{m:9.3f}' for m in med) + f' {sum(med):9.3f}'
+                else:
+                    line += '  ' + r['reason'][:60]
+                print(line)
+
+    if args.json:
+        report = {
+            'meta': {
+                'python': platform.python_version(),
+                'implementation': platform.python_implementation(),
+                'machine': platform.machine(),
+                'platform': platform.platform(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            },
+            'config': {'warmup': args.warmup, 'repeat': args.repeat, 'scales': scales},
+            'results': results,
+        }
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
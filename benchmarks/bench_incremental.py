@@ -0,0 +1,87 @@
+# 增量解析基准: 大文件中做一次小编辑, 对比整文件重新解析与 Document.edit() 的延迟
+#   python benchmarks/bench_incremental.py -funs 2000
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cilly_ast import parse_ast, to_list
+from cilly_parser import parser, lexer
+from cilly_incremental import Document
+
+
+def make_source(n):
+    # n 个函数定义, 每个函数体里有循环和条件分支
+    funs = []
+    for i in range(n):
+        funs.append(f'''fun f{i}(a, b) {{
+    var s = 0;
+    while (a < b) {{
+        if (a == {i}) {{
+            s = s + a * 2;
+        }} else {{
+            s = s - 1;
+        }}
+        a = a + 1;
+    }}
+    return s;
+}}
+''')
+    return ''.join(funs)
+
+
+# 每次编辑: 把某个函数里的常量改成别的数字, 文档总长度基本不变
+def random_edit(doc, rnd):
+    src = doc.source
+    i = src.find('a == ', rnd.randrange(len(src))) if len(src) > 0 else -1
+    if i < 0:
+        i = src.find('a == ')
+    i = i + len('a == ')
+    j = i
+    while src[j].isdigit():
+        j = j + 1
+    return i, j, str(rnd.randrange(100000))
+
+
+def main():
+    command = argparse.ArgumentParser(description='incremental parse benchmark')
+    command.add_argument('-funs', type=int, default=2000, help='functions in the largest file')
+    command.add_argument('-edits', type=int, default=200)
+    command.add_argument('-check', action='store_true', help='compare with a full parse after every edit')
+    args = command.parse_args()
+
+    rnd = random.Random(0)
+    print(f'{"funs":>7} {"bytes":>9} {"full parse":>11} {"edit avg":>10} {"edit max":>10}')
+    n = max(1, args.funs // 8)
+    while n <= args.funs:
+        src = make_source(n)
+
+        t = time.perf_counter()
+        parse_ast(src)
+        full = time.perf_counter() - t
+
+        doc = Document(src)
+        total = 0
+        worst = 0
+        for _ in range(args.edits):
+            i, j, text = random_edit(doc, rnd)
+            t = time.perf_counter()
+            doc.edit(i, j, text)
+            doc.ast()
+            t = time.perf_counter() - t
+            total = total + t
+            worst = max(worst, t)
+            if args.check and to_list(doc.ast()) != parser(lexer(doc.source)):
+                print('mismatch after edit', i, j, text)
+                return
+
+        print(f'{n:7d} {len(src):9d} {full * 1e3:9.2f}ms {total / args.edits * 1e3:8.3f}ms {worst * 1e3:8.3f}ms')
+        n = n * 2
+
+
+if __name__ == '__main__':
+    main()
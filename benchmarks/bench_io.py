@@ -0,0 +1,70 @@
+# 矩阵文件读写基准: 生成 N×N 的 .npy 和 .csv, 用脚本 load() 后做一次矩阵乘向量, 对比耗时和峰值内存
+#   python benchmarks/bench_io.py -n 4000
+#   python benchmarks/bench_io.py -n 2000 -keep /tmp/cilly_io
+# 峰值内存为 tracemalloc 统计的新分配字节数, .npy 是内存映射, 数据本身不计入
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+from cilly_lexer import lexer
+from cilly_parser import parser
+from cilly_interpreter import eval
+
+
+def run(src):
+    ast = parser(lexer(src))
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    t = time.perf_counter()
+    envir = {}
+    eval(ast, envir)
+    elapsed = time.perf_counter() - t
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return elapsed, peak, envir['y'].data
+
+
+def main():
+    command = argparse.ArgumentParser(description='matrix load/save benchmark')
+    command.add_argument('-n', type=int, default=4000, help='matrix size')
+    command.add_argument('-keep', help='directory for the generated files (default: a temporary directory)')
+    args = command.parse_args()
+
+    directory = args.keep or tempfile.mkdtemp()
+    os.makedirs(directory, exist_ok=True)
+    n = args.n
+    rng = np.random.default_rng(0)
+    a = rng.standard_normal((n, n))
+    v = rng.standard_normal(n)
+    npy = os.path.join(directory, 'A.npy')
+    csv = os.path.join(directory, 'A.csv')
+    vec = os.path.join(directory, 'v.npy')
+    np.save(npy, a)
+    np.save(vec, v)
+    np.savetxt(csv, a, delimiter=',', fmt='%.17g')
+
+    mb = 1024 * 1024
+    print(f'N = {n}, matrix = {a.nbytes / mb:.1f} MB, csv = {os.path.getsize(csv) / mb:.1f} MB')
+    print(f'{"file":>6} {"time":>9} {"peak":>10}')
+    expected = a @ v
+    try:
+        for name, path in (('npy', npy), ('csv', csv)):
+            elapsed, peak, y = run(f'var A = load("{path}");\nvar v = load("{vec}");\nvar y = A * v;\n')
+            ok = '' if np.allclose(y, expected) else '  MISMATCH'
+            print(f'{name:>6} {elapsed:8.3f}s {peak / mb:8.1f}MB{ok}')
+    finally:
+        if not args.keep:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
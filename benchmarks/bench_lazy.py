@@ -0,0 +1,86 @@
+# 惰性矩阵运算基准: 在 N×N 的随机矩阵上执行较长的矩阵公式, 对比立即求值与惰性求值(-lazy)的耗时和峰值内存
+#   python benchmarks/bench_lazy.py -n 2000
+#   python benchmarks/bench_lazy.py -n 500 -formulas sum,chain -repeat 5
+# 峰值内存为 tracemalloc 统计的、输入矩阵之外新分配的最大字节数; 每个公式最后取 E[0] 触发求值并核对两种模式的结果
+import argparse
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import cilly_array
+from cilly_array import CillyArray
+from cilly_lexer import lexer
+from cilly_parser import parser
+from cilly_interpreter import eval
+
+# A, B, C, D 为 N×N 矩阵, v 为长度 N 的向量
+FORMULAS = {
+    'affine': 'var E = A * B + C - D * 2.5;',
+    'sum': 'var E = A + B - C * 2 + D * 0.5 - A * 3 + B - C + D * 1.5;',
+    'chain': 'var E = A * B * C * v;',
+    'mixed': 'var E = (A * B)^T + C * D * 0.5 - A + B * 2;',
+}
+
+
+def make_env(n, seed):
+    rng = np.random.default_rng(seed)
+    env = {name: CillyArray(rng.standard_normal((n, n))) for name in 'ABCD'}
+    env['v'] = CillyArray(rng.standard_normal(n))
+    return env
+
+
+def run(src, env, lazy):
+    cilly_array.lazy_enabled = lazy
+    envir = dict(env)
+    ast = parser(lexer(src + '\nvar e0 = E[0];\n'))
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    t = time.perf_counter()
+    eval(ast, envir)
+    elapsed = time.perf_counter() - t
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+
+    cilly_array.lazy_enabled = False
+    return elapsed, peak, envir['E'].data
+
+
+def main():
+    command = argparse.ArgumentParser(description='lazy matrix expression benchmark')
+    command.add_argument('-n', type=int, default=2000, help='matrix size')
+    command.add_argument('-formulas', default='all', help='comma separated: ' + ','.join(FORMULAS))
+    command.add_argument('-repeat', type=int, default=3)
+    command.add_argument('-seed', type=int, default=0)
+    args = command.parse_args()
+
+    names = list(FORMULAS) if args.formulas == 'all' else args.formulas.split(',')
+    env = make_env(args.n, args.seed)
+    mb = 1024 * 1024
+    print(f'N = {args.n}, one matrix = {args.n * args.n * 8 / mb:.1f} MB')
+    print(f'{"formula":>8} {"eager":>10} {"lazy":>10} {"speedup":>8} {"eager peak":>11} {"lazy peak":>10} {"ratio":>6}')
+    for name in names:
+        src = FORMULAS[name]
+        results = {}
+        for lazy in (False, True):
+            times = []
+            for _ in range(args.repeat):
+                elapsed, peak, value = run(src, env, lazy)
+                times.append(elapsed)
+            results[lazy] = (statistics.median(times), peak, value)
+
+        (te, pe, ve), (tl, pl, vl) = results[False], results[True]
+        ok = '' if np.allclose(ve, vl) else '  MISMATCH'
+        print(f'{name:>8} {te:9.3f}s {tl:9.3f}s {te / tl:7.2f}x {pe / mb:9.1f}MB {pl / mb:8.1f}MB '
+              f'{pl / pe if pe else 0:6.2f}{ok}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+# 词法分析器吞吐量基准: 正则单遍扫描 lexer() 对比逐字符扫描 char_lexer()
+#   python benchmarks/bench_lexer.py -size 8 -ref-size 0.25
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cilly_lexer import lexer, char_lexer, iter_tokens, lex_buffer
+
+WORKLOADS = ['class.cilly', 'diamond.cilly', 'sum_100.cilly', 'test.cilly', 'lib.cilly']
+
+
+def read_workloads():
+    srcs = []
+    for name in WORKLOADS:
+        with open(os.path.join(ROOT, 'dist', name), encoding='utf-8') as f:
+            srcs.append(f.read())
+    return srcs
+
+
+def make_source(srcs, size):
+    # 把 dist 下的脚本重复拼接到 size 字节
+    unit = '\n'.join(srcs) + '\n'
+    return unit * max(1, int(size // len(unit)))
+
+
+def make_literals(size):
+    # 长字符串和长标识符, 逐字符扫描在这里是平方级的
+    n = int(size // 2)
+    return f'var s = "{"x" * n}";\nvar {"a" * n} = 1;\n'
+
+
+def bench(fn, src, repeat):
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn(src)
+        t = time.perf_counter() - t
+        best = t if best is None else min(best, t)
+    return best
+
+
+def report(name, fn, src, repeat):
+    t = bench(fn, src, repeat)
+    mb = len(src) / 1e6
+    print(f'{name:<12} {mb:8.2f} MB {t:9.3f} s {mb / t:9.2f} MB/s')
+
+
+def peak_memory(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def retained_memory(fn, src):
+    tracemalloc.start()
+    try:
+        tokens = fn(src)
+        return tracemalloc.get_traced_memory()[0], len(tokens)
+    finally:
+        tracemalloc.stop()
+
+
+def buffer_memory(srcs, size):
+    # 每个记号一个列表 (char_lexer)、共享定长记号的列表 (lexer) 与 TokenBuffer 各自常驻的内存
+    src = make_source(srcs, size)
+    buf_mem, n = retained_memory(lex_buffer, src)
+    for name, fn in [('char_lexer', char_lexer), ('lexer', lexer), ('lex_buffer', lex_buffer)]:
+        mem, _ = retained_memory(fn, src)
+        print(f'{name:<12} {mem / n:6.1f} B/token  ({mem / buf_mem:.1f}x)')
+
+
+def drain(tokens):
+    for _ in tokens:
+        pass
+
+
+def stream_memory(srcs, size):
+    # 对比一次性 lexer() 与流式 iter_tokens() 的记号内存峰值
+    src = make_source(srcs, size)
+    with tempfile.NamedTemporaryFile('w', suffix='.cilly', delete=False, encoding='utf-8') as f:
+        f.write(src)
+    try:
+        def whole():
+            with open(f.name, encoding='utf-8') as g:
+                lexer(g.read())
+
+        def stream():
+            with open(f.name, encoding='utf-8') as g:
+                drain(iter_tokens(g))
+
+        mb = len(src) / 1e6
+        print(f'{mb:8.2f} MB  lexer peak {peak_memory(whole) / 1e6:9.2f} MB'
+              f'  iter_tokens peak {peak_memory(stream) / 1e6:7.3f} MB')
+    finally:
+        os.remove(f.name)
+
+
+def main():
+    command = argparse.ArgumentParser(description='lexer benchmark')
+    command.add_argument('-size', type=float, default=4, help='input size in MB')
+    command.add_argument('-ref-size', type=float, default=0.25, help='input size in MB for char_lexer, 0 to skip')
+    command.add_argument('-repeat', type=int, default=3)
+    command.add_argument('-stream', action='store_true', help='to measure peak token memory of iter_tokens')
+    command.add_argument('-buffer', action='store_true', help='to measure token memory of lex_buffer')
+    args = command.parse_args()
+
+    srcs = read_workloads()
+    for src in srcs:
+        if lexer(src) != char_lexer(src):
+            raise Exception('lexer 与 char_lexer 的记号流不一致')
+
+    size = args.size * 1e6
+    ref_size = args.ref_size * 1e6
+
+    print('scripts')
+    report('lexer', lexer, make_source(srcs, size), args.repeat)
+    if ref_size > 0:
+        report('char_lexer', char_lexer, make_source(srcs, ref_size), 1)
+
+    report('lex_buffer', lex_buffer, make_source(srcs, size), args.repeat)
+
+    print('long literals')
+    report('lexer', lexer, make_literals(size), args.repeat)
+    if ref_size > 0:
+        report('char_lexer', char_lexer, make_literals(ref_size), 1)
+
+    if args.buffer:
+        print('token memory')
+        buffer_memory(srcs, size)
+
+    if args.stream:
+        print('peak memory')
+        for scale in [0.25, 0.5, 1]:
+            stream_memory(srcs, size * scale)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# 表达式解析基准: 一条语句里放 N 项表达式, 观察解析时间是否随 N 线性增长
+#   python benchmarks/bench_parser.py -terms 10000
+#   python benchmarks/bench_parser.py -memory -terms 100 -stmts 500    列表语法树与节点语法树的内存对比
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cilly_parser import parser, lex_buffer
+from cilly_ast import from_list
+
+OPS = ['+', '-', '*', '/', '<', '==']
+
+
+def make_expr(n):
+    # a0 + a1 * 2 - a2[1] / (a3 + 1) ... 共 n 项
+    terms = []
+    for i in range(n):
+        if i % 4 == 0:
+            t = f'a{i}'
+        elif i % 4 == 1:
+            t = f'a{i} * 2'
+        elif i % 4 == 2:
+            t = f'a{i}[1]'
+        else:
+            t = f'-(a{i} + 1)'
+        terms.append(t)
+        terms.append(OPS[i % len(OPS)])
+    return ' '.join(terms[:-1])
+
+
+def make_source(n, stmts):
+    e = make_expr(n)
+    return ''.join(f'x = {e};\nprint({e});\n' for _ in range(stmts))
+
+
+def bench(src, repeat):
+    buf = lex_buffer(src)
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        parser(buf)
+        t = time.perf_counter() - t
+        best = t if best is None else min(best, t)
+    return best
+
+
+# 分别测量列表语法树和节点语法树占用的内存
+def bench_memory(src):
+    buf = lex_buffer(src)
+
+    tracemalloc.start()
+    ast = parser(buf)
+    list_size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    node = from_list(ast)
+    node_size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return list_size, node_size
+
+
+def main():
+    command = argparse.ArgumentParser(description='parser benchmark')
+    command.add_argument('-terms', type=int, default=10000, help='largest expression size')
+    command.add_argument('-stmts', type=int, default=1, help='statements per source')
+    command.add_argument('-repeat', type=int, default=3)
+    command.add_argument('-memory', action='store_true', help='compare list AST and node AST memory')
+    args = command.parse_args()
+
+    if args.memory:
+        src = make_source(args.terms, args.stmts)
+        list_size, node_size = bench_memory(src)
+        print(f'list AST: {list_size / 1024:10.1f} KB')
+        print(f'node AST: {node_size / 1024:10.1f} KB ({node_size / list_size:.2f}x)')
+        return
+
+    print(f'{"terms":>8} {"time":>10} {"us/term":>9}')
+    n = max(1, args.terms // 8)
+    while n <= args.terms:
+        t = bench(make_source(n, args.stmts), args.repeat)
+        print(f'{n:8d} {t:9.4f}s {t / (2 * n * args.stmts) * 1e6:9.3f}')
+        n = n * 2
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+# 虚拟机基准: 用 cilly_vm 执行递归的 fib0(n), 报告 -repeat 次中最快一次的运行时间(不含编译)
+#   python benchmarks/bench_vm.py -n 25
+#   python benchmarks/bench_vm.py -n 25 -ref HEAD~1
+#   python benchmarks/bench_vm.py -n 25 -dispatch table,threaded
+# -dispatch 为当前版本要测的执行方式(见 cilly_vm.DISPATCH_MODES)
+# -ref 把指定 git 版本的源码导出到临时目录, 用同样的程序测一遍, 对比两个版本的耗时
+# 每个版本在单独的子进程中测量, 互不影响导入的模块
+# 另外用 tracemalloc 统计每次算术运算(+ - *)新分配、随结果一直存活的内存块数:
+#   程序把 ALLOC_OPS 个小整数运算的结果存进全局变量, 比较执行前后 cilly_vm.py 中分配的、仍存活的块数
+#   结果装在 [标签, 值] 列表里时每次运算一块; 直接用 Python 的小整数时为 0
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIB0 = '''fun fib0(n){
+    if(n < 2)
+        return n;
+    else
+        return fib0(n-1) + fib0(n-2);
+}
+print(fib0(%d));
+'''
+
+# 在子进程中执行, argv 为 源码目录、n、repeat 和可选的执行方式; 不给执行方式时按 cilly_vm 的默认方式, 旧版本也能测
+MEASURE = '''
+import contextlib, io, sys, time
+sys.path.insert(0, sys.argv[1])
+sys.setrecursionlimit(100000)
+from cilly_lexer import lexer
+from cilly_parser import parser
+from cilly_vm import cilly_vm, cilly_vm_compiler
+src = %r %% int(sys.argv[2])
+code, consts, glob_syms = cilly_vm_compiler(parser(lexer(src)), [], [], [])
+extra = sys.argv[4:]
+best = None
+for _ in range(int(sys.argv[3])):
+    buf = io.StringIO()
+    with contextlib.redirect_stdout(buf):
+        t = time.perf_counter()
+        cilly_vm(code, consts, list(glob_syms), *extra)
+        elapsed = time.perf_counter() - t
+    best = elapsed if best is None else min(best, elapsed)
+print(best, buf.getvalue().strip())
+''' % FIB0
+
+
+ALLOC_OPS = 300
+
+# 在子进程中执行, argv 为 源码目录和可选的执行方式, 输出每次运算的块数和字节数
+MEASURE_ALLOC = '''
+import gc, sys, tracemalloc
+sys.path.insert(0, sys.argv[1])
+from cilly_lexer import lexer
+from cilly_parser import parser
+from cilly_vm import cilly_vm, cilly_vm_compiler
+import cilly_fold
+cilly_fold.fold_enabled = False
+ops = %d
+src = 'var a = 7;\\nvar b = 3;\\n' + ''.join('var r%%d = a %%s b;\\n' %% (i, '+-*'[i %% 3]) for i in range(ops))
+code, consts, glob_syms = cilly_vm_compiler(parser(lexer(src)), [], [], [])
+globs = list(glob_syms)
+only_vm = [tracemalloc.Filter(True, '*cilly_vm.py')]
+tracemalloc.start()
+before = tracemalloc.take_snapshot().filter_traces(only_vm)
+cilly_vm(code, consts, globs, *sys.argv[2:])
+# 处理函数之间互相引用, 回收后只剩存进 globs 的运算结果
+gc.collect()
+after = tracemalloc.take_snapshot().filter_traces(only_vm)
+tracemalloc.stop()
+diff = after.compare_to(before, 'filename')
+blocks = sum(d.count_diff for d in diff)
+size = sum(d.size_diff for d in diff)
+print(blocks / ops, size / ops)
+''' % ALLOC_OPS
+
+
+def measure(root, n, repeat, dispatch):
+    argv = [sys.executable, '-c', MEASURE, root, str(n), str(repeat)]
+    if dispatch is not None:
+        argv.append(dispatch)
+    out = subprocess.run(argv, capture_output=True, text=True, check=True).stdout.split()
+    return float(out[0]), out[1]
+
+
+def measure_alloc(root, dispatch):
+    argv = [sys.executable, '-c', MEASURE_ALLOC, root]
+    if dispatch is not None:
+        argv.append(dispatch)
+    out = subprocess.run(argv, capture_output=True, text=True, check=True).stdout.split()
+    return float(out[0]), float(out[1])
+
+
+# 导出 git 版本 rev 的源码树到临时目录
+def export(rev):
+    directory = tempfile.mkdtemp()
+    archive = subprocess.run(['git', '-C', ROOT, 'archive', rev], capture_output=True, check=True).stdout
+    subprocess.run(['tar', '-x', '-C', directory], input=archive, check=True)
+    return directory
+
+
+def main():
+    command = argparse.ArgumentParser(description='VM dispatch benchmark')
+    command.add_argument('-n', type=int, default=25, help='argument of fib0')
+    command.add_argument('-repeat', type=int, default=3, help='runs per version, the fastest is reported')
+    command.add_argument('-ref', help='git revision to compare against')
+    command.add_argument('-dispatch', default='table,threaded', help='comma separated dispatch modes of the current version')
+    args = command.parse_args()
+
+    # (版本, 执行方式, 源码目录)
+    runs = [('current', d.strip(), ROOT) for d in args.dispatch.split(',') if d.strip()]
+    if args.ref:
+        runs.insert(0, (args.ref, None, export(args.ref)))
+
+    print(f'fib0({args.n}), best of {args.repeat}')
+    print(f'{"version":>12} {"dispatch":>9} {"time":>9} {"speedup":>8}  result')
+    base = None
+    try:
+        for name, dispatch, root in runs:
+            elapsed, result = measure(root, args.n, args.repeat, dispatch)
+            base = base or elapsed
+            print(f'{name:>12} {dispatch or "default":>9} {elapsed:8.3f}s {base / elapsed:7.2f}x  {result}')
+
+        print(f'\nlive allocations per arithmetic op, {ALLOC_OPS} ops')
+        print(f'{"version":>12} {"dispatch":>9} {"blocks":>7} {"bytes":>7}')
+        for name, dispatch, root in runs:
+            blocks, size = measure_alloc(root, dispatch)
+            print(f'{name:>12} {dispatch or "default":>9} {blocks:7.2f} {size:7.1f}')
+    finally:
+        for name, dispatch, root in runs:
+            if root != ROOT:
+                shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,17 @@
 import argparse
+import atexit
+import os
+from multiprocessing import freeze_support
+import cilly_array
+import cilly_cache
+import cilly_fold
+import cilly_memo
+from cilly_batch import compile_batch
 from cilly_interpreter import *
-# from cilly_vm import *
+from cilly_closure import execute
+from cilly_stack import execute_stack
+from cilly_cache import *
+from cilly_vm import *
 
 def parse_command_line():
     command = argparse.ArgumentParser(description='Simple compiler')
@@ -13,6 +24,20 @@ def parse_command_line():
     command.add_argument('-itr', action='store_true', help='to entry interactive mode')
     command.add_argument('-vmc', nargs='?', help='to compiler from ast to opcode')
     command.add_argument('-vme', nargs='?', help='to execute a cilly program in virtual machine')
+    command.add_argument('-dispatch', choices=list(DISPATCH_MODES), default='table',
+                         help='instruction dispatch for -vme: table (default) or threaded (pre-decoded, fastest for long runs)')
+    command.add_argument('-engine', choices=list(ENGINES), default='eval', help='execution engine for -exc and -itr')
+    command.add_argument('-lazy', action='store_true', help='to defer matrix operations until a value is used')
+    command.add_argument('-no-cache', action='store_true', help='to ignore __cillycache__ and compile from source')
+    command.add_argument('-no-fold', action='store_true', help='to disable constant folding')
+    command.add_argument('-fold-report', action='store_true', help='to print how many syntax tree nodes constant folding removed')
+    command.add_argument('-memo', nargs='?', type=int, const=cilly_memo.memo_size,
+                         help='to cache results of pure functions, keeping at most n entries per function')
+    command.add_argument('-memo-report', action='store_true', help='to print memoization hits and misses')
+    command.add_argument('-cache-stats', nargs='?', const='.', help='to print compilation cache statistics')
+    command.add_argument('-batch', nargs='?', help='to compile every cilly file under a directory')
+    command.add_argument('-jobs', type=int, help='worker processes for -batch (default: cpu count)')
+    command.add_argument('-out', nargs='?', help='output directory for -batch artifacts')
 
     return command.parse_args()
 
@@ -29,6 +54,26 @@ def cilly_help():
     print('  -itr           to entry interactive mode')
     print('  -vmc [file]    to compiler from ast to opcode')
     print('  -vme [file]    to execute a cilly program in virtual machine')
+    print('  -dispatch [mode] instruction dispatch for -vme: table (default) or threaded (pre-decoded, fastest for long runs)')
+    print('  -engine [name] execution engine for -exc and -itr: eval (default), closure or stack')
+    print('  -lazy          to defer matrix operations until a value is used')
+    print('  -no-cache      to ignore __cillycache__ and compile from source')
+    print('  -no-fold       to disable constant folding')
+    print('  -fold-report   to print how many syntax tree nodes constant folding removed')
+    print('  -memo [n]      to cache results of pure functions, keeping at most n entries per function (default 1024)')
+    print('  -memo-report   to print memoization hits and misses')
+    print('  -cache-stats [dir]  to print compilation cache statistics')
+    print('  -batch [dir]   to compile every cilly file under a directory into .cillyc')
+    print('  -jobs [n]      worker processes for -batch (default: cpu count)')
+    print('  -out [dir]     output directory for -batch artifacts')
+
+
+# 执行引擎: 参数为 (语法树, 环境)
+ENGINES = {
+    'eval': eval,
+    'closure': execute,
+    'stack': execute_stack,
+}
 
 
 def cilly_lexer(filename):
@@ -39,15 +84,13 @@ def cilly_lexer(filename):
 
 def cilly_parser(filename):
     if filename is not None:
-        with open(filename) as f:
-            print(parser(lexer(f.read())))
+        print(load_ast(filename))
 
 
-def cilly_execute(filename):
+def cilly_execute(filename, run=eval):
     envir = {}
     if filename is not None:
-        with open(filename) as f:
-            print(eval(parser(lexer(f.read())), envir))
+        print(run(load_ast(filename), envir))
 
 
 def cilly_cat(filename):
@@ -60,10 +103,38 @@ def cilly_env():
     pass
 
 
-def cilly_interact():
+def cilly_batch(directory, jobs, out_dir):
+    count, failed, wall = compile_batch(directory, jobs, out_dir)
+    for path, msg in failed:
+        print(msg)
+    print(f'{count} files, {count - len(failed)} compiled, {len(failed)} failed, '
+          f'{wall:.2f}s, {count / wall if wall > 0 else 0:.1f} files/s')
+
+
+def cilly_cache_stats(directory):
+    stats = read_stats(os.path.join(directory, CACHE_DIR))
+    for key, value in stats.items():
+        print(f'{key:10} {value}')
+
+
+def cilly_fold_report():
+    stats = cilly_fold.fold_stats
+    for key, value in stats.items():
+        print(f'{key:10} {value}')
+    if stats['nodes']:
+        print(f'{"ratio":10} {stats["removed"] / stats["nodes"]:.1%}')
+
+
+def cilly_memo_report():
+    print(f'{"function":12} {"hits":>10} {"misses":>10} {"entries":>8}')
+    for name, (hits, misses, size) in cilly_memo.stats().items():
+        print(f'{name:12} {hits:10} {misses:10} {size:8}')
+
+
+def cilly_interact(run=eval):
     def exexute(code, env):
         lex = lexer(code)
-        eval(parser(lex), env)
+        run(parser(lex), env)
     envir = {}
     code = ''
     layer = 0
@@ -94,56 +165,43 @@ def cilly_interact():
             print('Invalid synix, please input again, key `exit` to break')
 
 
-# def opcode_2_instruction(opcode):
-#     c = []
-#     i = 0
-#     while i < len(opcode):
-#         for key, value in zl.items():
-#             if opcode[i] == value:
-#                 st = ""
-#                 for x in c:
-#                     st += x + '\t'
-#                 print(st)
-#                 c = []
-#                 c.append(f"{i}: {key}")
-#                 f = key
-#                 break
-#         if f in ["LOAD_CONST", "ENTER_SCOPE", "JMP", "JMP_TRUE", "JMP_FALSE", "CALL"]:
-#             c.append(f"{opcode[i + 1]}")
-#             f = None
-#             i += 1
-#         elif f in ["LOAD_VAR", "STORE_VAR"]:
-#             c.append(f"{opcode[i + 1]}")
-#             c.append(f"{opcode[i + 2]}")
-#             f = None
-#             i += 2
-#         i += 1
-
-
-# def cilly_vmc(filename):
-#     if filename is not None:
-#         with open(filename) as f:
-#             ast = parser(lexer(f.read()))
-#
-#     code, consts, glob_syms = cilly_vm_compiler(ast, [], [], [])
-#
-#     opcode_2_instruction(code)
-#     print(consts)
-#     print(glob_syms)
-
-
-# def cilly_vme(filename):
-#     if filename is not None:
-#         with open(filename) as f:
-#             ast = parser(lexer(f.read()))
-#
-#     code, consts, glob_syms = cilly_vm_compiler(ast, [], [], [])
-#     cilly_vm(code, consts, glob_syms)
+def cilly_vmc(filename):
+    if filename is not None:
+        code, consts, glob_syms = load_code(filename)
+
+        print(disassemble(code))
+        print(consts)
+        print(glob_syms)
+
+
+def cilly_vme(filename, dispatch='table'):
+    if filename is not None:
+        code, consts, glob_syms = load_code(filename)
+        cilly_vm(code, consts, glob_syms, dispatch)
 
 
 def main():
     args = parse_command_line()
 
+    if args.no_cache:
+        cilly_cache.cache_enabled = False
+
+    if args.lazy:
+        cilly_array.lazy_enabled = True
+
+    if args.no_fold:
+        cilly_fold.fold_enabled = False
+
+    if args.fold_report:
+        atexit.register(cilly_fold_report)
+
+    if args.memo is not None:
+        cilly_memo.memo_enabled = True
+        cilly_memo.memo_size = max(1, args.memo)
+
+    if args.memo_report:
+        atexit.register(cilly_memo_report)
+
     if args.help:
         cilly_help()
         return
@@ -158,7 +216,7 @@ def main():
 
     if args.exc:
         if args.exc.endswith('.cilly'):
-            cilly_execute(filename=args.exc)
+            cilly_execute(filename=args.exc, run=ENGINES[args.engine])
 
     if args.env:
         cilly_env()
@@ -168,17 +226,24 @@ def main():
         cilly_cat(filename=args.cat)
 
     if args.itr:
-        cilly_interact()
+        cilly_interact(run=ENGINES[args.engine])
+        return
+
+    if args.vmc:
+        cilly_vmc(filename=args.vmc)
         return
 
-    # if args.vmc:
-    #     cilly_vmc(filename=args.vmc)
-    #     return
-    #
-    # if args.vme:
-    #     cilly_vme(filename=args.vme)
-    #     return
+    if args.vme:
+        cilly_vme(filename=args.vme, dispatch=args.dispatch)
+        return
+
+    if args.cache_stats:
+        cilly_cache_stats(args.cache_stats)
+
+    if args.batch:
+        cilly_batch(args.batch, args.jobs, args.out)
 
 
 if __name__ == '__main__':
+    freeze_support()
     main()
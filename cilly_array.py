@@ -0,0 +1,219 @@
+import weakref
+import numpy as np
+import cilly_lazy
+
+# 向量、矩阵的值: 包装一个 ndarray, 运算结果一直留在 NumPy 中
+# 脚本取元素时才转成 Python 数值, 打印时才转成列表; 列表字面量在第一次参与运算时转换
+# 取一行得到的是共享数据的视图, 通过它赋值会改到原矩阵, 与嵌套列表的行为一致
+
+# 为 True 时矩阵运算的结果是 cilly_lazy 的表达式节点, 取值时才计算
+lazy_enabled = False
+
+
+class CillyArray:
+    __slots__ = ('_data', 'base', 'index', 'expr', 'pinned', '__weakref__')
+
+    # base 不为 None 时是 base 的第 index 行的视图, 数据每次从 base 取, base 升级类型后仍然共享
+    def __init__(self, data, base=None, index=None):
+        self._data = data
+        self.base = base
+        self.index = index
+        # 惰性模式下尚未求值的表达式
+        self.expr = None
+        # 数据被未求值的表达式引用着, 下次写元素前先复制一份
+        self.pinned = False
+
+    @property
+    def data(self):
+        if self.base is not None:
+            return self.base.data[self.index]
+        if self.expr is not None:
+            self._data = cilly_lazy.force(self.expr)
+            self.expr = None
+            # 结果也缓存在表达式节点上, 其他表达式可能还引用着它
+            self.pinned = True
+        return self._data
+
+    @property
+    def shape(self):
+        if self.expr is not None:
+            return self.expr.shape
+        return self.data.shape
+
+    @property
+    def dtype(self):
+        if self.expr is not None:
+            return self.expr.dtype
+        return self.data.dtype
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def tolist(self):
+        return self.data.tolist()
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            return self.data
+        return self.data.astype(dtype)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __bool__(self):
+        return self.data.size > 0
+
+    def __getitem__(self, i):
+        v = self.data[i]
+        if type(v) is np.ndarray:
+            return CillyArray(None, self, i)
+        # 写入不同类型的元素后数组变为 object dtype, 元素已是 Python 值
+        return v.item() if isinstance(v, np.generic) else v
+
+    def __setitem__(self, i, value):
+        if type(value) is CillyArray:
+            value = value.data
+        root = self.root()
+        if root.pinned:
+            root._data = root.data.copy()
+            root.pinned = False
+        data = self.data
+        if not fits(data.dtype, value):
+            # 整数矩阵中写入小数等情况, 整个矩阵换成 object, 各元素保持原来的 Python 类型, 打印与列表相同
+            self.upcast(np.dtype(object))
+            data = self.data
+        data[i] = value
+
+    def upcast(self, t):
+        root = self.root()
+        root._data = root.data.astype(t)
+
+    def root(self):
+        a = self
+        while a.base is not None:
+            a = a.base
+        return a
+
+    def __neg__(self):
+        return wrap(-operand(self))
+
+    def __str__(self):
+        return str(self.tolist())
+
+    def __repr__(self):
+        return repr(self.tolist())
+
+
+# value 写进 dtype 的数组后是否仍是同一类值
+def fits(dtype, value):
+    k = dtype.kind
+    if k == 'O':
+        return True
+    if type(value) is np.ndarray or type(value) is list:
+        return np.asarray(value).dtype.kind == k
+    if isinstance(value, (bool, np.bool_)):
+        return k == 'b'
+    if isinstance(value, (int, np.integer)):
+        return k == 'i' or k == 'u'
+    if isinstance(value, (float, np.floating)):
+        return k == 'f'
+    return False
+
+
+# 矩阵、向量运算的操作数: CillyArray 直接取 ndarray, 列表在这里转换, 其余返回 None
+def as_array(x):
+    if type(x) is CillyArray:
+        data = x.data
+        # 写入过其他类型元素的数组, 与列表一样按元素重新推断类型
+        if data.dtype.kind == 'O':
+            return np.array(data.tolist())
+        return data
+    if type(x) is list:
+        return np.array(x)
+    return None
+
+
+# binop 的操作数: 惰性模式下为表达式节点, 否则同 as_array
+def operand(x):
+    if not lazy_enabled:
+        return as_array(x)
+    if type(x) is CillyArray:
+        if x.expr is not None:
+            return x.expr
+        data = as_array(x)
+        x.root().pinned = True
+        return cilly_lazy.leaf(data)
+    if type(x) is list:
+        return cilly_lazy.leaf(np.array(x))
+    return None
+
+
+# binop 操作数的种类
+SCALAR = 0
+VECTOR = 1
+MATRIX = 2
+EMPTY = 3
+
+
+# 返回 (种类, 参与运算的值), 只看类型、形状和第一个元素, 不扫描数据
+# 向量、矩阵的值为 ndarray, 惰性模式下为表达式节点; 标量原样返回
+def classify(x):
+    t = type(x)
+    if t is CillyArray:
+        if x.expr is None and x.base is None and not lazy_enabled:
+            a = x._data
+            if a.dtype.kind == 'O':
+                a = np.array(a.tolist())
+        else:
+            a = operand(x)
+        shape = a.shape
+        if 0 in shape:
+            return EMPTY, a
+        return (VECTOR if len(shape) == 1 else MATRIX), a
+    if t is list:
+        if not x:
+            return EMPTY, None
+        if type(x[0]) is list:
+            if len(x) == 1 and not x[0]:
+                return EMPTY, None
+            return MATRIX, operand(x)
+        return VECTOR, operand(x)
+    return SCALAR, x
+
+
+# 把运算结果(ndarray 或表达式节点)包装成 CillyArray
+def wrap(v):
+    if type(v) is cilly_lazy.Expr:
+        a = CillyArray(None)
+        a.expr = v
+        v.owner = weakref.ref(a)
+        return a
+    return CillyArray(v)
+
+
+def matmul(a, b):
+    if type(a) is cilly_lazy.Expr:
+        return cilly_lazy.dot(a, b)
+    return np.dot(a, b)
+
+
+# 转置得到新的矩阵, 不与原矩阵共享数据
+def transpose(a):
+    if type(a) is cilly_lazy.Expr:
+        return a.T
+    return a.T.copy()
+
+
+def is_array(x):
+    return type(x) is list or type(x) is CillyArray
+
+
+def is_matrix(x):
+    if type(x) is CillyArray:
+        return x.ndim == 2
+    return type(x) is list and type(x[0]) is list
+
+
+def is_square(x):
+    return is_matrix(x) and len(x) == len(x[0])
@@ -0,0 +1,379 @@
+from cilly_parser import *
+
+# 语法树节点种类
+N_PROGRAM = 0
+N_IMPORT = 1
+N_FUN = 2
+N_BLOCK = 3
+N_WHILE = 4
+N_IF = 5
+N_RETURN = 6
+N_BREAK = 7
+N_CONTINUE = 8
+N_PRINT = 9
+N_VAR = 10
+N_ASSIGN = 11
+N_BINOP = 12
+N_UINOP = 13
+N_LOGIC = 14
+N_CALL = 15
+N_BUILTIN = 16
+N_ID = 17
+N_INDEX = 18
+N_NUM = 19
+N_STR = 20
+N_BOOL = 21
+N_TRANS = 22
+N_VEC = 23
+
+NODE_NAMES = [
+    'program', 'import', 'fun', 'block', 'while', 'if', 'return', 'break', 'continue', 'print',
+    'var', 'assign', 'binop', 'uinop', 'logic', 'call', 'builtin', 'id', 'index', 'num', 'str',
+    'bool', 'T', 'vec'
+]
+
+
+# 所有节点都带 span: 源码中的 (起始偏移, 结束偏移), 不是从 TokenBuffer 解析来的为 None
+class Node:
+    __slots__ = ('span',)
+    kind = -1
+
+    def fields(self):
+        return [getattr(self, f) for f in type(self).__slots__]
+
+    def __repr__(self):
+        return f'{type(self).__name__}({", ".join(repr(f) for f in self.fields())})'
+
+
+class Program(Node):
+    __slots__ = ('stmts',)
+    kind = N_PROGRAM
+
+    def __init__(self, stmts, span=None):
+        self.stmts = stmts
+        self.span = span
+
+
+class Import(Node):
+    __slots__ = ('path',)
+    kind = N_IMPORT
+
+    def __init__(self, path, span=None):
+        self.path = path
+        self.span = span
+
+
+class Fun(Node):
+    __slots__ = ('name', 'params', 'body')
+    kind = N_FUN
+
+    def __init__(self, name, params, body, span=None):
+        self.name = name
+        self.params = params
+        self.body = body
+        self.span = span
+
+
+class Block(Node):
+    __slots__ = ('stmts',)
+    kind = N_BLOCK
+
+    def __init__(self, stmts, span=None):
+        self.stmts = stmts
+        self.span = span
+
+
+class While(Node):
+    __slots__ = ('cond', 'body')
+    kind = N_WHILE
+
+    def __init__(self, cond, body, span=None):
+        self.cond = cond
+        self.body = body
+        self.span = span
+
+
+class If(Node):
+    __slots__ = ('cond', 'then', 'orelse')
+    kind = N_IF
+
+    def __init__(self, cond, then, orelse, span=None):
+        self.cond = cond
+        self.then = then
+        self.orelse = orelse
+        self.span = span
+
+
+class Return(Node):
+    __slots__ = ('value',)
+    kind = N_RETURN
+
+    def __init__(self, value, span=None):
+        self.value = value
+        self.span = span
+
+
+class Break(Node):
+    __slots__ = ()
+    kind = N_BREAK
+
+    def __init__(self, span=None):
+        self.span = span
+
+
+class Continue(Node):
+    __slots__ = ()
+    kind = N_CONTINUE
+
+    def __init__(self, span=None):
+        self.span = span
+
+
+class Print(Node):
+    __slots__ = ('args',)
+    kind = N_PRINT
+
+    def __init__(self, args, span=None):
+        self.args = args
+        self.span = span
+
+
+class Var(Node):
+    __slots__ = ('name', 'init')
+    kind = N_VAR
+
+    def __init__(self, name, init, span=None):
+        self.name = name
+        self.init = init
+        self.span = span
+
+
+# target 是 Id 或 Index
+class Assign(Node):
+    __slots__ = ('target', 'value')
+    kind = N_ASSIGN
+
+    def __init__(self, target, value, span=None):
+        self.target = target
+        self.value = value
+        self.span = span
+
+
+class BinOp(Node):
+    __slots__ = ('op', 'left', 'right')
+    kind = N_BINOP
+
+    def __init__(self, op, left, right, span=None):
+        self.op = op
+        self.left = left
+        self.right = right
+        self.span = span
+
+
+# op 为 '-', '!' 或 'frac'(后缀阶乘)
+class UnOp(Node):
+    __slots__ = ('op', 'operand')
+    kind = N_UINOP
+
+    def __init__(self, op, operand, span=None):
+        self.op = op
+        self.operand = operand
+        self.span = span
+
+
+class Logic(Node):
+    __slots__ = ('op', 'left', 'right')
+    kind = N_LOGIC
+
+    def __init__(self, op, left, right, span=None):
+        self.op = op
+        self.left = left
+        self.right = right
+        self.span = span
+
+
+class Call(Node):
+    __slots__ = ('fn', 'args')
+    kind = N_CALL
+
+    def __init__(self, fn, args, span=None):
+        self.fn = fn
+        self.args = args
+        self.span = span
+
+
+# 系统函数调用, 如 input()、det(A)
+class Builtin(Node):
+    __slots__ = ('name', 'args')
+    kind = N_BUILTIN
+
+    def __init__(self, name, args, span=None):
+        self.name = name
+        self.args = args
+        self.span = span
+
+
+class Id(Node):
+    __slots__ = ('name',)
+    kind = N_ID
+
+    def __init__(self, name, span=None):
+        self.name = name
+        self.span = span
+
+
+# 带下标的变量 a[i][j]
+class Index(Node):
+    __slots__ = ('name', 'indexes')
+    kind = N_INDEX
+
+    def __init__(self, name, indexes, span=None):
+        self.name = name
+        self.indexes = indexes
+        self.span = span
+
+
+class Num(Node):
+    __slots__ = ('value',)
+    kind = N_NUM
+
+    def __init__(self, value, span=None):
+        self.value = value
+        self.span = span
+
+
+class Str(Node):
+    __slots__ = ('value',)
+    kind = N_STR
+
+    def __init__(self, value, span=None):
+        self.value = value
+        self.span = span
+
+
+class Bool(Node):
+    __slots__ = ('value',)
+    kind = N_BOOL
+
+    def __init__(self, value, span=None):
+        self.value = value
+        self.span = span
+
+
+# 转置记号 T
+class Trans(Node):
+    __slots__ = ()
+    kind = N_TRANS
+
+    def __init__(self, span=None):
+        self.span = span
+
+
+class Vec(Node):
+    __slots__ = ('items',)
+    kind = N_VEC
+
+    def __init__(self, items, span=None):
+        self.items = items
+        self.span = span
+
+
+# 列表形式的语法树 -> 节点; spans 为 parser() 记录的 {id(列表节点): (起, 止)}, 转换时统一减去 offset
+def from_list(ast, spans=None, offset=0):
+    def span(a):
+        if not spans:
+            return None
+        s = spans.get(id(a))
+        if s is None or offset == 0:
+            return s
+        return s[0] - offset, s[1] - offset
+
+    def conv(a):
+        if a is None:
+            return None
+        if type(a) is tuple:
+            t, (_, pos) = a
+            return Index(tk_val(t), [conv(e) for e in pos], span(a))
+
+        tag = a[0]
+        f = converters.get(tag)
+        if f is not None:
+            return f(a)
+        if len(a) == 3 and tag in ['and', 'or']:
+            return Logic(tag, conv(a[1]), conv(a[2]), span(a))
+        # 系统函数: [name] 或 [name, arg]
+        return Builtin(tag, [conv(e) for e in a[1:]], span(a))
+
+    converters = {
+        'program': lambda a: Program([conv(s) for s in a[1]], span(a)),
+        'import': lambda a: Import(a[1], span(a)),
+        'fun': lambda a: Fun(a[1], a[2], conv(a[3]), span(a)),
+        'block': lambda a: Block([conv(s) for s in a[1]], span(a)),
+        'while': lambda a: While(conv(a[1]), conv(a[2]), span(a)),
+        'if': lambda a: If(conv(a[1]), conv(a[2]), conv(a[3]), span(a)),
+        'return': lambda a: Return(conv(a[1]), span(a)),
+        'break': lambda a: Break(span(a)),
+        'continue': lambda a: Continue(span(a)),
+        'print': lambda a: Print([conv(e) for e in a[1]], span(a)),
+        'var': lambda a: Var(tk_val(a[1]), conv(a[2]), span(a)),
+        'assign': lambda a: Assign(conv(a[1]), conv(a[2]), span(a)),
+        'binop': lambda a: BinOp(a[1], conv(a[2]), conv(a[3]), span(a)),
+        'uinop': lambda a: UnOp(a[1], conv(a[2]), span(a)),
+        'call': lambda a: Call(conv(a[1]), [conv(e) for e in a[2]], span(a)),
+        'id': lambda a: Id(a[1], span(a)),
+        'num': lambda a: Num(a[1], span(a)),
+        'str': lambda a: Str(a[1], span(a)),
+        'true': lambda a: Bool(True, span(a)),
+        'false': lambda a: Bool(False, span(a)),
+        'T': lambda a: Trans(span(a)),
+        'vec': lambda a: Vec([conv(e) for e in a[1]], span(a)),
+    }
+
+    return conv(ast)
+
+
+# 节点 -> 列表形式的语法树, 与 parser() 的输出一致
+def to_list(node):
+    def conv(n):
+        if n is None:
+            return None
+        return converters[n.kind](n)
+
+    def convs(ns):
+        return [conv(n) for n in ns]
+
+    converters = [
+        lambda n: ['program', convs(n.stmts)],
+        lambda n: ['import', n.path],
+        lambda n: ['fun', n.name, n.params, conv(n.body)],
+        lambda n: ['block', convs(n.stmts)],
+        lambda n: ['while', conv(n.cond), conv(n.body)],
+        lambda n: ['if', conv(n.cond), conv(n.then), conv(n.orelse)],
+        lambda n: ['return', conv(n.value)],
+        lambda n: ['break'],
+        lambda n: ['continue'],
+        lambda n: ['print', convs(n.args)],
+        lambda n: ['var', ['id', n.name], conv(n.init)],
+        lambda n: ['assign', conv(n.target), conv(n.value)],
+        lambda n: ['binop', n.op, conv(n.left), conv(n.right)],
+        lambda n: ['uinop', n.op, conv(n.operand)],
+        lambda n: [n.op, conv(n.left), conv(n.right)],
+        lambda n: ['call', conv(n.fn), convs(n.args)],
+        lambda n: [n.name] + convs(n.args),
+        lambda n: ['id', n.name],
+        lambda n: (['id', n.name], ['vec', convs(n.indexes)]),
+        lambda n: ['num', n.value],
+        lambda n: ['str', n.value],
+        lambda n: ['true'] if n.value else ['false'],
+        lambda n: ['T'],
+        lambda n: ['vec', convs(n.items)],
+    ]
+
+    return conv(node)
+
+
+# 源码 -> 带源码位置的节点树
+def parse_ast(prog):
+    spans = {}
+    ast = parser(lex_buffer(prog), spans)
+    return from_list(ast, spans)
@@ -0,0 +1,89 @@
+import marshal
+import os
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from cilly_cache import COMPILER_VERSION, write_atomic
+from cilly_vm_compiler import *
+
+# 批量编译: 把目录下所有 .cilly 文件分给进程池编译
+# 成功时在源文件旁写 .cillyc (marshal 的 (COMPILER_VERSION, code 的字节, consts, glob_syms)), 失败时写 .err
+
+
+def find_sources(directory):
+    files = []
+    for root, dirs, names in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('__'))
+        for name in sorted(names):
+            if name.endswith('.cilly'):
+                files.append(os.path.join(root, name))
+    return files
+
+
+# 产物路径: out_dir 为 None 时写在源文件旁, 否则在 out_dir 下保持相对目录结构
+def artifact_path(path, base, out_dir, ext):
+    stem = os.path.splitext(path)[0]
+    if out_dir is not None:
+        stem = os.path.join(out_dir, os.path.relpath(stem, base))
+    return stem + ext
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# 在子进程中执行: 编译一个文件, 返回 (路径, 错误信息或 None)
+def compile_file(job):
+    path, base, out_dir = job
+    out = artifact_path(path, base, out_dir, '.cillyc')
+    err_out = artifact_path(path, base, out_dir, '.err')
+    try:
+        with open(path, encoding='utf-8') as f:
+            src = f.read()
+        code, consts, glob_syms = cilly_vm_compiler(parser(lexer(src)), [], [], [])
+        data = marshal.dumps((COMPILER_VERSION, code.tobytes(), consts, glob_syms))
+    except Exception as e:
+        msg = f'{path}: {e}'
+        os.makedirs(os.path.dirname(err_out), exist_ok=True)
+        write_atomic(err_out, (msg + '\n').encode('utf-8'))
+        remove_file(out)
+        return path, msg
+
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    write_atomic(out, data)
+    remove_file(err_out)
+    return path, None
+
+
+# 读取 .cillyc, 返回 (code, consts, glob_syms)
+def load_artifact(path):
+    with open(path, 'rb') as f:
+        version, code, consts, glob_syms = marshal.loads(f.read())
+    if version != COMPILER_VERSION:
+        error('cilly batch', f'{path} 由其他版本的编译器生成')
+    return array('i', code), consts, glob_syms
+
+
+# 返回 (文件数, 失败的 [(路径, 错误信息)], 耗时秒数)
+def compile_batch(directory, jobs=None, out_dir=None):
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    files = find_sources(directory)
+    work = [(path, directory, out_dir) for path in files]
+
+    start = time.perf_counter()
+    if jobs <= 1 or len(files) <= 1:
+        results = [compile_file(w) for w in work]
+    else:
+        # 每个进程一次取一批, 减少进程间通信的开销
+        chunk = max(1, len(work) // (jobs * 8))
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(compile_file, work, chunksize=chunk))
+    wall = time.perf_counter() - start
+
+    failed = [(path, msg) for path, msg in results if msg is not None]
+    return len(files), failed, wall
@@ -0,0 +1,193 @@
+import gc
+import hashlib
+import marshal
+import os
+from array import array
+from cilly_vm_compiler import *
+import cilly_fold
+
+# 编译缓存: 类似 __pycache__, 把语法树和 (code, consts, glob_syms) 序列化到源文件旁的 __cillycache__ 目录
+# 缓存键为 源码内容的 sha256 + 编译器版本, 源码或编译器版本变化都会换一个键
+
+# 语法树或字节码格式变化时递增, 使旧缓存失效
+COMPILER_VERSION = 8
+
+CACHE_DIR = '__cillycache__'
+# 缓存目录大小上限, 超出后按最近使用时间(mtime)淘汰
+CACHE_LIMIT = 32 * 1024 * 1024
+STATS_FILE = 'stats'
+
+# 本进程内的统计, 同时累加到缓存目录下的 stats 文件
+cache_stats = {'hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0, 'errors': 0}
+
+# 为 False 时不读写缓存, 总是重新编译
+cache_enabled = True
+
+
+def cache_dir(filename):
+    return os.path.join(os.path.dirname(os.path.abspath(filename)), CACHE_DIR)
+
+
+# 字节码在编译时做过常量折叠, 关闭折叠(-no-fold)时换一个键
+def cache_key(src):
+    h = hashlib.sha256(f'cilly {COMPILER_VERSION} {cilly_fold.fold_enabled}\n'.encode())
+    h.update(src.encode('utf-8'))
+    return h.hexdigest()
+
+
+# 读取源文件, 返回源码文本
+def read_source(filename):
+    with open(filename, encoding='utf-8') as f:
+        return f.read()
+
+
+def count(name, directory):
+    cache_stats[name] = cache_stats[name] + 1
+    path = os.path.join(directory, STATS_FILE)
+    try:
+        with open(path, 'rb') as f:
+            stats = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        stats = {}
+    stats[name] = stats.get(name, 0) + 1
+    try:
+        write_atomic(path, marshal.dumps(stats))
+    except OSError:
+        pass
+
+
+# 语法树是大量没有循环引用的小列表, 反序列化期间暂停分代回收
+def load_file(path):
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        with open(path, 'rb') as f:
+            return marshal.loads(f.read())
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def write_atomic(path, data):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+# 缓存目录超过 limit 字节时, 从最久未使用的条目开始删除
+def evict(directory, limit=None):
+    if limit is None:
+        limit = CACHE_LIMIT
+
+    entries = []
+    total = 0
+    for name in os.listdir(directory):
+        if name == STATS_FILE or name.endswith('.tmp'):
+            continue
+        try:
+            st = os.stat(os.path.join(directory, name))
+        except OSError:
+            continue
+        entries.append((st.st_mtime_ns, st.st_size, name))
+        total = total + st.st_size
+
+    entries.sort()
+    removed = 0
+    for _, size, name in entries:
+        if total <= limit:
+            break
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            continue
+        total = total - size
+        removed = removed + 1
+
+    for _ in range(removed):
+        count('evictions', directory)
+    return removed
+
+
+# 取缓存, 没有则调用 build() 生成并写入; kind 区分同一份源码的不同产物('ast', 'vm')
+def cached(src, filename, kind, build):
+    if not cache_enabled:
+        return build()
+
+    directory = cache_dir(filename)
+    path = os.path.join(directory, f'{cache_key(src)}.{kind}')
+    try:
+        version, k, value = load_file(path)
+        if version == COMPILER_VERSION and k == kind:
+            # 更新 mtime, 作为最近使用时间
+            os.utime(path)
+            count('hits', directory)
+            return value
+    except FileNotFoundError:
+        pass
+    except (OSError, EOFError, ValueError, TypeError):
+        # 损坏的缓存文件, 当作未命中并覆盖
+        if os.path.isdir(directory):
+            count('errors', directory)
+
+    value = build()
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError:
+        pass
+    count('misses', directory)
+    try:
+        write_atomic(path, marshal.dumps((COMPILER_VERSION, kind, value)))
+        count('writes', directory)
+        evict(directory)
+    except OSError:
+        # 缓存目录不可写时照常运行
+        pass
+    return value
+
+
+# 列表形式的语法树
+# 不用缓存时不需要整个源码来算键, 与原来一样边读文件边解析, 内存占用不随文件长度增长
+def load_ast(filename, src=None):
+    if src is None and not cache_enabled:
+        with open(filename, encoding='utf-8') as f:
+            return parser(iter_tokens(f))
+    if src is None:
+        src = read_source(filename)
+    return cached(src, filename, 'ast', lambda: parser(lexer(src)))
+
+
+# 虚拟机的 (code, consts, glob_syms)
+def load_code(filename, src=None):
+    if src is None and cache_enabled:
+        src = read_source(filename)
+
+    # marshal 不支持 array, 字节码按原始字节存
+    def build():
+        code, consts, glob_syms = cilly_vm_compiler(load_ast(filename, src), [], [], [])
+        return code.tobytes(), consts, glob_syms
+
+    code, consts, glob_syms = cached(src, filename, 'vm', build)
+    return array('i', code), consts, glob_syms
+
+
+# 缓存目录的累计统计
+def read_stats(directory):
+    stats = {'hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0, 'errors': 0}
+    try:
+        with open(os.path.join(directory, STATS_FILE), 'rb') as f:
+            stats.update(marshal.load(f))
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    entries = 0
+    size = 0
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name == STATS_FILE or name.endswith('.tmp'):
+                continue
+            entries = entries + 1
+            size = size + os.path.getsize(os.path.join(directory, name))
+    stats['entries'] = entries
+    stats['bytes'] = size
+    return stats
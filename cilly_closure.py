@@ -0,0 +1,516 @@
+import operator
+from cilly_interpreter import *
+from cilly_resolver import *
+import cilly_fold
+import cilly_memo
+
+# 闭包编译执行引擎: 把语法树一次性编译成嵌套的 Python 闭包, 每个节点一个, 子节点预先绑定
+# 变量经 cilly_resolver 解析为 (depth, slot), 局部变量存在定长列表的函数帧里, 全局变量存在传入的 dict 里
+# 闭包的运行参数是当前函数帧, 顶层代码的帧为 None
+# 函数内对外层变量的赋值直接写进外层帧, 调用结束后不需要把环境写回
+
+# 两个操作数都是这些类型时, binop() 的结果就是 Python 运算符本身; 字符串拼接可能得到 Rope, 交给 binop()
+SCALAR_TYPES = {int, float, bool}
+
+FAST_BINOPS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+    '^': operator.xor,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+
+
+# 函数值: frame 为定义时所在的帧, size 为调用时新建帧的长度
+class Closure:
+    __slots__ = ('name', 'params', 'size', 'body', 'frame', 'memo')
+
+    def __init__(self, name, params, size, body, frame, memo=None):
+        self.name = name
+        self.params = params
+        self.size = size
+        self.body = body
+        self.frame = frame
+        # 纯函数的记忆化缓存(cilly_memo.MemoCache), 不记忆化时为 None
+        self.memo = memo
+
+    def __repr__(self):
+        return f'<fun {self.name}>'
+
+
+# 编译期上下文: 解析结果、全局变量 dict, 以及执行被导入模块的引擎 run(语法树, 环境)
+class Context:
+    __slots__ = ('res', 'globs', 'run')
+
+    def __init__(self, res, globs, run):
+        self.res = res
+        self.globs = globs
+        self.run = run
+
+
+# 编译整个程序, 返回无参函数, 调用即在 envir 中执行
+def compile_ast(ast, envir):
+    if not isinstance(ast, Node):
+        ast = from_list(ast)
+    ast = cilly_fold.fold(ast)
+    if cilly_memo.memo_enabled:
+        cilly_memo.analyze(ast)
+    code = compile_node(ast, Context(resolve(ast), envir, execute))
+    return lambda: code(None)
+
+
+def execute(ast, envir):
+    return compile_ast(ast, envir)()
+
+
+def compile_node(node, ctx):
+    return COMPILERS[node.kind](node, ctx)
+
+
+def compile_nodes(nodes, ctx):
+    return [compile_node(n, ctx) for n in nodes]
+
+
+# 全局变量未定义; 也是函数帧中变量槽的初值, 表示对应的 var/fun 还没有执行
+UNBOUND = object()
+
+
+# 顶层 import 的模块中定义 name 的模块环境, 都没有时报错
+def global_module(g, name):
+    m = module_owner(g, name)
+    if m is None:
+        err(f'unbound variable{name}')
+    return m
+
+
+def outer_frame(frame, depth):
+    for _ in range(depth):
+        frame = frame[0]
+    return frame
+
+
+def load_global(name, g):
+    def run(frame):
+        v = g.get(name, UNBOUND)
+        if v is UNBOUND:
+            return global_module(g, name)[name]
+        return v
+    return run
+
+
+# 查找链中的一步: 变量槽已定义时读它, 模块列表中有 name 时读模块变量, 否则交给 nxt
+def load_step(depth, slot, module, name, nxt):
+    if module:
+        def run(frame):
+            mods = outer_frame(frame, depth)[slot]
+            if mods is not UNBOUND:
+                for m in mods:
+                    if name in m:
+                        return m[name]
+            return nxt(frame)
+        return run
+
+    if depth == 0:
+        def run(frame):
+            v = frame[slot]
+            if v is UNBOUND:
+                return nxt(frame)
+            return v
+        return run
+
+    def run(frame):
+        v = outer_frame(frame, depth)[slot]
+        if v is UNBOUND:
+            return nxt(frame)
+        return v
+    return run
+
+
+# 按解析出的地址读变量
+def compile_load(node, ctx):
+    name = node.name
+    chain = ctx.res.chains.get(node)
+    if chain is not None:
+        run = load_global(name, ctx.globs)
+        for depth, slot, module in reversed(chain):
+            run = load_step(depth, slot, module, name, run)
+        return run
+
+    addr = ctx.res.addrs[node]
+    if addr is None:
+        return load_global(name, ctx.globs)
+
+    depth, slot = addr
+    if depth == 0:
+        return lambda frame: frame[slot]
+    if depth == 1:
+        return lambda frame: frame[0][slot]
+    if depth == 2:
+        return lambda frame: frame[0][0][slot]
+    return lambda frame: outer_frame(frame, depth)[slot]
+
+
+def store_global(name, g):
+    def store(frame, value):
+        if name in g:
+            g[name] = value
+        else:
+            global_module(g, name)[name] = value
+    return store
+
+
+def store_step(depth, slot, module, name, nxt):
+    if module:
+        def store(frame, value):
+            mods = outer_frame(frame, depth)[slot]
+            if mods is not UNBOUND:
+                for m in mods:
+                    if name in m:
+                        m[name] = value
+                        return
+            nxt(frame, value)
+        return store
+
+    def store(frame, value):
+        f = outer_frame(frame, depth)
+        if f[slot] is UNBOUND:
+            nxt(frame, value)
+        else:
+            f[slot] = value
+    return store
+
+
+# 按解析出的地址写变量, 返回 store(frame, value); checked 为 True 时为赋值, 变量必须已定义, 否则为 var/fun 定义
+def compile_store(node, ctx, checked):
+    name = node.name
+    g = ctx.globs
+    chain = ctx.res.chains.get(node) if checked else None
+    if chain is not None:
+        store = store_global(name, g)
+        for depth, slot, module in reversed(chain):
+            store = store_step(depth, slot, module, name, store)
+        return store
+
+    addr = ctx.res.addrs[node]
+    if addr is None:
+        if checked:
+            return store_global(name, g)
+
+        def store(frame, value):
+            g[name] = value
+        return store
+
+    depth, slot = addr
+    if depth == 0:
+        def store(frame, value):
+            frame[slot] = value
+        return store
+
+    def store(frame, value):
+        outer_frame(frame, depth)[slot] = value
+    return store
+
+
+def compile_program(node, ctx):
+    stmts = compile_nodes(node.stmts, ctx)
+
+    def run(frame):
+        for s in stmts:
+            ret = s(frame)
+            if type(ret) is ReturnValue:
+                return ret.value
+        return ""
+    return run
+
+
+def compile_import(node, ctx):
+    path = node.path
+    engine = ctx.run
+    addr = ctx.res.addrs[node]
+    if addr is None:
+        g = ctx.globs
+
+        def run(frame):
+            attach_module(load_module(path, engine), g)
+            return None
+        return run
+
+    slot = addr[1]
+
+    def run(frame):
+        module = load_module(path, engine)
+        mods = frame[slot]
+        if mods is UNBOUND:
+            frame[slot] = [module]
+        elif all(m is not module for m in mods):
+            mods.append(module)
+        return None
+    return run
+
+
+def compile_fun(node, ctx):
+    name = node.name
+    params = node.params
+    size = ctx.res.frames[node]
+    body = compile_node(node.body, ctx)
+    store = compile_store(node, ctx, False)
+
+    def run(frame):
+        store(frame, Closure(name, params, size, body, frame, cilly_memo.new_cache(node)))
+        return None
+    return run
+
+
+def compile_block(node, ctx):
+    stmts = compile_nodes(node.stmts, ctx)
+
+    def run(frame):
+        for s in stmts:
+            ret = s(frame)
+            if type(ret) is ReturnValue:
+                return ret
+        return None
+    return run
+
+
+def compile_while(node, ctx):
+    cond = compile_node(node.cond, ctx)
+    body = compile_node(node.body, ctx)
+
+    def run(frame):
+        while cond(frame):
+            ret = body(frame)
+            if type(ret) is ReturnValue:
+                return ret
+        return None
+    return run
+
+
+def compile_if(node, ctx):
+    cond = compile_node(node.cond, ctx)
+    then = compile_node(node.then, ctx)
+    if node.orelse is None:
+        def run(frame):
+            if cond(frame) == True:
+                return then(frame)
+            return None
+        return run
+
+    orelse = compile_node(node.orelse, ctx)
+
+    def run(frame):
+        if cond(frame) == True:
+            return then(frame)
+        return orelse(frame)
+    return run
+
+
+def compile_return(node, ctx):
+    if node.value is None:
+        return lambda frame: ReturnValue(None)
+    value = compile_node(node.value, ctx)
+    return lambda frame: ReturnValue(value(frame))
+
+
+def compile_print(node, ctx):
+    args = compile_nodes(node.args, ctx)
+
+    def run(frame):
+        print(' '.join([str(a(frame)) for a in args]))
+        return None
+    return run
+
+
+def compile_var(node, ctx):
+    store = compile_store(node, ctx, False)
+    if node.init is None:
+        def run(frame):
+            store(frame, None)
+            return None
+        return run
+
+    init = compile_node(node.init, ctx)
+
+    def run(frame):
+        store(frame, init(frame))
+        return None
+    return run
+
+
+# 按下标取值, 出错时与 check_variable 一样报告
+def get_item(element, pos):
+    try:
+        for x in pos[:-1]:
+            element = element[x]
+        return element[pos[-1]]
+    except Exception as e:
+        err(e)
+
+
+def compile_assign(node, ctx):
+    var = node.target
+    value = compile_node(node.value, ctx)
+
+    if var.kind == N_ID:
+        store = compile_store(var, ctx, True)
+
+        def run(frame):
+            store(frame, value(frame))
+            return None
+        return run
+
+    if var.kind == N_INDEX:
+        load = compile_load(var, ctx)
+        indexes = compile_nodes(var.indexes, ctx)
+
+        def run(frame):
+            pos = [e(frame) for e in indexes]
+            element = load(frame)
+            get_item(element, pos)
+            v = value(frame)
+            for x in pos[:-1]:
+                element = element[x]
+            element[pos[-1]] = v
+            return None
+        return run
+
+    def run(frame):
+        err(f'{var} is not a legal var')
+    return run
+
+
+def compile_binop(node, ctx):
+    op = node.op
+    left = compile_node(node.left, ctx)
+    right = compile_node(node.right, ctx)
+    f = FAST_BINOPS.get(op)
+    if f is None:
+        return lambda frame: binop(op, left(frame), right(frame))
+
+    def run(frame):
+        a = left(frame)
+        b = right(frame)
+        if type(a) in SCALAR_TYPES and type(b) in SCALAR_TYPES:
+            return f(a, b)
+        return binop(op, a, b)
+    return run
+
+
+def compile_uinop(node, ctx):
+    op = node.op
+    operand = compile_node(node.operand, ctx)
+    if op == '-':
+        return lambda frame: -operand(frame)
+    if op == '!':
+        return lambda frame: not operand(frame)
+    return lambda frame: uinop(op, operand(frame))
+
+
+def compile_call(node, ctx):
+    fn = compile_node(node.fn, ctx)
+    args = compile_nodes(node.args, ctx)
+    n = len(args)
+
+    def run(frame):
+        f = fn(frame)
+        if type(f) is not Closure:
+            err(f'{f} is not a function')
+
+        new_frame = [UNBOUND] * f.size
+        new_frame[0] = f.frame
+        # 与 eval 一致, 实参与形参个数不同时按较少的一方对应, 缺少的参数未定义
+        k = min(n, len(f.params))
+        for i in range(k):
+            new_frame[i + 1] = args[i](frame)
+        for i in range(k, n):
+            args[i](frame)
+
+        memo = f.memo
+        if memo is not None:
+            key = cilly_memo.memo_key(new_frame[1:k + 1])
+            if key is not None:
+                value = memo.get(key)
+                if value is not cilly_memo.MISSING:
+                    return value
+
+        ret = f.body(new_frame)
+        value = ret.value if type(ret) is ReturnValue else None
+        if memo is not None and key is not None:
+            cilly_memo.store(memo, key, value)
+        return value
+    return run
+
+
+def compile_builtin(node, ctx):
+    f = BUILTINS.get(node.name)
+    if f is None:
+        return compile_illegal(node, ctx)
+
+    args = compile_nodes(node.args, ctx)
+    if len(args) == 0:
+        return lambda frame: f()
+    if len(args) == 1:
+        a = args[0]
+        return lambda frame: f(a(frame))
+    return lambda frame: f(*[a(frame) for a in args])
+
+
+def compile_id(node, ctx):
+    return compile_load(node, ctx)
+
+
+def compile_index(node, ctx):
+    load = compile_load(node, ctx)
+    indexes = compile_nodes(node.indexes, ctx)
+    return lambda frame: get_item(load(frame), [e(frame) for e in indexes])
+
+
+def compile_literal(node, ctx):
+    value = node.value
+    return lambda frame: value
+
+
+def compile_trans(node, ctx):
+    return lambda frame: 'T'
+
+
+def compile_vec(node, ctx):
+    items = compile_nodes(node.items, ctx)
+    return lambda frame: [e(frame) for e in items]
+
+
+# 与 eval 一致: 不支持的节点在执行到时才报错
+def compile_illegal(node, ctx):
+    def run(frame):
+        err(f'illegal expression{node}')
+    return run
+
+
+COMPILERS = [compile_illegal] * len(NODE_NAMES)
+COMPILERS[N_PROGRAM] = compile_program
+COMPILERS[N_IMPORT] = compile_import
+COMPILERS[N_FUN] = compile_fun
+COMPILERS[N_BLOCK] = compile_block
+COMPILERS[N_WHILE] = compile_while
+COMPILERS[N_IF] = compile_if
+COMPILERS[N_RETURN] = compile_return
+COMPILERS[N_PRINT] = compile_print
+COMPILERS[N_VAR] = compile_var
+COMPILERS[N_ASSIGN] = compile_assign
+COMPILERS[N_BINOP] = compile_binop
+COMPILERS[N_UINOP] = compile_uinop
+COMPILERS[N_CALL] = compile_call
+COMPILERS[N_BUILTIN] = compile_builtin
+COMPILERS[N_ID] = compile_id
+COMPILERS[N_INDEX] = compile_index
+COMPILERS[N_NUM] = compile_literal
+COMPILERS[N_STR] = compile_literal
+COMPILERS[N_BOOL] = compile_literal
+COMPILERS[N_TRANS] = compile_trans
+COMPILERS[N_VEC] = compile_vec
@@ -0,0 +1,267 @@
+from cilly_ast import *
+import cilly_interpreter
+from cilly_string import text
+
+# 常量折叠与部分求值: 各执行引擎(eval、closure、stack、vm)在执行或编译前共用的一遍语法树改写
+#   操作数都是字面量的二元、一元运算(含阶乘)直接算出结果, 运算用 cilly_interpreter 的 binop/uinop, 语义与 eval 相同
+#   条件为 true/false 的 if 只保留会执行的分支, 条件为 false 的 while 整条删除, return 之后执行不到的语句删除
+#   删除的语句中有声明(var、fun)时不删除, 这些名字仍在作用域中, 删除后变量解析的结果会变
+#   只折叠虚拟机也实现了的运算, 否则折叠会把虚拟机的编译错误变成一个值
+# 新节点沿用被折叠节点的 span, 报错位置仍指向原来的源码; 没有变化的子树原样复用, 不复制
+# 运算出错(如除以 0)的表达式不折叠, 留到运行时按原样报错
+
+fold_enabled = True
+
+# 累计统计, 由 -fold-report 打印
+fold_stats = {'programs': 0, 'nodes': 0, 'removed': 0, 'folded': 0, 'pruned': 0}
+
+LITERAL_KINDS = {N_NUM, N_STR, N_BOOL}
+
+# cilly_vm_compiler 能编译的运算符
+FOLD_BINOPS = {'+', '-', '*', '/', '<', '<=', '>', '>=', '==', '!=', '^'}
+FOLD_UINOPS = {'-', '!', 'frac'}
+
+# 折叠结果的大小上限, 超出的留到运行时计算, 避免编译时算出巨大的数或字符串
+MAX_FACTORIAL = 1000
+MAX_STR = 4096
+
+
+def fold(ast):
+    if not fold_enabled:
+        return ast
+    before = count_nodes(ast)
+    ast = fold_stmt(ast)
+    if ast is None:
+        ast = Program([])
+    removed = before - count_nodes(ast)
+    fold_stats['programs'] += 1
+    fold_stats['nodes'] += before
+    fold_stats['removed'] += removed
+    return ast
+
+
+def count_nodes(node):
+    if not isinstance(node, Node):
+        return 0
+    n = 1
+    for f in node.fields():
+        if isinstance(f, Node):
+            n += count_nodes(f)
+        elif type(f) is list:
+            for e in f:
+                n += count_nodes(e)
+    return n
+
+
+# 数、字符串、布尔字面量
+def is_literal(node):
+    return node is not None and node.kind in LITERAL_KINDS
+
+
+# 各引擎对非布尔条件的判断不同(eval 看 == True, 虚拟机只认布尔值), 只按 true/false 字面量删除分支
+def is_bool(node):
+    return node is not None and node.kind == N_BOOL
+
+
+# 把运算结果变回字面量节点, 结果不是简单的标量时返回 None
+def literal(value, span):
+    value = text(value)
+    t = type(value)
+    if t is bool:
+        return Bool(value, span)
+    if t is int or t is float:
+        return Num(value, span)
+    if t is str and len(value) <= MAX_STR:
+        return Str(value, span)
+    return None
+
+
+def try_fold(f, span):
+    try:
+        value = f()
+    except Exception:
+        return None
+    node = literal(value, span)
+    if node is not None:
+        fold_stats['folded'] += 1
+    return node
+
+
+# 改写列表中的每个元素, 都没变时返回原列表
+def fold_list(items, f):
+    out = [f(e) for e in items]
+    if all(a is b for a, b in zip(out, items)):
+        return items
+    return out
+
+
+def fold_expr(node):
+    if node is None:
+        return None
+    k = node.kind
+    if k == N_BINOP:
+        left = fold_expr(node.left)
+        right = fold_expr(node.right)
+        if node.op in FOLD_BINOPS and is_literal(left) and is_literal(right):
+            r = try_fold(lambda: cilly_interpreter.binop(node.op, left.value, right.value), node.span)
+            if r is not None:
+                return r
+        if left is node.left and right is node.right:
+            return node
+        return BinOp(node.op, left, right, node.span)
+
+    if k == N_UINOP:
+        operand = fold_expr(node.operand)
+        # 非布尔值取反时 eval 看真假, 虚拟机只认 true, 只折叠布尔字面量
+        if node.op in FOLD_UINOPS and (is_bool(operand) if node.op == '!' else is_literal(operand)):
+            v = operand.value
+            if node.op != 'frac' or (type(v) is int and v <= MAX_FACTORIAL):
+                r = try_fold(lambda: cilly_interpreter.uinop(node.op, v), node.span)
+                if r is not None:
+                    return r
+        if operand is node.operand:
+            return node
+        return UnOp(node.op, operand, node.span)
+
+    if k == N_CALL:
+        fn = fold_expr(node.fn)
+        args = fold_list(node.args, fold_expr)
+        if fn is node.fn and args is node.args:
+            return node
+        return Call(fn, args, node.span)
+    if k == N_BUILTIN:
+        args = fold_list(node.args, fold_expr)
+        return node if args is node.args else Builtin(node.name, args, node.span)
+    if k == N_VEC:
+        items = fold_list(node.items, fold_expr)
+        return node if items is node.items else Vec(items, node.span)
+    if k == N_INDEX:
+        indexes = fold_list(node.indexes, fold_expr)
+        return node if indexes is node.indexes else Index(node.name, indexes, node.span)
+    if k == N_LOGIC:
+        left = fold_expr(node.left)
+        right = fold_expr(node.right)
+        if left is node.left and right is node.right:
+            return node
+        return Logic(node.op, left, right, node.span)
+    return node
+
+
+# 语句之后的语句是否一定执行不到
+def always_returns(node):
+    if node is None:
+        return False
+    k = node.kind
+    if k == N_RETURN:
+        return True
+    if k == N_BLOCK:
+        return any(always_returns(s) for s in node.stmts)
+    if k == N_IF:
+        return always_returns(node.then) and always_returns(node.orelse)
+    return False
+
+
+# 语句中是否有声明(var、fun), 包括代码块、if、while 里的, 不进入函数体
+def declares(node):
+    if node is None:
+        return False
+    k = node.kind
+    if k == N_VAR or k == N_FUN:
+        return True
+    if k == N_BLOCK or k == N_PROGRAM:
+        return any(declares(s) for s in node.stmts)
+    if k == N_WHILE:
+        return declares(node.body)
+    if k == N_IF:
+        return declares(node.then) or declares(node.orelse)
+    return False
+
+
+# 改写语句列表: 删除空语句和 return 之后的语句
+# 执行不到的语句中有声明时保留整段
+def fold_stmts(stmts):
+    out = []
+    for i, s in enumerate(stmts):
+        s = fold_stmt(s)
+        if s is None:
+            if stmts[i] is not None:
+                fold_stats['pruned'] += 1
+            continue
+        out.append(s)
+        if always_returns(s):
+            rest = stmts[i + 1:]
+            if rest and not any(declares(r) for r in rest):
+                fold_stats['pruned'] += sum(1 for r in rest if r is not None)
+                break
+            out.extend(fold_stmt(r) for r in rest)
+            out = [r for r in out if r is not None]
+            break
+    if len(out) == len(stmts) and all(a is b for a, b in zip(out, stmts)):
+        return stmts
+    return out
+
+
+# 作为 if/while 的分支时不能删掉, 换成空语句块
+def fold_body(node):
+    r = fold_stmt(node)
+    if r is None and node is not None:
+        return Block([], node.span)
+    return r
+
+
+# 返回改写后的语句, 语句整条删除时返回 None
+def fold_stmt(node):
+    if node is None:
+        return None
+    k = node.kind
+    if k == N_PROGRAM or k == N_BLOCK:
+        stmts = fold_stmts(node.stmts)
+        if stmts is node.stmts:
+            return node
+        return type(node)(stmts, node.span)
+
+    if k == N_IF:
+        cond = fold_expr(node.cond)
+        if is_bool(cond) and not declares(node.orelse if cond.value else node.then):
+            fold_stats['pruned'] += 1
+            if cond.value:
+                return fold_stmt(node.then)
+            return fold_stmt(node.orelse)
+        then = fold_body(node.then)
+        orelse = fold_stmt(node.orelse)
+        if cond is node.cond and then is node.then and orelse is node.orelse:
+            return node
+        return If(cond, then, orelse, node.span)
+
+    if k == N_WHILE:
+        cond = fold_expr(node.cond)
+        if is_bool(cond) and not cond.value and not declares(node.body):
+            fold_stats['pruned'] += 1
+            return None
+        body = fold_body(node.body)
+        if cond is node.cond and body is node.body:
+            return node
+        return While(cond, body, node.span)
+
+    if k == N_FUN:
+        body = fold_body(node.body)
+        return node if body is node.body else Fun(node.name, node.params, body, node.span)
+    if k == N_RETURN:
+        value = fold_expr(node.value)
+        return node if value is node.value else Return(value, node.span)
+    if k == N_PRINT:
+        args = fold_list(node.args, fold_expr)
+        return node if args is node.args else Print(args, node.span)
+    if k == N_VAR:
+        init = fold_expr(node.init)
+        return node if init is node.init else Var(node.name, init, node.span)
+    if k == N_ASSIGN:
+        target = fold_expr(node.target)
+        value = fold_expr(node.value)
+        if target is node.target and value is node.value:
+            return node
+        return Assign(target, value, node.span)
+    if k == N_IMPORT or k == N_BREAK or k == N_CONTINUE:
+        return node
+    # 表达式语句
+    return fold_expr(node)
@@ -0,0 +1,122 @@
+from bisect import bisect_right
+from cilly_ast import *
+
+
+# 把一段源码切成顶层语句段, 返回 (各段文本, 各段记号, 各段节点, 末尾剩余的空白)
+# 每段是语句前的空白加上语句本身, 段内记号偏移和节点 span 都相对于段起点
+def parse_segments(text):
+    buf = lex_buffer(text)
+    spans = {}
+    ast = parser(buf, spans)
+
+    texts = []
+    bufs = []
+    nodes = []
+    starts = buf.starts
+    prev = 0
+    i = 0
+    for s in ast[1]:
+        # 空语句就是一个 ';'
+        end = spans[id(s)][1] if s is not None else buf.ends[i]
+        j = bisect_right(starts, end - 1, i)
+        seg = text[prev:end]
+        texts.append(seg)
+        bufs.append(buf.sub(i, j, prev, seg))
+        nodes.append(from_list(s, spans, prev))
+        prev = end
+        i = j
+
+    return texts, bufs, nodes, text[prev:]
+
+
+# 增量解析的文档: 按顶层语句分段保存记号和语法树
+# 编辑时只重新分析受影响的几段, 其余段连同记号和节点原样复用
+# 第 i 段覆盖 source[starts[i]:starts[i] + len(texts[i])], 段内偏移相对于 starts[i]
+class Document:
+    __slots__ = ('source', 'starts', 'texts', 'buffers', 'nodes', 'error')
+
+    def __init__(self, source=''):
+        self.source = ''
+        self.starts = []
+        self.texts = []
+        self.buffers = []
+        self.nodes = []
+        self.error = None
+        self.edit(0, 0, source)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    # 整个文档的语法树, 各语句节点的 span 相对于所在段
+    def ast(self):
+        if self.error is not None:
+            error('cilly incremental', self.error)
+        return Program(list(self.nodes))
+
+    # 偏移所在的段号
+    def segment(self, offset):
+        return max(bisect_right(self.starts, offset) - 1, 0)
+
+    # 段内 span -> 整个文档中的 span
+    def span(self, i, span):
+        return span[0] + self.starts[i], span[1] + self.starts[i]
+
+    # 把 source[start:end] 替换为 text, 返回被重新解析的段号范围 (lo, hi)
+    # 解析失败时文档仍然接受这次编辑, 出错位置到文末合并为一个无节点的段, 错误信息记在 error 中
+    def edit(self, start, end, text):
+        src = self.source
+        if not 0 <= start <= end <= len(src):
+            error('cilly incremental', f'编辑范围越界{start}, {end}')
+
+        starts = self.starts
+        n = len(starts)
+        delta = len(text) - (end - start)
+        new_src = src[:start] + text + src[end:]
+
+        # 从编辑起点所在段的前一段(可能被 else 接上)开始, 到编辑终点所在段为止
+        lo = max(bisect_right(starts, start) - 2, 0)
+        hi = min(bisect_right(starts, end), n)
+        # 已有错误时出错段一直在文末, 需要一起重新解析
+        if self.error is not None:
+            hi = n
+
+        step = 1
+        a = starts[lo] if lo < n else 0
+        while True:
+            b = starts[hi] if hi < n else len(src)
+            region = new_src[a:b + delta]
+            try:
+                texts, bufs, nodes, rest = parse_segments(region)
+            except Exception as e:
+                # 可能是未闭合的字符串或代码块, 向后扩大范围重试
+                if hi < n:
+                    hi = min(hi + step, n)
+                    step = step * 2
+                    continue
+                texts, bufs, nodes, rest = [region], [None], [None], ''
+                self.error = str(e)
+                break
+
+            # 末尾的空白要并入下一段
+            if rest and hi < n:
+                hi = min(hi + step, n)
+                step = step * 2
+                continue
+            if hi == n:
+                self.error = None
+            break
+
+        new_starts = []
+        p = a
+        for t in texts:
+            new_starts.append(p)
+            p = p + len(t)
+        starts[lo:hi] = new_starts
+        for i in range(lo + len(new_starts), len(starts)):
+            starts[i] = starts[i] + delta
+
+        self.texts[lo:hi] = texts
+        self.buffers[lo:hi] = bufs
+        self.nodes[lo:hi] = nodes
+        self.source = new_src
+        return lo, lo + len(nodes)
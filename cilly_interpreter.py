@@ -1,348 +1,564 @@
 # import argparse
+import operator
+import os
 import numpy as np
-from cilly_parser import *
-from collections import ChainMap
+from cilly_ast import *
+from cilly_array import *
+from cilly_string import *
+from cilly_io import load_matrix, save_matrix
+import cilly_cache
+import cilly_fold
+import cilly_memo
+from cilly_resolver import IMPORT_NAME
+
+
+# 模块注册表: (绝对路径, 执行引擎) -> (mtime_ns, size, 模块环境), 每个文件在进程内每个引擎只求值一次
+# 各引擎的函数值表示不同, 所以按引擎分开登记
+modules = {}
+# 正在加载的模块路径, 用于检测循环导入
+loading = []
+
+
+# 函数返回值, 沿着代码块、循环一路传回到函数调用处
+class ReturnValue:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+# 环境: 每次函数调用一个 Env, vars 为本层的变量, parent 为函数定义处的环境
+# 对外层变量的赋值直接写进拥有它的那一层, 外层与内层共享同一份绑定, 调用结束后不需要写回
+class Env:
+    __slots__ = ('vars', 'parent', 'modules')
+
+    def __init__(self, vars, parent):
+        self.vars = vars
+        self.parent = parent
+        # 本层 import 的模块环境, 在本层变量之后、外层变量之前查找
+        self.modules = None
+
+    # 找到定义 name 的那一层的 dict, 没有则返回 None
+    def owner(self, name):
+        e = self
+        while e is not None:
+            if name in e.vars:
+                return e.vars
+            if e.modules is not None:
+                for m in e.modules:
+                    if name in m:
+                        return m
+            e = e.parent
+        return None
+
+    def __getitem__(self, name):
+        e = self
+        while e is not None:
+            v = e.vars
+            if name in v:
+                return v[name]
+            if e.modules is not None:
+                for m in e.modules:
+                    if name in m:
+                        return m[name]
+            e = e.parent
+        err(f'unbound variable{name}')
+
+    def __contains__(self, name):
+        return self.owner(name) is not None
 
+    # 定义变量, 总是在本层
+    def __setitem__(self, name, value):
+        self.vars[name] = value
 
-# 定义求值函数
+
+
+# 定义求值函数, expression 可以是节点, 也可以是 parser() 输出的列表形式语法树
+# envir 为 dict 时作为顶层环境, 顶层定义的变量写进这个 dict
 def eval(expression, envir):
-    # 如果表达式为整数或布尔值，则直接返回
-    if type(expression) is list and expression[0] in ["id", "num", "str", "vec", "true", "false", "T"]:
-        if expression[0] == 'id':
-            return envir[expression[1]]
-        if expression[0] == 'num':
-            return expression[1]
-        if expression[0] == 'true':
-            return True
-        if expression[0] == 'false':
-            return False
-        if expression[0] == 'T':
-            return 'T'
-        # 如果表达式为字符串，则返回其内容（去除引号）
-        if expression[0] == 'str':
-            return expression[1]
-        if expression[0] == 'vec':
-            res = []
-            for item in expression[1]:
-                res.append(eval(item, envir))
-            return res
-
-        return expression
-
-    # 如果表达式为元组，则检查变量并返回其值
-    if type(expression) is tuple:
-        return check_variable((expression[0], eval(expression[1], envir)), envir)
-
-    # 处理变量赋值语句
-    if type(expression) is list and len(expression) == 3 and expression[0] == 'var':
-        set_var(expression[1], eval(expression[2], envir), envir)
-        return None
+    if not isinstance(expression, Node):
+        expression = from_list(expression)
+    expression = cilly_fold.fold(expression)
+    if cilly_memo.memo_enabled:
+        cilly_memo.analyze(expression)
+    if type(envir) is dict:
+        envir = Env(envir, None)
+        envir.modules = envir.vars.get(IMPORT_NAME)
+    return eval_node(expression, envir)
+
+
+# 按节点种类查表分派
+def eval_node(node, envir):
+    return EVALUATORS[node.kind](node, envir)
+
+
+def eval_id(node, envir):
+    return envir[node.name]
+
+
+def eval_literal(node, envir):
+    return node.value
+
+
+def eval_trans(node, envir):
+    return 'T'
+
+
+def eval_vec(node, envir):
+    return [eval_node(item, envir) for item in node.items]
+
+
+# 检查带下标的变量并返回其值
+def eval_index(node, envir):
+    return check_variable(node.name, [eval_node(e, envir) for e in node.indexes], envir)
+
+
+# 处理变量定义语句
+def eval_var(node, envir):
+    set_var(node.name, None, None if node.init is None else eval_node(node.init, envir), envir)
+    return None
+
+
+# 处理导入语句
+def eval_import(node, envir):
+    attach_module(load_module(node.path), envir)
+    return None
 
-    # 处理导入语句
-    if type(expression) is list and len(expression) == 2 and expression[0] == 'import':
-        inner_envir = {}
-        eval(parser(lexer(open(expression[1]).read())), inner_envir)
-        envir.update(inner_envir)
+
+# 环境直接挂上模块环境, 不复制绑定, 模块中的函数改写模块变量后导入方读到的是新值
+# 顶层环境(dict 或顶层 Env)的模块列表记在 dict 的 IMPORT_NAME 项中, 同一个 dict 再次执行(如交互模式)时仍能找到
+def attach_module(module, envir):
+    if type(envir) is Env:
+        if envir.modules is None:
+            envir.modules = []
+            if envir.parent is None:
+                envir.vars[IMPORT_NAME] = envir.modules
+        mods = envir.modules
+    else:
+        mods = envir.get(IMPORT_NAME)
+        if mods is None:
+            mods = envir[IMPORT_NAME] = []
+    if all(m is not module for m in mods):
+        mods.append(module)
+
+
+# 顶层 dict 中 import 的模块里定义 name 的那一个, 没有则返回 None
+def module_owner(envir, name):
+    mods = envir.get(IMPORT_NAME)
+    if mods is not None:
+        for m in mods:
+            if name in m:
+                return m
+    return None
+
+
+# 取模块环境, 文件的 mtime 或大小变化后重新求值; run(语法树, 环境) 为执行模块的引擎, 默认为 eval
+def load_module(path, run=None):
+    key = os.path.abspath(path)
+    try:
+        st = os.stat(key)
+    except OSError as e:
+        err(f'无法导入{path}: {e}')
+
+    if run is None:
+        run = eval
+    m = modules.get((key, run))
+    if m is not None and m[0] == st.st_mtime_ns and m[1] == st.st_size:
+        return m[2]
+
+    if key in loading:
+        cycle = loading[loading.index(key):] + [key]
+        err(f'循环导入: {" -> ".join(cycle)}')
+
+    loading.append(key)
+    try:
+        module = {}
+        run(cilly_cache.load_ast(key), module)
+    finally:
+        loading.pop()
+
+    modules[(key, run)] = (st.st_mtime_ns, st.st_size, module)
+    return module
+
+
+# 处理赋值语句
+def eval_assign(node, envir):
+    var = node.target
+    if var.kind == N_ID:
+        # 先确认变量已定义, 再求值
+        v = envir.owner(var.name)
+        if v is None:
+            err(f'unbound variable{var.name}')
+        v[var.name] = eval_node(node.value, envir)
+        return None
+    if var.kind == N_INDEX:
+        pos = [eval_node(e, envir) for e in var.indexes]
+        check_variable(var.name, pos, envir)
+        set_var(var.name, pos, eval_node(node.value, envir), envir)
         return None
+    err(f'{var} is not a legal var')
 
-    # 处理赋值语句
-    if type(expression) is list and len(expression) == 3 and expression[0] == 'assign':
-        var = expression[1]
-        if type(var) is list:
-            check_variable(var, envir)
-            set_var(var, eval(expression[2], envir), envir)
-            return None
-        if type(var) is tuple and len(var) == 2:
-            check_variable((var[0], eval(var[1], envir)), envir)
-            set_var(var, eval(expression[2], envir), envir)
+
+# 处理函数定义语句
+# 函数值为 ['proc', 形参, 函数体, 定义时的环境, 记忆化缓存或 None]
+def eval_fun(node, envir):
+    set_var(node.name, None, ['proc', node.params, node.body, envir, cilly_memo.new_cache(node)], envir)
+    return None
+
+
+# 处理函数调用
+def eval_call(node, envir):
+    f = eval_node(node.fn, envir)
+    if type(f) != list or f[0] != 'proc':
+        err(f'{f} is not a function')
+
+    args = [eval_node(e, envir) for e in node.args]
+    memo = f[4]
+    if memo is not None:
+        # 多出的实参不影响结果, 不放进键
+        key = cilly_memo.memo_key(args[:len(f[1])])
+        if key is not None:
+            value = memo.get(key)
+            if value is not cilly_memo.MISSING:
+                return value
+
+    new_envir = ext_env(f[1], args, f[3])
+
+    this_ret = eval_node(f[2], new_envir)
+    value = this_ret.value if type(this_ret) is ReturnValue else None
+    if memo is not None and key is not None:
+        cilly_memo.store(memo, key, value)
+    return value
+
+
+# 处理代码块
+def eval_block(node, envir):
+    for e in node.stmts:
+        this_ret = eval_node(e, envir)
+        if type(this_ret) is ReturnValue:
+            return this_ret
+    return None
+
+
+# 处理return语句
+def eval_return(node, envir):
+    return ReturnValue(None if node.value is None else eval_node(node.value, envir))
+
+
+# 处理if语句
+def eval_if(node, envir):
+    cond = eval_node(node.cond, envir)
+    if cond == True:
+        return eval_node(node.then, envir)
+    else:
+        if node.orelse is None:
             return None
         else:
-            err(f'{var} is not a legal var')
+            return eval_node(node.orelse, envir)
 
-    # 处理函数定义语句
-    if type(expression) is list and len(expression) == 4 and expression[0] == 'fun':
-        set_var(expression[1], ['proc', expression[2], expression[3], envir], envir)
-        return None
 
-    # 处理阶乘函数
-    if type(expression) is list and len(expression) == 2 and expression[0] == 'frac':
-        if type(expression[1]) is not int:
-            err(f'{expression[1]} is not an integer')
-        frac = 1
-        for i in range(1, expression[1] + 1):
-            frac *= i
-        return frac
-
-    # 处理函数调用
-    if type(expression) is list and len(expression) == 3 and expression[0] == 'call':
-        f = eval(expression[1], envir)
-        if type(f) != list or f[0] != 'proc':
-            err(f'{f} is not a function')
-
-        old_envir = f[3]
-        old_envir = ChainMap({expression[1]: f}, old_envir)
-        new_envir = old_envir.copy()
-
-        if expression[2] is not None:
-            new_envir = ext_env(f[1], [eval(e, envir) for e in expression[2]], old_envir)
-
-        this_ret = eval(f[2], new_envir)
-        up_env(f[3], new_envir)
-        if type(this_ret) is list and this_ret[0] == 'return':
-            return this_ret[1]
-        else:
-            return None
+# 处理while语句
+def eval_while(node, envir):
+    while eval_node(node.cond, envir):
+        this_ret = eval_node(node.body, envir)
+        if type(this_ret) is ReturnValue:
+            return this_ret
 
-    # 处理代码块
-    if type(expression) is list and len(expression) == 2 and expression[0] == 'block':
-        for e in expression[1]:
-            this_ret = eval(e, envir)
-            if type(this_ret) == list and this_ret[0] == "return":
-                return this_ret
-        return None
+    return None
 
-    # 处理return语句
-    if type(expression) is list and len(expression) == 2 and expression[0] == 'return':
-        return ['return', eval(expression[1], envir)]
 
-    # 处理if语句
-    if type(expression) is list and len(expression) == 4 and expression[0] == 'if':
-        cond = eval(expression[1], envir)
-        if cond == True:
-            return eval(expression[2], envir)
-        else:
-            if expression[3] == None:
-                return None
-            else:
-                return eval(expression[3], envir)
+# 处理print语句
+def eval_print(node, envir):
+    print(' '.join(str(eval_node(e, envir)) for e in node.args))
+    return None
 
-    # 处理while语句
-    if type(expression) is list and len(expression) == 3 and expression[0] == 'while':
-        while eval(expression[1], envir):
-            this_ret = eval(expression[2], envir)
-            if type(this_ret) == list and this_ret[0] == "return":
-                return this_ret
 
-        return None
+def eval_program(node, envir):
+    for e in node.stmts:
+        this_ret = eval_node(e, envir)
+        if type(this_ret) is ReturnValue:
+            return this_ret.value
+    return ""
+
+
+# 处理二元操作符
+def eval_binop(node, envir):
+    return binop(node.op, eval_node(node.left, envir), eval_node(node.right, envir))
+
+
+# 处理一元操作符
+def eval_uinop(node, envir):
+    return uinop(node.op, eval_node(node.operand, envir))
+
+
+# 系统函数
+def eval_builtin(node, envir):
+    f = BUILTINS.get(node.name)
+    if f is None:
+        err(f'illegal expression{node}')
+    return f(*[eval_node(e, envir) for e in node.args])
 
-    # 处理print语句
-    if type(expression) is list and len(expression) == 2 and expression[0] == 'print':
-        st = ""
-        cnt = 0
-        for e in expression[1]:
-            if cnt > 0:
-                st += ' '
-            cnt += 1
-            st += str(eval(e, envir))
-        print(st)
-        return None
 
-    if type(expression) is list and len(expression) == 2 and expression[0] == 'show':
-        st = ''
-        res = eval(expression[1], envir)
-        if type(res) is list:
-            # 矩阵
-            if type(res[0]) is list:
-                res = [[str(x) for x in y] for y in res]
-                if len(res) == 1:
-                    st += '[[' + ','.join(res[0]) + ']]'
-                else:
-                    st += '[[' + ','.join(res[0]) + '],' + '\n'
-                    for item in res[1:-1]:
-                        st += ' [' + ','.join(item) + '],' + '\n'
-                    st += ' [' + ','.join(res[-1]) + ']]'
-            # 向量
+def eval_illegal(node, envir):
+    err(f'illegal expression{node}')
+
+
+EVALUATORS = [eval_illegal] * len(NODE_NAMES)
+EVALUATORS[N_PROGRAM] = eval_program
+EVALUATORS[N_IMPORT] = eval_import
+EVALUATORS[N_FUN] = eval_fun
+EVALUATORS[N_BLOCK] = eval_block
+EVALUATORS[N_WHILE] = eval_while
+EVALUATORS[N_IF] = eval_if
+EVALUATORS[N_RETURN] = eval_return
+EVALUATORS[N_PRINT] = eval_print
+EVALUATORS[N_VAR] = eval_var
+EVALUATORS[N_ASSIGN] = eval_assign
+EVALUATORS[N_BINOP] = eval_binop
+EVALUATORS[N_UINOP] = eval_uinop
+EVALUATORS[N_CALL] = eval_call
+EVALUATORS[N_BUILTIN] = eval_builtin
+EVALUATORS[N_ID] = eval_id
+EVALUATORS[N_INDEX] = eval_index
+EVALUATORS[N_NUM] = eval_literal
+EVALUATORS[N_STR] = eval_literal
+EVALUATORS[N_BOOL] = eval_literal
+EVALUATORS[N_TRANS] = eval_trans
+EVALUATORS[N_VEC] = eval_vec
+
+
+SCALAR_OPS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '^': operator.xor,
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+}
+
+ELEMENTWISE = {'+': operator.add, '-': operator.sub, '*': operator.mul}
+
+
+# 以下 kernel 的参数为 (运算符, 左值, 右值, 左操作数, 右操作数), 操作数由 classify() 给出
+
+# 向量 +-* 向量
+def vector_elementwise(option, first, second, a, b):
+    if a.shape != b.shape:
+        err(f'向量大小不匹配')
+    return wrap(ELEMENTWISE[option](a, b))
+
+
+# 矩阵 +- 矩阵
+def matrix_elementwise(option, first, second, a, b):
+    if a.shape != b.shape:
+        err(f'矩阵大小不匹配')
+    return wrap(ELEMENTWISE[option](a, b))
+
+
+# 矩阵 * 矩阵, 矩阵 * 向量, 向量 * 矩阵
+def matrix_product(option, first, second, a, b):
+    if a.shape[-1] != b.shape[0]:
+        err(f'矩阵大小不匹配')
+    return wrap(matmul(a, b))
+
+
+# 向量或矩阵 * 标量
+def scale_left(option, first, second, a, b):
+    return wrap(a * second)
+
+
+# 标量 * 向量或矩阵
+def scale_right(option, first, second, a, b):
+    return wrap(b * first)
+
+
+# 向量与矩阵相加减
+def size_mismatch(option, first, second, a, b):
+    err(f'矩阵大小不匹配')
+
+
+# A^T -> A的转置矩阵, 其余按标量运算
+def matrix_power(option, first, second, a, b):
+    if second == 'T':
+        return wrap(transpose(a))
+    return first ^ second
+
+
+# 比较按列表的规则
+def compare_arrays(option, first, second, a, b):
+    if type(first) is CillyArray:
+        first = first.tolist()
+    if type(second) is CillyArray:
+        second = second.tolist()
+    return SCALAR_OPS[option](first, second)
+
+
+# (运算符, 左操作数种类, 右操作数种类) -> kernel(option, first, second); 两边都是标量时直接用 SCALAR_OPS
+ARRAY_KERNELS = {
+    ('+', VECTOR, VECTOR): vector_elementwise,
+    ('-', VECTOR, VECTOR): vector_elementwise,
+    ('*', VECTOR, VECTOR): vector_elementwise,
+    ('+', MATRIX, MATRIX): matrix_elementwise,
+    ('-', MATRIX, MATRIX): matrix_elementwise,
+    ('+', VECTOR, MATRIX): size_mismatch,
+    ('+', MATRIX, VECTOR): size_mismatch,
+    ('-', VECTOR, MATRIX): size_mismatch,
+    ('-', MATRIX, VECTOR): size_mismatch,
+    ('*', MATRIX, MATRIX): matrix_product,
+    ('*', MATRIX, VECTOR): matrix_product,
+    ('*', VECTOR, MATRIX): matrix_product,
+    ('*', VECTOR, SCALAR): scale_left,
+    ('*', MATRIX, SCALAR): scale_left,
+    ('*', SCALAR, VECTOR): scale_right,
+    ('*', SCALAR, MATRIX): scale_right,
+    ('^', MATRIX, SCALAR): matrix_power,
+}
+ARRAY_KERNELS.update({(op, k1, k2): compare_arrays
+                      for op in ('>', '>=', '<', '<=', '==', '!=')
+                      for k1 in (SCALAR, VECTOR, MATRIX)
+                      for k2 in (SCALAR, VECTOR, MATRIX)
+                      if k1 != SCALAR or k2 != SCALAR})
+
+
+def binop(option, first, second):
+    k1, a = classify(first)
+    k2, b = classify(second)
+    if k1 == SCALAR and k2 == SCALAR:
+        # 长字符串拼接得到 Rope
+        if type(first) is str and option == '+':
+            return concat(first, second)
+        f = SCALAR_OPS.get(option)
+        if f is None:
+            err(f'非法二元运算符{option}')
+        return f(first, second)
+
+    if k1 == EMPTY or k2 == EMPTY:
+        err('矩阵或向量不能为空')
+    kernel = ARRAY_KERNELS.get((option, k1, k2))
+    if kernel is not None:
+        return kernel(option, first, second, a, b)
+    # 没有对应的矩阵运算(如 向量 + 标量), 与原来一样按 Python 运算符处理, 由 Python 报类型错误
+    f = SCALAR_OPS.get(option)
+    if f is None:
+        err(f'非法二元运算符{option}')
+    return f(first, second)
+
+
+def uinop(option, value):
+    if option == '!':
+        return not value
+    if option == '-':
+        return -value
+    if option == 'frac':
+        num = value
+        for i in range(1, num):
+            num *= i
+        return num
+
+    err(f'非法一元运算符{option}')
+
+
+def show(res):
+    if type(res) is CillyArray:
+        res = res.tolist()
+    st = ''
+    if type(res) is list:
+        # 矩阵
+        if type(res[0]) is list:
+            res = [[str(x) for x in y] for y in res]
+            if len(res) == 1:
+                st += '[[' + ','.join(res[0]) + ']]'
             else:
-                res = [str(x) for x in res]
-                st += '[' + ','.join(res) + ']'
-            print(st)
+                st += '[[' + ','.join(res[0]) + '],' + '\n'
+                for item in res[1:-1]:
+                    st += ' [' + ','.join(item) + '],' + '\n'
+                st += ' [' + ','.join(res[-1]) + ']]'
+        # 向量
         else:
-            print(res)
+            res = [str(x) for x in res]
+            st += '[' + ','.join(res) + ']'
+        print(st)
+    else:
+        print(res)
 
-        return None
+    return None
 
-    # 系统函数
-    if type(expression) is list and len(expression) == 1 and expression[0] == 'input':
-        this_ret = input()
-        return this_ret
-
-    if type(expression) is list and len(expression) == 2 and expression[0] == 'abs':
-        return abs(eval(expression[1], envir))
-
-    if type(expression) is list and len(expression) == 2 and expression[0] == 'int':
-        return int(eval(expression[1], envir))
-
-    if type(expression) is list and len(expression) == 2 and expression[0] == 'len':
-        return len(eval(expression[1], envir))
-
-    if type(expression) is list and len(expression) == 2 and expression[0] == 'type':
-        val = eval(expression[1], envir)
-        if type(val) is int:
-            return 'int'
-        if type(val) is bool:
-            return 'bool'
-        if type(val) is str:
-            return 'str'
-        if type(val) is list:
-            return 'arr'
-
-    if type(expression) is list and len(expression) == 2 and expression[0] == 'tr':
-        res = eval(expression[1], envir)
-        if type(res) is list and type(res[0]) is list:
-            return np.trace(np.array(res))
-        else:
-            err(f'type error:{res} is not matrix, cannot use tr()')
 
-    if type(expression) is list and len(expression) == 2 and expression[0] == 'eig':
-        res = eval(expression[1], envir)
-        if type(res) is list and type(res[0]) is list and len(res) == len(res[0]):
-            eigenvalues, eigenvectors = np.linalg.eig(res)
-            return eigenvalues, eigenvectors
-        else:
-            err(f'type error:{res} is not square matrix, cannot use eig()')
+def builtin_type(val):
+    if type(val) is int:
+        return 'int'
+    if type(val) is bool:
+        return 'bool'
+    if is_string(val):
+        return 'str'
+    if is_array(val):
+        return 'arr'
 
-    if type(expression) is list and len(expression) == 2 and expression[0] == 'det':
-        res = eval(expression[1], envir)
-        if type(res) is list and type(res[0]) is list and len(res) == len(res[0]):
-            return np.linalg.det(np.array(res))
-        else:
-            err(f'type error:{res} is not square matrix, cannot use det()')
 
-    if type(expression) is list and len(expression) == 2 and expression[0] == 'inv':
-        res = eval(expression[1], envir)
-        if type(res) is list and type(res[0]) is list and len(res) == len(res[0]):
-            return np.linalg.inv(np.array(res)).tolist()
-        else:
-            err(f'type error:{res} is not square matrix, cannot use inv()')
-
-    # if type(expression) is list and len(expression) == 2 and expression[0] == 'arr':
-    #     length = eval(expression[1], envir)
-    #     this_ret = [0 for i in range(length)]
-    #     return this_ret
-
-    if type(expression) is list and len(expression) == 2 and expression[0] == 'program':
-        for e in expression[1]:
-            this_ret = eval(e, envir)
-            if type(this_ret) == list and this_ret[0] == "return":
-                return this_ret[1]
-        return ""
-
-    # 处理二元操作符
-    if type(expression) is list and len(expression) == 4 and expression[0] == 'binop':
-        first = eval(expression[2], envir)
-        second = eval(expression[3], envir)
-        option = expression[1]
-        arr1 = None
-        arr2 = None
-        if first == [] or first == [[]] or second == [] or second == [[]]:
-            err('矩阵或向量不能为空')
-
-        if option == '>':
-            return first > second
-        if option == '>=':
-            return first >= second
-        if option == '<':
-            return first < second
-        if option == '<=':
-            return first <= second
-        if option == '==':
-            return first == second
-        if option == '!=':
-            return first != second
-
-        if option == '^':
-            # A^T -> A的转置矩阵
-            if type(first) is list and type(first[0]) is list and second == 'T':
-                matrix = np.array(first)
-                return np.transpose(matrix).tolist()
-            # A^B -> A的B次幂
-            return first ^ second
-
-        if option == '+':
-            if type(first) is list:
-                arr1 = np.array(first)
-            if type(second) is list:
-                arr2 = np.array(second)
-            # 向量 + 向量
-            if np.any(arr1) and (type(first[0]) is not list) and np.any(arr2) and (type(second[0]) is not list):
-                if arr1.shape != arr2.shape:
-                    err(f'向量大小不匹配')
-                return (arr1 + arr2).tolist()
-            # 矩阵 + 矩阵
-            if np.any(arr1) and np.any(arr2):
-                if arr1.shape != arr2.shape:
-                    err(f'矩阵大小不匹配')
-                return (arr1 + arr2).tolist()
-            # 标量 + 标量
-            return first + second
-
-        if option == '-':
-            if type(first) is list:
-                arr1 = np.array(first)
-            if type(second) is list:
-                arr2 = np.array(second)
-            # 向量 - 向量
-            if np.any(arr1) and (type(first[0]) is not list) and np.any(arr2) and (type(second[0]) is not list):
-                if arr1.shape != arr2.shape:
-                    err(f'向量大小不匹配')
-                return (arr1 - arr2).tolist()
-            # 矩阵 - 矩阵
-            if np.any(arr1) and np.any(arr2):
-                if arr1.shape != arr2.shape:
-                    err(f'矩阵大小不匹配')
-                return (arr1 - arr2).tolist()
-            # 标量 - 标量
-            return first - second
-
-        if option == '*':
-            if type(first) is list:
-                arr1 = np.array(first)
-            if type(second) is list:
-                arr2 = np.array(second)
-            # 向量 * 向量
-            if np.any(arr1) and (type(first[0]) is not list) and np.any(arr2) and (type(second[0]) is not list):
-                if arr1.shape != arr2.shape:
-                    err(f'向量大小不匹配')
-                return (arr1 * arr2).tolist()
-            # 向量 * 标量
-            if np.any(arr1) and (type(first[0]) is not list) and not np.any(arr2):
-                return (arr1 * second).tolist()
-            # 标量 * 向量
-            if np.any(arr2) and (type(second[0]) is not list) and not np.any(arr1):
-                return (arr2 * first).tolist()
-            # 矩阵 * 矩阵
-            if np.any(arr1) and np.any(arr2):
-                if arr1.shape[1] != arr2.shape[0]:
-                    err(f'矩阵大小不匹配')
-                return np.dot(arr1, arr2).tolist()
-            # 矩阵 * 标量
-            if np.any(arr1) and not np.any(arr2):
-                return (arr1 * second).tolist()
-            # 标量 * 矩阵
-            if np.any(arr2) and not np.any(arr1):
-                return (arr2 * first).tolist()
-            # 标量 * 标量
-            return first * second
-
-        if option == '/':
-            return first / second
-
-
-    # 处理一元操作符
-    if type(expression) is list and len(expression) == 3 and expression[0] == 'uinop':
-        option = expression[1]
-        if option == '!':
-            return not eval(expression[2], envir)
-        if option == '-':
-            return -eval(expression[2], envir)
-        if option == 'frac':
-            num = eval(expression[2], envir)
-            for i in range(1, num):
-                num *= i
-            return num
-
-    # 若未匹配到任何情况，则抛出异常
-    err(f'illegal expression{expression}')
+def builtin_tr(res):
+    if is_matrix(res):
+        return np.trace(as_array(res))
+    else:
+        err(f'type error:{res} is not matrix, cannot use tr()')
+
+
+def builtin_eig(res):
+    if is_square(res):
+        eigenvalues, eigenvectors = np.linalg.eig(as_array(res))
+        return eigenvalues, eigenvectors
+    else:
+        err(f'type error:{res} is not square matrix, cannot use eig()')
+
+
+def builtin_det(res):
+    if is_square(res):
+        return np.linalg.det(as_array(res))
+    else:
+        err(f'type error:{res} is not square matrix, cannot use det()')
+
+
+def builtin_inv(res):
+    if is_square(res):
+        return CillyArray(np.linalg.inv(as_array(res)))
+    else:
+        err(f'type error:{res} is not square matrix, cannot use inv()')
+
+
+def builtin_load(path):
+    a = CillyArray(load_matrix(text(path)))
+    # .npy 是只读映射, 写元素前先复制
+    if not a.data.flags.writeable:
+        a.pinned = True
+    return a
+
+
+def builtin_save(path, res):
+    a = as_array(res)
+    if a is None:
+        err(f'type error:{res} is not vector or matrix, cannot use save()')
+    save_matrix(text(path), a)
+    return None
+
+
+BUILTINS = {
+    'input': input,
+    'abs': abs,
+    'int': int,
+    'len': len,
+    'type': builtin_type,
+    'show': show,
+    'tr': builtin_tr,
+    'eig': builtin_eig,
+    'det': builtin_det,
+    'inv': builtin_inv,
+    'load': builtin_load,
+    'save': builtin_save,
+}
 
 
 # 异常处理函数
@@ -350,55 +566,39 @@ def err(e):
     raise Exception(e)
 
 
-# 设置变量
-def set_var(var, val, envir):
-    if type(var) is tuple:
-        var2 = tk_val(var[0])
-        pos = eval(var[1], envir)
-        # print(var2, pos)
-        element = envir[var2]
+# 设置变量, pos 为已求值的下标列表
+def set_var(var, pos, val, envir):
+    if pos is not None:
+        element = envir[var]
         for x in pos[:-1]:
             element = element[x]
         element[pos[-1]] = val
     else:
-        envir[tk_val(var)] = val
-
-
-# 更新环境
-def up_env(envir, new_envir):
-    for var, val in envir.items():
-        envir[var] = check_variable(var, new_envir)
+        envir[var] = val
 
 
 # 检查变量
-def check_variable(var, envir):
-    if type(var) is list:
-        var = var[1]
-        if var not in envir:
-            err(f'unbound variable{var}')
-        return envir[var]
+def check_variable(var, pos, envir):
+    if var not in envir:
+        err(f'unbound variable{var}')
 
-    if type(var) is tuple:
-        var2 = tk_val(var[0])
-        pos = var[1]
-        # print(var2, var[1])
-        if var2 not in envir:
-            err(f'unbound variable{var[0]}')
+    if pos is None:
+        return envir[var]
 
-        try:
-            element = envir[var2]
-            for x in pos[:-1]:
-                element = element[x]
-            return element[pos[-1]]
-        except Exception as e:
-            err(e)
+    try:
+        element = envir[var]
+        for x in pos[:-1]:
+            element = element[x]
+        return element[pos[-1]]
+    except Exception as e:
+        err(e)
 
 
 # 扩展环境
 def ext_env(vars, vals, envir):
     e = {var: val for (var, val) in zip(vars, vals)}
 
-    return ChainMap(e, envir)
+    return Env(e, envir)
 
 
 
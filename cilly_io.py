@@ -0,0 +1,128 @@
+import tempfile
+import numpy as np
+from cilly_lexer import error
+
+# 矩阵文件读写, 供 load()/save() 系统函数使用; 路径相对于当前目录
+#   .npy: 用 np.load(mmap_mode='r') 映射进内存, 不读入也不复制, 运算直接读映射的数据; 写元素时才复制一份(见 CillyArray.pinned)
+#   其余按文本读写: .csv 以逗号分隔, 其他后缀以空白分隔, 每行一个矩阵行, 空行和 # 开头的行跳过
+# 文本按约 CHUNK_BYTES 字节一块解析进预先分配的数组, 不经过 Python 列表; 结果超过 OUT_OF_CORE_BYTES 时数组放在临时文件的映射上
+# 文本只有一行时读成向量, 保存向量时写成一行
+
+CHUNK_BYTES = 8 * 1024 * 1024
+# 保存文本时每块的行数
+CHUNK_ROWS = 4096
+OUT_OF_CORE_BYTES = 256 * 1024 * 1024
+
+
+def err(msg):
+    error('cilly io', msg)
+
+
+def is_npy(path):
+    return path.lower().endswith('.npy')
+
+
+def delimiter(path):
+    return ',' if path.lower().endswith('.csv') else None
+
+
+def load_matrix(path):
+    if type(path) is not str:
+        err(f'load() 的参数应为文件名: {path}')
+    try:
+        if is_npy(path):
+            a = np.load(path, mmap_mode='r', allow_pickle=False)
+            # memmap 子类换成普通 ndarray 视图, 仍共享映射的数据
+            a = a.view(np.ndarray)
+        else:
+            a = load_text(path)
+    except OSError as e:
+        err(f'无法读取{path}: {e}')
+    except ValueError as e:
+        err(f'{path} 格式错误: {e}')
+    if a.ndim not in (1, 2) or a.size == 0:
+        err(f'{path} 不是向量或矩阵, 形状为{a.shape}')
+    if a.dtype.kind not in 'biuf':
+        err(f'{path} 的元素不是数: {a.dtype}')
+    return a
+
+
+def data_lines(f):
+    for line in f:
+        s = line.strip()
+        if s and not s.startswith('#'):
+            yield s
+
+
+# 第一遍数行数、列数并确定元素类型, 第二遍按块解析进结果数组
+def load_text(path):
+    sep = delimiter(path)
+    rows = 0
+    cols = None
+    dtype = np.dtype(np.int64)
+    with open(path) as f:
+        for s in data_lines(f):
+            if cols is None:
+                cols = len(s.split(sep))
+            # 有小数点、指数或 nan/inf 的文件按浮点数读
+            if dtype.kind == 'i' and any(c in s for c in '.eEnN'):
+                dtype = np.dtype(np.float64)
+            rows += 1
+    if rows == 0:
+        err(f'{path} 是空文件')
+
+    out = allocate((rows, cols), dtype)
+    i = 0
+    with open(path) as f:
+        chunk = []
+        size = 0
+        for s in data_lines(f):
+            chunk.append(s)
+            size += len(s)
+            if size >= CHUNK_BYTES:
+                parse_chunk(chunk, sep, out, i)
+                i += len(chunk)
+                chunk = []
+                size = 0
+        if chunk:
+            parse_chunk(chunk, sep, out, i)
+    return out[0] if rows == 1 else out
+
+
+# 解析一块文本行写入 out[i:]
+def parse_chunk(lines, sep, out, i):
+    block = np.loadtxt(lines, delimiter=sep, dtype=out.dtype, ndmin=2)
+    if block.shape[1] != out.shape[1]:
+        err(f'第 {i + 1} 行起的列数为 {block.shape[1]}, 与第一行的 {out.shape[1]} 列不同')
+    out[i:i + len(lines)] = block
+
+
+# 超过 OUT_OF_CORE_BYTES 的数组放在临时文件上, 文件已删除, 映射释放时空间一并回收
+def allocate(shape, dtype):
+    nbytes = shape[0] * shape[1] * dtype.itemsize
+    if nbytes <= OUT_OF_CORE_BYTES:
+        return np.empty(shape, dtype)
+    with tempfile.TemporaryFile() as f:
+        return np.memmap(f, dtype=dtype, mode='w+', shape=shape).view(np.ndarray)
+
+
+def save_matrix(path, a):
+    if type(path) is not str:
+        err(f'save() 的第一个参数应为文件名: {path}')
+    try:
+        if is_npy(path):
+            np.save(path, a, allow_pickle=False)
+        else:
+            save_text(path, a)
+    except OSError as e:
+        err(f'无法写入{path}: {e}')
+
+
+def save_text(path, a):
+    sep = delimiter(path) or ' '
+    fmt = '%d' if a.dtype.kind in 'biu' else '%.17g'
+    if a.ndim == 1:
+        a = a.reshape(1, -1)
+    with open(path, 'w') as f:
+        for i in range(0, a.shape[0], CHUNK_ROWS):
+            np.savetxt(f, a[i:i + CHUNK_ROWS], fmt=fmt, delimiter=sep)
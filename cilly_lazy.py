@@ -0,0 +1,210 @@
+import numpy as np
+
+# 惰性矩阵运算: 开启后矩阵、向量的 binop 结果只是表达式图(DAG)中的一个节点, 形状和类型在建图时就确定, 出错仍在运算处报告
+# 取值(打印、取元素、det/inv 等)时才整体求值:
+#   连乘 A*B*C 合并为一次 np.linalg.multi_dot, 按代价最小的顺序结合
+#   加减链 A + B - C*2 只分配一块结果缓冲区, 之后用 out= 原地累加; 数乘、取负等项按行分块计算后立即累加, 只用一小块临时缓冲区
+#   节点被脚本中的变量引用着时(owner 仍存活), 算出后缓存在节点上, 不会被原地改写
+# 加减链和数乘保持与立即求值相同的运算顺序, 结果逐位相同; 连乘改变结合顺序, 结果只在舍入误差范围内相同
+
+LEAF = 0
+ADD = 1
+SUB = 2
+MUL = 3     # 逐元素相乘
+SCALE = 4   # 乘标量
+DOT = 5
+T = 6
+NEG = 7
+
+SCALAR_TYPES = (int, float, complex, np.number)
+
+# 分块累加时临时缓冲区的大小(字节), 放得进 CPU 缓存
+BLOCK_BYTES = 256 * 1024
+
+
+class Expr:
+    __slots__ = ('op', 'args', 'shape', 'dtype', 'value', 'owner')
+
+    def __init__(self, op, args, shape, dtype):
+        self.op = op
+        self.args = args
+        self.shape = shape
+        self.dtype = dtype
+        # 缓存的结果
+        self.value = None
+        # 指向包装这个节点的 CillyArray 的弱引用, 由 cilly_array 设置
+        self.owner = None
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def T(self):
+        return Expr(T, (self,), self.shape[::-1], self.dtype)
+
+    def __add__(self, other):
+        return Expr(ADD, (self, other), self.shape, np.result_type(self.dtype, other.dtype))
+
+    def __sub__(self, other):
+        return Expr(SUB, (self, other), self.shape, np.result_type(self.dtype, other.dtype))
+
+    def __mul__(self, other):
+        if type(other) is Expr:
+            return Expr(MUL, (self, other), self.shape, np.result_type(self.dtype, other.dtype))
+        if isinstance(other, SCALAR_TYPES):
+            return Expr(SCALE, (self, other), self.shape, np.result_type(self.dtype, other))
+        return NotImplemented
+
+    def __neg__(self):
+        return Expr(NEG, (self,), self.shape, self.dtype)
+
+
+def leaf(data):
+    e = Expr(LEAF, (data,), data.shape, data.dtype)
+    e.value = data
+    return e
+
+
+# 与 np.dot 相同的形状规则
+def dot(a, b):
+    if a.ndim == 1:
+        shape = b.shape[1:]
+    elif b.ndim == 1:
+        shape = a.shape[:-1]
+    else:
+        shape = (a.shape[0], b.shape[1])
+    return Expr(DOT, (a, b), shape, np.result_type(a.dtype, b.dtype))
+
+
+# 没有缓存结果、也没有被变量引用的节点, 可以与父节点合并计算, 结果可以原地改写
+def is_free(e):
+    return e.value is None and (e.owner is None or e.owner() is None)
+
+
+# 求值, 返回 (数组, 是否为本次计算新分配、可以原地改写)
+def compute(e):
+    if e.value is not None:
+        return e.value, False
+    if not is_free(e):
+        return force(e), False
+    return run(e)
+
+
+def run(e):
+    op = e.op
+    if op == DOT:
+        return run_dot(e), True
+    if op == ADD or op == SUB:
+        return run_sum(e), True
+    if op == T:
+        a, owned = compute(e.args[0])
+        return a.T, owned
+
+    a, owned = compute(e.args[0])
+    if op == MUL:
+        b, b_owned = compute(e.args[1])
+        if not owned and b_owned:
+            a, b, owned = b, a, True
+        return np.multiply(a, b, out=in_place(e, a, owned)), True
+    if op == SCALE:
+        return np.multiply(a, e.args[1], out=in_place(e, a, owned)), True
+    return np.negative(a, out=in_place(e, a, owned)), True
+
+
+# 能原地写回 a 时返回 a, 否则返回 None 由 NumPy 分配结果
+def in_place(e, a, owned):
+    if owned and a.dtype == e.dtype:
+        return a
+    return None
+
+
+# 把相邻的 DOT 节点展开为一串矩阵, 交给 multi_dot 选择结合顺序
+def run_dot(e):
+    mats = []
+
+    def flatten(x):
+        if x.op == DOT and (x is e or is_free(x)):
+            flatten(x.args[0])
+            flatten(x.args[1])
+        else:
+            mats.append(compute(x)[0])
+    flatten(e)
+
+    # multi_dot 只允许首尾是向量, 中间有向量(如 A*v*B)时按原顺序依次相乘
+    if len(mats) == 2 or any(m.ndim == 1 for m in mats[1:-1]):
+        v = mats[0]
+        for m in mats[1:]:
+            v = np.dot(v, m)
+        return v
+    return np.linalg.multi_dot(mats)
+
+
+# 左结合的加减链 ((t0 ± t1) ± t2) ...: 按原顺序逐项累加到一块缓冲区
+def run_sum(e):
+    steps = []
+    x = e
+    while (x.op == ADD or x.op == SUB) and (x is e or is_free(x)):
+        steps.append(x)
+        x = x.args[0]
+
+    acc, owned = compute(x)
+    for s in reversed(steps):
+        f = np.add if s.op == ADD else np.subtract
+        term = s.args[1]
+        if owned and acc.dtype == s.dtype:
+            if is_free(term) and (term.op == SCALE or term.op == NEG or term.op == MUL):
+                accumulate(f, acc, term)
+            else:
+                f(acc, compute(term)[0], out=acc)
+        else:
+            acc = f(acc, compute(term)[0])
+            owned = True
+    return acc
+
+
+# acc = f(acc, term), term 为逐元素运算: 输入是新分配的就原地算, 否则按行分块算进一小块缓冲区再累加
+def accumulate(f, acc, term):
+    a, owned = compute(term.args[0])
+    if term.op == MUL:
+        b, b_owned = compute(term.args[1])
+        if b_owned and not owned:
+            a, b, owned = b, a, True
+        g = np.multiply
+    elif term.op == SCALE:
+        b = term.args[1]
+        g = np.multiply
+    else:
+        b = None
+        g = np.negative
+
+    def apply(x, y, out):
+        if b is None:
+            return g(x, out=out)
+        return g(x, y, out=out)
+
+    if owned and a.dtype == term.dtype:
+        f(acc, apply(a, b, a), out=acc)
+        return
+
+    n = acc.shape[0]
+    row = acc[0:1].nbytes
+    rows = max(1, min(n, BLOCK_BYTES // max(row, 1)))
+    tmp = np.empty((rows,) + acc.shape[1:], term.dtype)
+    for i in range(0, n, rows):
+        j = min(n, i + rows)
+        part = tmp[:j - i]
+        y = b if type(b) is not np.ndarray else b[i:j]
+        apply(a[i:j], y, part)
+        f(acc[i:j], part, out=acc[i:j])
+
+
+# 取值: 返回结果数组并缓存
+def force(e):
+    if e.value is None:
+        v, owned = run(e)
+        if not owned:
+            v = v.copy()
+        e.value = v
+        e.args = None
+    return e.value
@@ -1,3 +1,10 @@
+import codecs
+import gc
+import re
+from array import array
+from bisect import bisect_right
+
+
 def make_tk(type, val=None):
     return [type, val] if val is not None else [type]
 
@@ -13,11 +20,287 @@ def tk_val(t):
 def error(src, msg):
     raise Exception(f'<{src}>: {msg}')
 
+# 记号种类: 每种记号标签只驻留一次, 解析器按整数比较
+# break/continue/and/or 目前不是关键字, 词法分析器不会产生, 只为语法分析器保留
+TK_EOF = 0
+TK_NUM = 1
+TK_STR = 2
+TK_ID = 3
+TK_RETURN = 4
+TK_FUN = 5
+TK_PRINT = 6
+TK_IF = 7
+TK_ELSE = 8
+TK_VAR = 9
+TK_TRUE = 10
+TK_FALSE = 11
+TK_IMPORT = 12
+TK_WHILE = 13
+TK_BREAK = 14
+TK_CONTINUE = 15
+TK_AND = 16
+TK_OR = 17
+TK_COLON = 18
+TK_COMMA = 19
+TK_ADD = 20
+TK_SUB = 21
+TK_MUL = 22
+TK_DIV = 23
+TK_POW = 24
+TK_SEMI = 25
+TK_LPAREN = 26
+TK_RPAREN = 27
+TK_LBRACE = 28
+TK_RBRACE = 29
+TK_LBRACKET = 30
+TK_RBRACKET = 31
+TK_T = 32
+TK_ASSIGN = 33
+TK_EQ = 34
+TK_GT = 35
+TK_GE = 36
+TK_LT = 37
+TK_LE = 38
+TK_NOT = 39
+TK_NE = 40
+
+TK_NAMES = [
+    'eof', 'num', 'str', 'id', 'return', 'fun', 'print', 'if', 'else', 'var', 'true', 'false',
+    'import', 'while', 'break', 'continue', 'and', 'or', ':', ',', '+', '-', '*', '/', '^',
+    ';', '(', ')', '{', '}', '[', ']', 'T', '=', '==', '>', '>=', '<', '<=', '!', '!='
+]
+TK_KINDS = {name: i for i, name in enumerate(TK_NAMES)}
+
+
+
+KEYWORDS = ['return', 'fun', 'print', 'if', 'else', 'var', 'true', 'false', 'import', 'while']
+OPERATORS = [':', ',', '+', '-', '*', '/', '^', ';', '(', ')', '{', '}', '[', ']', 'T',
+             '=', '==', '>', '>=', '<', '<=', '!', '!=']
+
+# 主正则: 一次匹配一个完整记号, 空白由 findall 跳过
+# 'T' 作为单字符记号优先于标识符, 因此标识符不能以 T 开头 (与逐字符扫描器一致)
+# 最后一个分支兜底匹配任何非空白字符, 用来报告非法字符和未结束的字符串
+TOKEN_RE = re.compile(
+    r'[0-9]+(?:\.[0-9]*)?'
+    r'|[A-SU-Za-z_][A-Za-z0-9_]*'
+    r'|"[^"]*"'
+    r'|[=!<>]=?'
+    r'|[^ \t\r\n]')
+
+# 运算符和关键字记号不带值, 所有出现共享同一个列表
+FIXED_TOKENS = {t: make_tk(t) for t in OPERATORS + KEYWORDS}
+
+
+def isletter_(c):
+    return c == '_' or (c >= 'a' and c <= 'z') or (c >= 'A' and c <= 'Z')
+
 
 def lexer(prog):
     def err(msg):
         error('lexer', msg)
 
+    fixed = FIXED_TOKENS
+    tokens = []
+    append = tokens.append
+
+    # 记号列表没有循环引用, 扫描期间暂停分代回收, 避免在大文件上反复遍历新生代
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for t in TOKEN_RE.findall(prog):
+            tk = fixed.get(t)
+            if tk is not None:
+                append(tk)
+                continue
+
+            c = t[0]
+            if c == '"':
+                if len(t) == 1:
+                    err('字符串缺少结束引号')
+                append(['str', t[1:-1]])
+            elif c >= '0' and c <= '9':
+                append(['num', float(t) if '.' in t else int(t)])
+            elif isletter_(c):
+                append(['id', t])
+            else:
+                err(f'非法字符{t}')
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    append(make_tk('eof'))
+    return tokens
+
+
+def make_token(t, err):
+    tk = FIXED_TOKENS.get(t)
+    if tk is not None:
+        return tk
+
+    c = t[0]
+    if c == '"':
+        if len(t) == 1:
+            err('字符串缺少结束引号')
+        return ['str', t[1:-1]]
+    if c >= '0' and c <= '9':
+        return ['num', float(t) if '.' in t else int(t)]
+    if isletter_(c):
+        return ['id', t]
+    err(f'非法字符{t}')
+
+
+# 惰性词法分析: 从字符串、文件对象(文本或二进制)或 mmap 中按块读取并逐个产生记号
+# 只保留当前块里尚未扫描的尾部, 内存与文件大小无关
+def iter_tokens(src, chunk_size=1 << 16):
+    def err(msg):
+        error('lexer', msg)
+
+    if isinstance(src, str):
+        for t in TOKEN_RE.findall(src):
+            yield make_token(t, err)
+        yield make_tk('eof')
+        return
+
+    decoder = None
+    buf = ''
+    final = False
+
+    while not final:
+        # 一个记号比块还长时, 按已积累的长度加大读取量, 避免反复重扫
+        data = src.read(max(chunk_size, len(buf)))
+        final = not data
+        if not isinstance(data, str):
+            if decoder is None:
+                decoder = codecs.getincrementaldecoder('utf-8')()
+            data = decoder.decode(data, final)
+        buf = buf + data
+
+        end = len(buf)
+        pos = end
+        for m in TOKEN_RE.finditer(buf):
+            t = m.group()
+            # 块末尾的记号可能还没读完整: 标识符/数字/'=' 等会延续到下一块, 单独的 '"' 可能是跨块的字符串
+            if not final and (m.end() == end or t == '"'):
+                pos = m.start()
+                break
+            yield make_token(t, err)
+        buf = buf[pos:]
+
+    yield make_tk('eof')
+
+
+# 紧凑记号缓冲区: 种类和起止偏移存放在并行数组里, 字面量的值存放在旁表 values 中
+# 解析器通过 make_buffer_tokenizer 读取, 同时可以按下标取得每个记号在源码中的位置
+class TokenBuffer:
+    __slots__ = ('source', 'kinds', 'starts', 'ends', 'values', 'line_starts')
+
+    def __init__(self, source=''):
+        self.source = source
+        self.kinds = array('B')
+        self.starts = array('I')
+        self.ends = array('I')
+        self.values = []
+        self.line_starts = None
+
+    def append(self, kind, start, end, value=None):
+        self.kinds.append(kind)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.values.append(value)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, i):
+        return self.token(i)
+
+    def __iter__(self):
+        for i in range(len(self.kinds)):
+            yield self.token(i)
+
+    def kind(self, i):
+        return self.kinds[i]
+
+    def tag(self, i):
+        return TK_NAMES[self.kinds[i]]
+
+    def value(self, i):
+        return self.values[i]
+
+    def span(self, i):
+        return self.starts[i], self.ends[i]
+
+    # 第 lo 到 hi-1 个记号组成的新缓冲区, 偏移整体减去 offset, source 为对应的源码片段
+    def sub(self, lo, hi, offset, source):
+        b = TokenBuffer(source)
+        b.kinds = self.kinds[lo:hi]
+        b.starts = array('I', [x - offset for x in self.starts[lo:hi]])
+        b.ends = array('I', [x - offset for x in self.ends[lo:hi]])
+        b.values = self.values[lo:hi]
+        return b
+
+    # 物化为 lexer() 输出的记号形式
+    def token(self, i):
+        v = self.values[i]
+        if v is None:
+            return KIND_TOKENS[self.kinds[i]]
+        return [TK_NAMES[self.kinds[i]], v]
+
+    # 偏移 -> (行, 列), 均从 1 开始
+    def line_col(self, offset):
+        if self.line_starts is None:
+            src = self.source
+            starts = array('I', [0])
+            i = src.find('\n')
+            while i >= 0:
+                starts.append(i + 1)
+                i = src.find('\n', i + 1)
+            self.line_starts = starts
+        line = bisect_right(self.line_starts, offset)
+        return line, offset - self.line_starts[line - 1] + 1
+
+
+FIXED_KINDS = {t: TK_KINDS[t] for t in OPERATORS + KEYWORDS}
+KIND_TOKENS = [make_tk(name) for name in TK_NAMES]
+
+
+def lex_buffer(prog):
+    def err(msg):
+        error('lexer', msg)
+
+    buf = TokenBuffer(prog)
+    kinds = buf.kinds.append
+    starts = buf.starts.append
+    ends = buf.ends.append
+    values = buf.values.append
+    fixed = FIXED_KINDS
+    names = {}
+
+    for m in TOKEN_RE.finditer(prog):
+        t = m.group()
+        k = fixed.get(t)
+        if k is None:
+            tag, v = make_token(t, err)
+            k = TK_KINDS[tag]
+            # 同名标识符共享一个字符串对象
+            if k == TK_ID:
+                v = names.setdefault(v, v)
+        else:
+            v = None
+        kinds(k)
+        starts(m.start())
+        ends(m.end())
+        values(v)
+
+    buf.append(TK_EOF, len(prog), len(prog))
+    return buf
+
+
+# 逐字符扫描的旧实现, 保留作为新词法分析器的对照
+def char_lexer(prog):
+    def err(msg):
+        error('lexer', msg)
+
     pos = -1
     cur = None
     keywords = ['return', 'fun', 'print', 'if', 'else', 'var', 'true', 'false', 'import', 'while']
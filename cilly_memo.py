@@ -0,0 +1,193 @@
+from collections import OrderedDict
+from cilly_ast import *
+from cilly_string import Rope
+
+# 纯函数自动记忆化(-memo): 对顶层 fun 定义做纯度分析, 纯函数的闭包带一个按实参查找的 LRU 缓存
+# 纯函数: 不 print、不 import、不调用 input/show 等有副作用的系统函数, 不写函数外的变量, 不写数组元素,
+#   只读自己的参数和局部变量, 只调用其他纯函数; 函数名在程序中没有被 var/赋值重新绑定过
+# 实参和返回值都是数、字符串、布尔或空值时才查缓存、存缓存, 数组等可变的值每次都真正调用
+# 键中带有实参的类型, 1、1.0 和 true 各占一项, 结果的类型与不缓存时相同
+
+# 由 -memo 打开; 每个函数缓存的最大项数
+memo_enabled = False
+memo_size = 1024
+
+# 分析出的纯函数定义节点
+pure_funs = set()
+
+# 创建过的所有缓存, 供 -memo 的统计输出
+caches = []
+
+PURE_BUILTINS = {'abs', 'int', 'len', 'type', 'tr', 'eig', 'det', 'inv'}
+
+KEY_TYPES = {int, float, str, bool, Rope, type(None)}
+
+# 缓存未命中
+MISSING = object()
+
+
+class MemoCache:
+    __slots__ = ('name', 'entries', 'size', 'hits', 'misses')
+
+    def __init__(self, name, size):
+        self.name = name
+        self.entries = OrderedDict()
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        v = self.entries.get(key, MISSING)
+        if v is MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return v
+
+    def put(self, key, value):
+        entries = self.entries
+        entries[key] = value
+        if len(entries) > self.size:
+            entries.popitem(last=False)
+
+
+# 定义 node 时创建的闭包所用的缓存, 不记忆化时为 None
+def new_cache(node):
+    if not memo_enabled or node not in pure_funs:
+        return None
+    return named_cache(node.name)
+
+
+def named_cache(name):
+    c = MemoCache(name, memo_size)
+    caches.append(c)
+    return c
+
+
+# 实参元组对应的键, 有不能作键的实参时返回 None
+def memo_key(args):
+    types = tuple(map(type, args))
+    for t in types:
+        if t not in KEY_TYPES:
+            return None
+    return types, tuple(args)
+
+
+# 返回值可以缓存时存入
+def store(memo, key, value):
+    if type(value) in KEY_TYPES:
+        memo.put(key, value)
+
+
+def stats():
+    total = {}
+    for c in caches:
+        hits, misses, size = total.get(c.name, (0, 0, 0))
+        total[c.name] = (hits + c.hits, misses + c.misses, size + len(c.entries))
+    return total
+
+
+# 遍历语法树, 对每个节点调用 f
+def walk(node, f):
+    if not isinstance(node, Node):
+        return
+    f(node)
+    for x in node.fields():
+        if isinstance(x, Node):
+            walk(x, f)
+        elif type(x) is list:
+            for e in x:
+                walk(e, f)
+
+
+# 分析程序中的顶层函数, 把纯函数加入 pure_funs, 返回本次分析出的纯函数
+def analyze(ast):
+    if ast.kind != N_PROGRAM:
+        return set()
+
+    defs = {}
+    rebound = set()
+
+    def scan(node):
+        k = node.kind
+        if k == N_FUN:
+            defs[node.name] = defs.get(node.name, 0) + 1
+        elif k == N_VAR:
+            rebound.add(node.name)
+        elif k == N_ASSIGN and node.target.kind == N_ID:
+            rebound.add(node.target.name)
+    walk(ast, scan)
+
+    # 名字只绑定到唯一一个顶层函数
+    known = {}
+    for s in ast.stmts:
+        if s is not None and s.kind == N_FUN and defs[s.name] == 1 and s.name not in rebound:
+            known[s.name] = s
+
+    deps = {}
+    for name, fun in known.items():
+        d = set()
+        if check_fun(fun, known, d):
+            deps[name] = d
+
+    # 调用了非纯函数的函数也不是纯函数, 反复剔除直到不再变化
+    changed = True
+    while changed:
+        changed = False
+        for name in list(deps):
+            if not deps[name] <= deps.keys():
+                del deps[name]
+                changed = True
+
+    pure = {known[name] for name in deps}
+    pure_funs.update(pure)
+    return pure
+
+
+def check_fun(fun, known, deps):
+    local = set(fun.params)
+
+    def scan(node):
+        if node.kind == N_VAR:
+            local.add(node.name)
+    walk(fun.body, scan)
+
+    return check(fun.body, local, known, deps)
+
+
+def check(node, local, known, deps):
+    if node is None:
+        return True
+    k = node.kind
+    if k == N_PRINT or k == N_IMPORT or k == N_FUN:
+        return False
+    if k == N_BUILTIN:
+        if node.name not in PURE_BUILTINS:
+            return False
+    elif k == N_ASSIGN:
+        target = node.target
+        if target.kind != N_ID or target.name not in local:
+            return False
+        return check(node.value, local, known, deps)
+    elif k == N_ID:
+        return node.name in local or node.name in known
+    elif k == N_INDEX:
+        if node.name not in local:
+            return False
+    elif k == N_CALL:
+        fn = node.fn
+        if fn.kind != N_ID or fn.name in local or fn.name not in known:
+            return False
+        deps.add(fn.name)
+        return all(check(a, local, known, deps) for a in node.args)
+
+    for x in node.fields():
+        if isinstance(x, Node):
+            if not check(x, local, known, deps):
+                return False
+        elif type(x) is list:
+            for e in x:
+                if isinstance(e, Node) and not check(e, local, known, deps):
+                    return False
+    return True
@@ -1,3 +1,4 @@
+from collections import deque
 from cilly_lexer import *
 
 
@@ -5,7 +6,13 @@ def node_tag(ast):
     return ast[0]
 
 
+def expect_err(err, m, k):
+    err(f'期望{tuple(TK_NAMES[x] for x in m)},实际为{TK_NAMES[k]}')
+
+
+# 所有记号源的 peek(k) 都返回整数记号种类, next() 返回记号本身
 def make_tokenizer(tokens, err):
+    kinds = [TK_KINDS[tk_tag(t)] for t in tokens]
     pos = -1
     cur = None
 
@@ -20,14 +27,14 @@ def make_tokenizer(tokens, err):
         return t
 
     def peek(k=0):
-        if k + pos >= len(tokens):
-            return 'eof'
+        if k + pos >= len(kinds):
+            return TK_EOF
         else:
-            return tk_tag(tokens[k + pos])
+            return kinds[k + pos]
 
     def match(*m):
         if peek() not in m:
-            err(f'期望{m},实际为{peek()}')
+            expect_err(err, m, peek())
 
         return next()
 
@@ -35,125 +42,187 @@ def make_tokenizer(tokens, err):
     return (next, peek, match)
 
 
-def parser(tokens):
-    def expr():
-        return logic_or()
+# 流式记号源: tokens 是记号迭代器(如 iter_tokens), 只在环形缓冲区里保留 peek(k) 需要的前瞻记号
+def make_stream_tokenizer(tokens, err):
+    pull = iter(tokens).__next__
+    ahead = deque()
+    ahead_kinds = deque()
 
-    def logic_or():
-        ret = logic_and()
-        while peek() in ['or']:
-            op = tk_tag(next())
-            ret = [op, ret, logic_and()]
-        return ret
+    def fill(k):
+        while len(ahead) <= k:
+            try:
+                t = pull()
+            except StopIteration:
+                t = make_tk('eof')
+            ahead.append(t)
+            ahead_kinds.append(TK_KINDS[tk_tag(t)])
 
-    def logic_and():
-        ret = equality()
-        while peek() in ['and']:
-            op = tk_tag(next())
-            ret = [op, ret, equality()]
-        return ret
+    def next():
+        if not ahead:
+            fill(0)
+        ahead_kinds.popleft()
+        return ahead.popleft()
 
-    def equality():
-        ret = comparison()
-        while peek() in ['==', '!=']:
-            op = tk_tag(next())
-            ret = ['binop', op, ret, comparison()]
-        return ret
+    def peek(k=0):
+        if len(ahead) <= k:
+            fill(k)
+        return ahead_kinds[k]
 
-    def comparison():
-        ret = term()
-        while peek() in ['>', '>=', '<', '<=']:
-            op = tk_tag(next())
-            ret = ['binop', op, ret, term()]
-        return ret
+    def match(*m):
+        if peek() not in m:
+            expect_err(err, m, peek())
 
-    def term():
-        ret = factor()
-        while peek() in ['+', '-']:
-            op = tk_tag(next())
-            ret = ['binop', op, ret, factor()]
-        return ret
+        return next()
+
+    return (next, peek, match)
 
-    def factor():
-        ret = unary()
-        while peek() in ['*', '/']:
-            op = tk_tag(next())
-            ret = ['binop', op, ret, unary()]
-        return ret
 
-    def unary():
-        if peek() == '-':
-            match('-')
-            return ['uinop', '-', unary()]
-        elif peek() == '!':
-            match('!')
-            return ['uinop', '!', unary()]
+# 紧凑记号源: 直接读 TokenBuffer 的种类数组, 只有 next() 取出的记号才物化成列表
+def make_buffer_tokenizer(buf, err):
+    kinds = buf.kinds
+    n = len(kinds)
+    pos = 0
+
+    def next():
+        nonlocal pos
+        t = buf.token(pos) if pos < n else make_tk('eof')
+        pos = pos + 1
+        return t
+
+    def peek(k=0):
+        if k + pos >= n:
+            return TK_EOF
         else:
-            return pow()
-
-    def pow():
-        ret = atom()
-        if peek() == '!':
-            match('!')
-            ret = ['uinop', 'frac', ret]
-        if peek() == '^':
-            match('^')
-            ret = ['binop', '^', ret, pow()]
-        return ret
+            return kinds[k + pos]
+
+    def match(*m):
+        k = peek()
+        if k not in m:
+            line, col = buf.line_col(buf.starts[pos] if pos < n else len(buf.source))
+            expect_err(lambda msg: err(f'{msg} ({line}行{col}列)'), m, k)
+
+        return next()
+
+    # 当前记号的起始偏移, 以及上一个已取出记号的结束偏移
+    def where():
+        return (buf.starts[pos] if pos < n else len(buf.source),
+                buf.ends[pos - 1] if pos > 0 else 0)
+
+    return (next, peek, match, where)
+
+
+# 中缀/后缀运算符的左绑定力, 数值越大结合越紧; 0 表示不是中缀运算符
+# 前缀 - 和 ! 的操作数按 PREFIX_BP 解析, 因此只吸收 ^ 和后缀 !(阶乘)
+INFIX_BP = [0] * len(TK_NAMES)
+INFIX_BP[TK_OR] = 4
+INFIX_BP[TK_AND] = 6
+INFIX_BP[TK_EQ] = INFIX_BP[TK_NE] = 10
+INFIX_BP[TK_GT] = INFIX_BP[TK_GE] = INFIX_BP[TK_LT] = INFIX_BP[TK_LE] = 20
+INFIX_BP[TK_ADD] = INFIX_BP[TK_SUB] = 30
+INFIX_BP[TK_MUL] = INFIX_BP[TK_DIV] = 40
+INFIX_BP[TK_POW] = 60
+INFIX_BP[TK_NOT] = 70
+PREFIX_BP = 50
+
+
+# spans 不为 None 时(需要 TokenBuffer), 记录每个语法树节点的源码位置 {id(节点): (起, 止)}
+def parser(tokens, spans=None):
+    def begin():
+        return where()[0] if spans is not None else 0
+
+    # 空语句 ';' 的语法树为 None, 不记录位置
+    def mark(node, start):
+        if spans is not None and node is not None:
+            spans[id(node)] = (start, where()[1])
+        return node
+
+    def expr(rbp=0):
+        start = begin()
+        ret = prefix()
+        while True:
+            k = peek()
+            bp = INFIX_BP[k]
+            if bp <= rbp:
+                return ret
+
+            op = tk_tag(next())
+            if k == TK_NOT:
+                ret = ['uinop', 'frac', ret]
+            elif k == TK_POW:
+                # 右结合
+                ret = ['binop', op, ret, expr(bp - 1)]
+            elif k == TK_AND or k == TK_OR:
+                ret = [op, ret, expr(bp)]
+            else:
+                ret = ['binop', op, ret, expr(bp)]
+            mark(ret, start)
+
+    def prefix():
+        start = begin()
+        k = peek()
+        if k == TK_SUB:
+            match(TK_SUB)
+            return mark(['uinop', '-', expr(PREFIX_BP)], start)
+        elif k == TK_NOT:
+            match(TK_NOT)
+            return mark(['uinop', '!', expr(PREFIX_BP)], start)
+        else:
+            return mark(atom(), start)
 
     def atom():
-        if peek() == 'num':
-            return match('num')
-        if peek() == 'true':
-            return match('true')
-        if peek() == 'false':
-            return match('false')
-        if peek() == 'str':
-            return match('str')
-        if peek() == 'T':
-            return match('T')
-        if peek() == '[':
-            match('[')
+        if peek() == TK_NUM:
+            return match(TK_NUM)
+        # 无值记号在记号流里是共享的, 语法树里用新的列表, 以便各自记录位置
+        if peek() == TK_TRUE:
+            return make_tk(tk_tag(match(TK_TRUE)))
+        if peek() == TK_FALSE:
+            return make_tk(tk_tag(match(TK_FALSE)))
+        if peek() == TK_STR:
+            return match(TK_STR)
+        if peek() == TK_T:
+            return make_tk(tk_tag(match(TK_T)))
+        if peek() == TK_LBRACKET:
+            match(TK_LBRACKET)
             ret = vec()
-            match(']')
+            match(TK_RBRACKET)
             return ['vec', ret]
-        if peek() == 'id':
-            if peek(1) == '(':
+        if peek() == TK_ID:
+            if peek(1) == TK_LPAREN:
                 return call()
             else:
                 return variable()
-        if peek() == '(':
-            match('(')
+        if peek() == TK_LPAREN:
+            match(TK_LPAREN)
             ret = expr()
-            match(')')
+            match(TK_RPAREN)
             return ret
         return None
 
     def vec():
-        if peek() == ']':
+        if peek() == TK_RBRACKET:
             return []
         ret = [expr()]
-        while peek() == ',':
-            match(',')
+        while peek() == TK_COMMA:
+            match(TK_COMMA)
             ret.append(expr())
         return ret
 
     def variable():
-        if peek() == 'id':
-            t = match('id')
-            if peek() != '[':
+        if peek() == TK_ID:
+            t = match(TK_ID)
+            if peek() != TK_LBRACKET:
                 return t
             pos = []
-            while peek() == '[':
-                match('[')
+            while peek() == TK_LBRACKET:
+                match(TK_LBRACKET)
                 ret = expr()
-                match(']')
+                match(TK_RBRACKET)
                 pos.append(ret)
             return (t, ['vec', pos])
 
     def call():
-        t = match('id')
-        match('(')
+        t = mark(match(TK_ID), begin())
+        match(TK_LPAREN)
 
         tv = tk_val(t)
 
@@ -161,177 +230,193 @@ def parser(tokens):
         if tv in ['input']:
             ret = [tv]
         # 系统函数 - 一参
-        elif tv in ['arr', 'int', 'len', 'type', 'abs', 'show', 'inv', 'det', 'tr', 'eig']:
+        elif tv in ['arr', 'int', 'len', 'type', 'abs', 'show', 'inv', 'det', 'tr', 'eig', 'load']:
             ret = [tv, expr()]
+        # 系统函数 - 两参
+        elif tv in ['save']:
+            ret = [tv, expr()]
+            match(TK_COMMA)
+            ret.append(expr())
         # 调用
         else:
             ret = ['call', t, args()]
 
-        match(')')
+        match(TK_RPAREN)
         return ret
 
     def params():
-        if peek() == ')':
+        if peek() == TK_RPAREN:
             return []
-        t = tk_val(match('id'))
+        t = tk_val(match(TK_ID))
         ret = [t]
-        while peek() == ',':
-            match(',')
-            ret.append(tk_val(match('id')))
+        while peek() == TK_COMMA:
+            match(TK_COMMA)
+            ret.append(tk_val(match(TK_ID)))
         return ret
 
     def args():
-        if peek() == ')':
+        if peek() == TK_RPAREN:
             return []
         ret = [expr()]
-        while peek() == ',':
-            match(',')
+        while peek() == TK_COMMA:
+            match(TK_COMMA)
             ret.append(expr())
         return ret
 
     def err(m):
         error('cilly parser', m)
 
-    next, peek, match = make_tokenizer(tokens, err)
+    if isinstance(tokens, list):
+        next, peek, match = make_tokenizer(tokens, err)
+    elif isinstance(tokens, TokenBuffer):
+        next, peek, match, where = make_buffer_tokenizer(tokens, err)
+    else:
+        next, peek, match = make_stream_tokenizer(tokens, err)
+
+    if spans is not None and not isinstance(tokens, TokenBuffer):
+        err('记录源码位置需要 TokenBuffer')
 
     def program():
+        start = begin()
         r = []
-        while peek() != 'eof':
+        while peek() != TK_EOF:
             r.append(statement())
-        return ['program', r]
+        return mark(['program', r], start)
 
     def statement():
+        start = begin()
+        return mark(stat(), start)
+
+    def stat():
         t = peek()
 
-        if t == 'import':
+        if t == TK_IMPORT:
             return import_stat()
 
-        if t == 'fun':
+        if t == TK_FUN:
             return fun_stat()
 
-        if t == '{':
+        if t == TK_LBRACE:
             return block_stat()
 
-        if t == 'while':
+        if t == TK_WHILE:
             return while_stat()
 
-        if t == 'if':
+        if t == TK_IF:
             return if_stat()
 
-        if t == 'return':
+        if t == TK_RETURN:
             return ret_stat()
 
-        if t == 'continue':
+        if t == TK_CONTINUE:
             return continue_stat()
 
-        if t == 'break':
+        if t == TK_BREAK:
             return break_stat()
 
-        if t == 'print':
+        if t == TK_PRINT:
             return print_stat()
 
-        if t == 'var':
+        if t == TK_VAR:
             return var_stat()
 
-        if t == 'id':
-            pos = 1
-            while peek(pos) != 'eof' and peek(pos) != ';':
-                if peek(pos) == '=':
-                    return assign_stat()
-                pos += 1
-
-        # 默认处理为匹配表达式
+        # 默认处理为匹配表达式, 表达式后紧跟 '=' 时按赋值处理
         return expr_stat()
 
     def import_stat():
-        match('import')
-        ret = tk_val(match('str'))
-        match(';')
+        match(TK_IMPORT)
+        ret = tk_val(match(TK_STR))
+        match(TK_SEMI)
         return ['import', ret]
 
     def expr_stat():
         ret = expr()
-        match(';')
+        if peek() == TK_ASSIGN:
+            return assign_stat(ret)
+        match(TK_SEMI)
         return ret
 
     def fun_stat():
-        match('fun')
-        id = match('id')
-        match('(')
+        match(TK_FUN)
+        id = match(TK_ID)
+        match(TK_LPAREN)
         ret = params()
-        match(')')
+        match(TK_RPAREN)
         return ['fun', tk_val(id), ret, block_stat()]
 
     def block_stat():
-        match('{')
+        start = begin()
+        match(TK_LBRACE)
         r = []
-        while peek() != '}':
+        while peek() != TK_RBRACE:
             r.append(statement())
-        match('}')
-        return ['block', r]
+        match(TK_RBRACE)
+        return mark(['block', r], start)
 
     def while_stat():
-        match('while')
-        match('(')
+        match(TK_WHILE)
+        match(TK_LPAREN)
         ret = expr()
-        match(')')
+        match(TK_RPAREN)
         return ['while', ret, statement()]
 
     def if_stat():
-        match('if')
-        match('(')
+        match(TK_IF)
+        match(TK_LPAREN)
         ret = expr()
-        match(')')
+        match(TK_RPAREN)
         sta = statement()
-        if peek() == 'else':
-            match('else')
+        if peek() == TK_ELSE:
+            match(TK_ELSE)
             return ['if', ret, sta, statement()]
         else:
             return ['if', ret, sta, None]
 
     def ret_stat():
-        match('return')
-        if peek() != ';':
+        match(TK_RETURN)
+        if peek() != TK_SEMI:
             e = expr()
         else:
             e = None
-        match(';')
+        match(TK_SEMI)
         return ['return', e]
 
     def print_stat():
-        match('print')
-        match('(')
+        match(TK_PRINT)
+        match(TK_LPAREN)
         ret = args()
-        match(')')
-        match(';')
+        match(TK_RPAREN)
+        match(TK_SEMI)
         return ['print', ret]
 
     def var_stat():
-        match('var')
-        id = match('id')
-        if peek() == '=':
-            match('=')
+        match(TK_VAR)
+        id = match(TK_ID)
+        if peek() == TK_ASSIGN:
+            match(TK_ASSIGN)
             e = expr()
         else:
             e = None
-        match(';')
+        match(TK_SEMI)
         return ['var', id, e]
 
-    def assign_stat():
-        vr = variable()
-        match('=')
+    def assign_stat(vr):
+        # 赋值目标只能是变量或带下标的变量
+        if type(vr) is not tuple and (type(vr) is not list or tk_tag(vr) != 'id'):
+            err(f'{vr}不能被赋值')
+        match(TK_ASSIGN)
         ret = expr()
-        match(';')
+        match(TK_SEMI)
         return ['assign', vr, ret]
 
     def continue_stat():
-        match('continue')
-        match(';')
+        match(TK_CONTINUE)
+        match(TK_SEMI)
         return ['continue']
 
     def break_stat():
-        match('break')
-        match(';')
+        match(TK_BREAK)
+        match(TK_SEMI)
         return ['break']
 
     return program()
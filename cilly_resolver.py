@@ -0,0 +1,163 @@
+from cilly_ast import *
+
+# 词法地址解析: 在执行前把每个变量引用解析为 (depth, slot)
+# depth 为向外跨过的函数层数, slot 为该层函数帧中的下标; 顶层(全局)变量解析为 None, 运行时按名字查全局 dict
+# 每个函数调用一个帧: 定长 Python 列表, 下标 0 为定义处的外层帧, 参数和函数体内声明的变量依次占后面的槽
+# 与 eval 一致, 代码块不单独成作用域, 函数体内任何位置的 var/fun 都属于该函数
+# 槽在对应的 var/fun 执行(或参数传入)之前是未定义的, 这时与 eval 一样按外层变量、import 的模块、全局变量的顺序查找
+# 只有一定已定义的引用(函数体顶层更早的语句中声明的变量)直接按 (depth, slot) 访问, 其余的按查找链在运行时逐个检查
+
+
+# 函数体内 import 的模块列表放在这个名字对应的槽里, 它不会与标识符重名
+IMPORT_NAME = '%import'
+
+
+class Scope:
+    __slots__ = ('names', 'parent', 'decls', 'pos', 'defining')
+
+    def __init__(self, parent):
+        self.names = {}
+        self.parent = parent
+        # 函数体顶层 var/fun 语句声明的名字 -> 最早的语句序号
+        self.decls = {}
+        # 正在解析的函数体顶层语句序号, 以及该语句为函数定义时的函数名
+        self.pos = 0
+        self.defining = None
+
+    def declare(self, name):
+        if name not in self.names:
+            self.names[name] = len(self.names) + 1
+        return self.names[name]
+
+    # 帧的长度
+    def size(self):
+        return len(self.names) + 1
+
+    # 在当前解析位置 name 是否一定已定义: 顶层更早的语句声明了它, 或者是在它自己的函数体中(递归)
+    def bound(self, name):
+        i = self.decls.get(name)
+        if i is None:
+            return False
+        return i < self.pos or (i == self.pos and name == self.defining)
+
+
+class Resolution:
+    __slots__ = ('addrs', 'chains', 'frames')
+
+    def __init__(self):
+        # 变量引用或定义节点(Id, Index, Var, Fun, Import) -> (depth, slot), 全局为 None
+        # 引用在 chains 中时为最近一层声明它的槽, 只作参考
+        self.addrs = {}
+        # 运行时才能确定位置的引用 -> 查找链 [(depth, slot, 是否为模块列表槽)], 都找不到时再查全局变量
+        self.chains = {}
+        # Fun 节点 -> 帧长度
+        self.frames = {}
+
+
+# 把函数体内声明的名字依次分配槽位, 不进入嵌套函数
+def hoist(scope, node):
+    if node is None:
+        return
+
+    k = node.kind
+    if k == N_VAR or k == N_FUN:
+        scope.declare(node.name)
+    elif k == N_BLOCK or k == N_PROGRAM:
+        for s in node.stmts:
+            hoist(scope, s)
+    elif k == N_WHILE:
+        hoist(scope, node.body)
+    elif k == N_IF:
+        hoist(scope, node.then)
+        hoist(scope, node.orelse)
+    elif k == N_IMPORT:
+        scope.declare(IMPORT_NAME)
+
+
+def scope_at(scope, depth):
+    for _ in range(depth):
+        scope = scope.parent
+    return scope
+
+
+def lookup(scope, name):
+    depth = 0
+    while scope is not None:
+        slot = scope.names.get(name)
+        if slot is not None:
+            return depth, slot
+        scope = scope.parent
+        depth = depth + 1
+    return None
+
+
+# 与 eval 的查找顺序相同: 每层先查变量, 再查该层 import 的模块; 遇到一定已定义的变量为止
+def lookup_chain(scope, name):
+    chain = []
+    depth = 0
+    while scope is not None:
+        slot = scope.names.get(name)
+        if slot is not None:
+            chain.append((depth, slot, False))
+            if scope.bound(name):
+                break
+        slot = scope.names.get(IMPORT_NAME)
+        if slot is not None:
+            chain.append((depth, slot, True))
+        scope = scope.parent
+        depth = depth + 1
+    return chain
+
+
+def resolve(ast):
+    res = Resolution()
+
+    def bind(node, name, scope):
+        chain = lookup_chain(scope, name)
+        if len(chain) == 1 and not chain[0][2] and scope_at(scope, chain[0][0]).bound(name):
+            res.addrs[node] = chain[0][:2]
+            return
+        res.addrs[node] = lookup(scope, name)
+        if chain:
+            res.chains[node] = chain
+
+    def visit(node, scope):
+        if node is None:
+            return
+
+        k = node.kind
+        if k == N_ID or k == N_INDEX:
+            bind(node, node.name, scope)
+        elif k == N_VAR:
+            # 定义总是写本层的槽
+            res.addrs[node] = lookup(scope, node.name)
+        elif k == N_IMPORT:
+            res.addrs[node] = lookup(scope, IMPORT_NAME)
+            return
+        elif k == N_FUN:
+            res.addrs[node] = lookup(scope, node.name)
+            inner = Scope(scope)
+            for p in node.params:
+                inner.declare(p)
+            hoist(inner, node.body)
+            stmts = node.body.stmts if node.body is not None and node.body.kind == N_BLOCK else [node.body]
+            for i, s in enumerate(stmts):
+                if s is not None and (s.kind == N_VAR or s.kind == N_FUN) and s.name not in inner.decls:
+                    inner.decls[s.name] = i
+            for i, s in enumerate(stmts):
+                inner.pos = i
+                inner.defining = s.name if s is not None and s.kind == N_FUN else None
+                visit(s, inner)
+            res.frames[node] = inner.size()
+            return
+
+        for f in node.fields():
+            if isinstance(f, Node):
+                visit(f, scope)
+            elif type(f) is list:
+                for e in f:
+                    if isinstance(e, Node):
+                        visit(e, scope)
+
+    visit(ast, None)
+    return res
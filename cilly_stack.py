@@ -0,0 +1,330 @@
+from cilly_closure import *
+
+# 显式栈执行引擎: 每个函数体展开成一条指令序列, 函数调用也是一条指令
+# 调用时把 (指令序列, pc, 帧, 返回值槽) 压进 Python 列表, 返回时弹出, 不占用 Python 调用栈, 递归深度只受内存限制
+# `return f(...)` 编译为尾调用, 直接用新帧替换当前帧, 栈不增长
+# 不含函数调用的表达式仍交给 cilly_closure 编译成闭包; 表达式中的调用先展开成 CALL 指令, 结果存进帧中的临时槽
+# 变量地址与 cilly_closure 相同, 帧为 [外层帧, 变量槽..., 临时槽...], 顶层代码也有一个只放临时槽的帧
+
+# 指令: (op, a, b, c)
+EXEC = 0            # a(frame), 执行不含调用的语句
+CALL = 1            # 调用函数 a(frame), 实参为闭包列表 b, 返回值存入 frame[c]
+TAIL_CALL = 2       # 同 CALL, 但新帧替换当前帧
+RETURN = 3          # 返回 a(frame)
+JUMP = 4            # 跳到 b
+JUMP_FALSE = 5      # a(frame) 为假时跳到 b, 用于 while
+JUMP_NOT_TRUE = 6   # a(frame) != True 时跳到 b, 用于 if, 与 eval 的判断一致
+
+# 临时槽在语法树中表示为这个名字的 Id, 解析地址为 (0, 槽号)
+TEMP_NAME = '%t'
+
+CONSTANT_KINDS = {N_NUM, N_STR, N_BOOL, N_TRANS}
+
+
+class Code:
+    __slots__ = ('instrs', 'size')
+
+    def __init__(self, instrs, size):
+        self.instrs = instrs
+        self.size = size
+
+    def __repr__(self):
+        return f'<code {len(self.instrs)} instrs>'
+
+
+# 一个函数体(或顶层代码)的编译状态, 临时槽从 base 开始, 每条语句重新分配
+class Lowering:
+    __slots__ = ('ctx', 'calls', 'instrs', 'base', 'temp', 'size')
+
+    def __init__(self, ctx, calls, base):
+        self.ctx = ctx
+        self.calls = calls
+        self.instrs = []
+        self.base = base
+        self.temp = base
+        self.size = base
+
+    def emit(self, op, a=None, b=None, c=None):
+        self.instrs.append((op, a, b, c))
+        return len(self.instrs) - 1
+
+    # 把第 i 条跳转指令的目标设为下一条指令
+    def patch(self, i):
+        op, a, _, c = self.instrs[i]
+        self.instrs[i] = (op, a, len(self.instrs), c)
+
+    def code(self, node):
+        return compile_node(node, self.ctx)
+
+    def new_temp(self):
+        slot = self.temp
+        self.temp = slot + 1
+        self.size = max(self.size, self.temp)
+        return slot
+
+    def temp_id(self, slot):
+        node = Id(TEMP_NAME)
+        self.ctx.res.addrs[node] = (0, slot)
+        return node
+
+    # 先求值 node 存入临时槽, 返回读取该槽的节点
+    def spill(self, node):
+        slot = self.new_temp()
+        f = self.code(node)
+
+        def store(frame):
+            frame[slot] = f(frame)
+        self.emit(EXEC, store)
+        return self.temp_id(slot)
+
+    # 改写出的新节点沿用原节点的变量地址
+    def rebind(self, old, new):
+        res = self.ctx.res
+        res.addrs[new] = res.addrs[old]
+        if old in res.chains:
+            res.chains[new] = res.chains[old]
+        return new
+
+
+def is_temp(node):
+    return node.kind == N_ID and node.name == TEMP_NAME
+
+
+# 表达式中是否有函数调用, 结果按节点记在 memo 中
+def has_call(node, memo):
+    if not isinstance(node, Node):
+        return False
+    r = memo.get(node)
+    if r is None:
+        r = node.kind == N_CALL
+        for f in node.fields():
+            if isinstance(f, Node):
+                r = has_call(f, memo) or r
+            elif type(f) is list:
+                for e in f:
+                    r = has_call(e, memo) or r
+        memo[node] = r
+    return r
+
+
+# 按顺序求值的一组子表达式: 后面还有调用时, 前面的先存进临时槽, 保持与 eval 相同的求值顺序
+def lower_operands(nodes, low):
+    last = -1
+    for i, n in enumerate(nodes):
+        if has_call(n, low.calls):
+            last = i
+
+    out = []
+    for i, n in enumerate(nodes):
+        n = lower_expr(n, low)
+        if i < last and n.kind not in CONSTANT_KINDS and not is_temp(n):
+            n = low.spill(n)
+        out.append(n)
+    return out
+
+
+# 把表达式中的调用展开成 CALL 指令, 返回不含调用的表达式
+def lower_expr(node, low):
+    if node is None or not has_call(node, low.calls):
+        return node
+
+    k = node.kind
+    if k == N_CALL:
+        parts = lower_operands([node.fn] + node.args, low)
+        slot = low.new_temp()
+        low.emit(CALL, low.code(parts[0]), [low.code(p) for p in parts[1:]], slot)
+        return low.temp_id(slot)
+    if k == N_BINOP:
+        left, right = lower_operands([node.left, node.right], low)
+        return BinOp(node.op, left, right, node.span)
+    if k == N_UINOP:
+        return UnOp(node.op, lower_expr(node.operand, low), node.span)
+    if k == N_BUILTIN:
+        return Builtin(node.name, lower_operands(node.args, low), node.span)
+    if k == N_VEC:
+        return Vec(lower_operands(node.items, low), node.span)
+    if k == N_INDEX:
+        return low.rebind(node, Index(node.name, lower_operands(node.indexes, low), node.span))
+    # 其余节点执行到时报错, 与 eval 一致
+    return node
+
+
+def lower_stmt(node, low):
+    if node is None:
+        return
+
+    low.temp = low.base
+    k = node.kind
+    if k == N_BLOCK or k == N_PROGRAM:
+        for s in node.stmts:
+            lower_stmt(s, low)
+
+    elif k == N_IF:
+        cond = lower_expr(node.cond, low)
+        jump = low.emit(JUMP_NOT_TRUE, low.code(cond))
+        lower_stmt(node.then, low)
+        if node.orelse is None:
+            low.patch(jump)
+        else:
+            skip = low.emit(JUMP)
+            low.patch(jump)
+            lower_stmt(node.orelse, low)
+            low.patch(skip)
+
+    elif k == N_WHILE:
+        head = len(low.instrs)
+        cond = lower_expr(node.cond, low)
+        jump = low.emit(JUMP_FALSE, low.code(cond))
+        lower_stmt(node.body, low)
+        low.emit(JUMP, None, head)
+        low.patch(jump)
+
+    elif k == N_RETURN:
+        v = node.value
+        if v is not None and v.kind == N_CALL:
+            parts = lower_operands([v.fn] + v.args, low)
+            low.emit(TAIL_CALL, low.code(parts[0]), [low.code(p) for p in parts[1:]])
+        elif v is None:
+            low.emit(RETURN, lambda frame: None)
+        else:
+            low.emit(RETURN, low.code(lower_expr(v, low)))
+
+    elif k == N_FUN:
+        name = node.name
+        params = node.params
+        body = lower_function(node.body, low.ctx.res.frames[node], low, None)
+        store = compile_store(node, low.ctx, False)
+
+        def define(frame):
+            store(frame, Closure(name, params, body.size, body, frame, cilly_memo.new_cache(node)))
+        low.emit(EXEC, define)
+
+    elif k == N_PRINT:
+        low.emit(EXEC, low.code(Print(lower_operands(node.args, low), node.span)))
+
+    elif k == N_VAR:
+        var = low.rebind(node, Var(node.name, lower_expr(node.init, low), node.span))
+        low.emit(EXEC, low.code(var))
+
+    elif k == N_ASSIGN:
+        target = node.target
+        if target.kind == N_INDEX:
+            parts = lower_operands(target.indexes + [node.value], low)
+            target = low.rebind(target, Index(target.name, parts[:-1], target.span))
+            value = parts[-1]
+        else:
+            value = lower_expr(node.value, low)
+        low.emit(EXEC, low.code(Assign(target, value, node.span)))
+
+    else:
+        # 表达式语句; 单独的调用已经展开成 CALL, 不需要再执行
+        n = lower_expr(node, low)
+        if not is_temp(n):
+            low.emit(EXEC, low.code(n))
+
+
+# 编译函数体, 执行完最后一条语句时返回 end
+def lower_function(body, base, parent, end):
+    low = Lowering(parent.ctx, parent.calls, base)
+    lower_stmt(body, low)
+    low.emit(RETURN, lambda frame: end)
+    return Code(low.instrs, low.size)
+
+
+def run_code(code, frame):
+    # 调用栈: (调用者的指令序列, 返回地址, 调用者的帧, 返回值槽, 返回时要存入的记忆化缓存)
+    # 最后一项为 None 或 [(缓存, 键), ...]; 尾调用的结果就是当前调用的结果, 被调函数的缓存项也挂在这里
+    # 返回时从最内层的调用开始存, 外层调用最后存入, 与递归求值时 LRU 的顺序相同
+    stack = []
+    instrs = code.instrs
+    pc = 0
+    while True:
+        op, a, b, c = instrs[pc]
+        pc = pc + 1
+        if op == EXEC:
+            a(frame)
+
+        elif op == CALL or op == TAIL_CALL:
+            f = a(frame)
+            if type(f) is not Closure:
+                err(f'{f} is not a function')
+
+            new_frame = [UNBOUND] * f.size
+            new_frame[0] = f.frame
+            # 与 eval 一致, 实参与形参个数不同时按较少的一方对应, 缺少的参数未定义
+            n = len(b)
+            k = min(n, len(f.params))
+            for i in range(k):
+                new_frame[i + 1] = b[i](frame)
+            for i in range(k, n):
+                b[i](frame)
+
+            stores = None
+            memo = f.memo
+            if memo is not None:
+                key = cilly_memo.memo_key(new_frame[1:k + 1])
+                if key is not None:
+                    value = memo.get(key)
+                    if value is not cilly_memo.MISSING:
+                        if op == CALL:
+                            frame[c] = value
+                            continue
+                        # 尾调用命中, 相当于直接返回
+                        if not stack:
+                            return value
+                        instrs, pc, frame, slot, stores = stack.pop()
+                        frame[slot] = value
+                        if stores is not None:
+                            for m, key in reversed(stores):
+                                cilly_memo.store(m, key, value)
+                        continue
+                    stores = [(memo, key)]
+
+            if op == CALL:
+                stack.append((instrs, pc, frame, c, stores))
+            elif stores is not None and stack:
+                top = stack[-1]
+                if top[4] is None:
+                    stack[-1] = top[:4] + (stores,)
+                else:
+                    top[4].extend(stores)
+            instrs = f.body.instrs
+            pc = 0
+            frame = new_frame
+
+        elif op == RETURN:
+            value = a(frame)
+            if not stack:
+                return value
+            instrs, pc, frame, slot, stores = stack.pop()
+            frame[slot] = value
+            if stores is not None:
+                for m, key in reversed(stores):
+                    cilly_memo.store(m, key, value)
+
+        elif op == JUMP:
+            pc = b
+
+        elif op == JUMP_FALSE:
+            if not a(frame):
+                pc = b
+
+        else:
+            if not (a(frame) == True):
+                pc = b
+
+
+# 编译整个程序, 返回无参函数, 调用即在 envir 中执行
+def compile_stack(ast, envir):
+    if not isinstance(ast, Node):
+        ast = from_list(ast)
+    ast = cilly_fold.fold(ast)
+    if cilly_memo.memo_enabled:
+        cilly_memo.analyze(ast)
+    top = Lowering(Context(resolve(ast), envir, execute_stack), {}, 1)
+    code = lower_function(ast, 1, top, "")
+    return lambda: run_code(code, [None] * code.size)
+
+
+def execute_stack(ast, envir):
+    return compile_stack(ast, envir)()
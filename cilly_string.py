@@ -0,0 +1,121 @@
+# 字符串拼接: s = s + t 每次都复制整个 s, 循环中反复追加时总耗时与长度的平方成正比
+# 长字符串的拼接结果改用 Rope: 只把片段追加到列表, 摊还 O(1); 取值(打印、比较、取下标、len 以外的运算)时才合并成 str 并缓存
+# 多个 Rope 共用一个片段列表, count 为自己用到的前几段; 追加时只有自己是列表的最后使用者才原地追加, 否则先复制前 count 段
+#   s = s + "a"; t = s + "b"; s = s + "c" 中各个值互不影响, 与不可变的 str 一致
+
+# 为 False 时拼接总是得到 str, 供基准对比
+rope_enabled = True
+
+# 左操作数短于这个长度时直接复制, 比维护片段列表更快
+ROPE_MIN = 64
+
+
+class Rope:
+    __slots__ = ('parts', 'count', 'size', 'text')
+
+    def __init__(self, parts, count, size):
+        self.parts = parts
+        self.count = count
+        self.size = size
+        # 合并后的 str
+        self.text = None
+
+    def flat(self):
+        if self.text is None:
+            parts = self.parts
+            if len(parts) != self.count:
+                parts = parts[:self.count]
+            self.text = ''.join(parts)
+            # 之后再追加时从合并好的一段开始, 不再引用共用的列表
+            self.parts = [self.text]
+            self.count = 1
+        return self.text
+
+    def __add__(self, other):
+        if type(other) is Rope:
+            other = other.flat()
+        elif type(other) is not str:
+            # 与 str 报相同的类型错误
+            return self.flat() + other
+        parts = self.parts
+        if len(parts) != self.count:
+            parts = parts[:self.count]
+        parts.append(other)
+        return Rope(parts, self.count + 1, self.size + len(other))
+
+    def __radd__(self, other):
+        if type(other) is str:
+            return concat(other, self.flat())
+        return other + self.flat()
+
+    def __mul__(self, n):
+        return self.flat() * n
+
+    __rmul__ = __mul__
+
+    def __len__(self):
+        return self.size
+
+    def __bool__(self):
+        return self.size > 0
+
+    def __getitem__(self, i):
+        return self.flat()[i]
+
+    def __iter__(self):
+        return iter(self.flat())
+
+    def __contains__(self, s):
+        return text(s) in self.flat()
+
+    def __eq__(self, other):
+        return self.flat() == text(other)
+
+    def __ne__(self, other):
+        return self.flat() != text(other)
+
+    def __lt__(self, other):
+        return self.flat() < text(other)
+
+    def __le__(self, other):
+        return self.flat() <= text(other)
+
+    def __gt__(self, other):
+        return self.flat() > text(other)
+
+    def __ge__(self, other):
+        return self.flat() >= text(other)
+
+    def __hash__(self):
+        return hash(self.flat())
+
+    def __int__(self):
+        return int(self.flat())
+
+    def __float__(self):
+        return float(self.flat())
+
+    def __str__(self):
+        return self.flat()
+
+    def __repr__(self):
+        return repr(self.flat())
+
+
+# Rope 合并成 str, 其余值原样返回
+def text(x):
+    if type(x) is Rope:
+        return x.flat()
+    return x
+
+
+# str + 值
+def concat(a, b):
+    b = text(b)
+    if not rope_enabled or len(a) < ROPE_MIN or type(b) is not str:
+        return a + b
+    return Rope([a, b], 2, len(a) + len(b))
+
+
+def is_string(x):
+    return type(x) is str or type(x) is Rope
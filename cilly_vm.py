@@ -1,247 +1,393 @@
+import operator
 from cilly_vm_compiler import *
+from cilly_string import concat
+import cilly_memo
 
 
-def num(n):
-    return ['num', n]
-
-
-def string(s):
-    return ['str', s]
+# 打印用: 带标签的值(空值、函数)取标签后的部分, 其余值原样返回
+def val(v):
+    return v[1] if type(v) is list else v
 
 
-def boolean(b):
-    return T if b else F
+# 执行方式:
+#   table: 每条指令按操作码查表分派, handlers[op](操作数1, 操作数2, 下一条指令的地址) 返回接着执行的地址
+#   threaded: 执行前先把每条指令译成一个无参的闭包, 操作数和常量绑定在闭包中, 跳转目标换成指令序号,
+#     循环中只调用闭包; 预译码的开销与代码长度成正比, 长时间运行的程序用这种方式最快
+DISPATCH_MODES = ('table', 'threaded')
 
+COMPARE = {
+    BINOP_GT: operator.gt,
+    BINOP_GE: operator.ge,
+    BINOP_LT: operator.lt,
+    BINOP_LE: operator.le,
+    BINOP_EQ: operator.eq,
+    BINOP_NE: operator.ne,
+}
 
-def val(v):
-    return v[1]
+ARITH = {
+    BINOP_SUB: operator.sub,
+    BINOP_MUL: operator.mul,
+    BINOP_DIV: operator.truediv,
+    BINOP_XOR: operator.xor,
+}
 
 
-def cilly_vm(code, consts, globs):
+def cilly_vm(code, consts, globs, dispatch='table'):
     stack = []
     callStack = []
-    scopes = [globs]
+    # 当前帧: 列表, 下标 0 为外层帧, 后面是变量的槽位; 顶层代码没有帧, 变量都在 globs 中
+    frame = None
+    # 函数入口地址的单位: table 方式为字, threaded 方式为指令
+    unit = WORD if dispatch == 'threaded' else 1
+
+    push = stack.append
+    pop = stack.pop
 
     def err(msg):
         error('cilly vm', msg)
 
-    def push_call_stack(c):
-        callStack.append(c)
-
-    def pop_call_stack():
-        return callStack.pop()
-
-    def enter_scope(var_count):
-        nonlocal scopes
-        scope = [None for _ in range(var_count)]
-        scopes = scopes + [scope]
-
-    def leave_scope():
-        nonlocal scopes
-        scopes = scopes[0:-1]
-
-    def current_scope():
-        return scopes[-1]
-
-    def load_var(scope_i, i):
-        scope = scopes[-(scope_i + 1)]
-        push(scope[i])
-
-    def store_var(scope_i, i):
-        scope = scopes[-(scope_i + 1)]
-        scope[i] = top()
-
-    def push(x):
-        stack.append(x)
-
-    def pop():
-        t = stack.pop()
-        return t
-
-    def top():
-        return stack[-1]
-
-    def empty():
-        return len(stack) == 0
-
-    def init_stack():
-        nonlocal stack
-        stack = []
-
-    def binop(op):
-        v2 = val(pop())
-        v1 = val(pop())
-
-        if op == '+':
-            v = num(v1 + v2)
-        elif op == '-':
-            v = num(v1 - v2)
-        elif op == '*':
-            v = num(v1 * v2)
-        elif op == '/':
-            v = num(v1 / v2)
-        elif op == '>':
-            v = boolean(v1 > v2)
-        elif op == '>=':
-            v = boolean(v1 >= v2)
-        elif op == '<':
-            v = boolean(v1 < v2)
-        elif op == '<=':
-            v = boolean(v1 <= v2)
-        elif op == '==':
-            v = boolean(v1 == v2)
-        elif op == '!=':
-            v = boolean(v1 != v2)
+    def load_const(index, _, pc):
+        push(consts[index])
+        return pc
+
+    def load_true(a, b, pc):
+        push(True)
+        return pc
+
+    def load_false(a, b, pc):
+        push(False)
+        return pc
+
+    def load_null(a, b, pc):
+        push(Null)
+        return pc
+
+    def outer_frame(depth):
+        f = frame
+        while depth:
+            f = f[0]
+            depth -= 1
+        return f
+
+    def load_var(depth, i, pc):
+        push((outer_frame(depth) if depth else frame)[i])
+        return pc
+
+    def store_var(depth, i, pc):
+        (outer_frame(depth) if depth else frame)[i] = stack[-1]
+        return pc
+
+    def load_global(index, _, pc):
+        push(globs[index])
+        return pc
+
+    # 与 STORE_VAR 一样, 赋的值留在栈上
+    def store_global(index, _, pc):
+        globs[index] = stack[-1]
+        return pc
+
+    # 新建帧和回到外层帧都不复制帧链
+    def enter_scope(var_count, _, pc):
+        nonlocal frame
+        f = [None] * (var_count + 1)
+        f[0] = frame
+        frame = f
+        return pc
+
+    def leave_scope(a, b, pc):
+        nonlocal frame
+        frame = frame[0]
+        return pc
+
+    # 每个二元运算一个处理函数, 不再按运算符字符串二次分派
+    def binop_add(a, b, pc):
+        v2 = pop()
+        v1 = pop()
+        push(concat(v1, v2) if type(v1) is str else v1 + v2)
+        return pc
+
+    def binop_sub(a, b, pc):
+        v2 = pop()
+        push(pop() - v2)
+        return pc
+
+    def binop_mul(a, b, pc):
+        v2 = pop()
+        push(pop() * v2)
+        return pc
+
+    def binop_div(a, b, pc):
+        v2 = pop()
+        push(pop() / v2)
+        return pc
+
+    def binop_gt(a, b, pc):
+        v2 = pop()
+        push(pop() > v2)
+        return pc
+
+    def binop_ge(a, b, pc):
+        v2 = pop()
+        push(pop() >= v2)
+        return pc
+
+    def binop_lt(a, b, pc):
+        v2 = pop()
+        push(pop() < v2)
+        return pc
+
+    def binop_le(a, b, pc):
+        v2 = pop()
+        push(pop() <= v2)
+        return pc
+
+    def binop_eq(a, b, pc):
+        v2 = pop()
+        push(pop() == v2)
+        return pc
+
+    def binop_ne(a, b, pc):
+        v2 = pop()
+        push(pop() != v2)
+        return pc
+
+    def uniop_not(a, b, pc):
+        push(pop() is not True)
+        return pc
+
+    def uniop_neg(a, b, pc):
+        push(-pop())
+        return pc
+
+    # 与 eval 相同: n! 为 n * 1 * 2 * ... * (n-1)
+    def uniop_frac(a, b, pc):
+        num = n = pop()
+        for i in range(1, n):
+            num *= i
+        push(num)
+        return pc
+
+    def binop_xor(a, b, pc):
+        v2 = pop()
+        push(pop() ^ v2)
+        return pc
+
+    def jmp(target, _, pc):
+        return target
+
+    def jmp_true(target, _, pc):
+        return target if pop() is True else pc
+
+    def jmp_false(target, _, pc):
+        return target if pop() is False else pc
+
+    def print_item(a, b, pc):
+        print(val(pop()), end=' ')
+        return pc
+
+    def print_newline(a, b, pc):
+        print('')
+        return pc
+
+    def pop_(a, b, pc):
+        pop()
+        return pc
+
+    def make_closure(a, b, pc):
+        tag, proc_entry, params, nlocals, memo_name = pop()
+        if tag != 'compiled fun':
+            err(f'非法函数定义{tag}')
+
+        memo = None
+        if memo_name is not None and cilly_memo.memo_enabled:
+            memo = cilly_memo.named_cache(memo_name)
+        push(['compiled closure', proc_entry // unit, params, nlocals, frame, memo])
+        return pc
+
+    # 被调函数的帧: [定义处的帧, 参数..., 局部变量...]
+    def call(args, _, pc):
+        nonlocal frame
+        base = len(stack) - args - 1
+        tag, proc_entry, params, nlocals, parent, memo = stack[base]
+        if args == params:
+            f = stack[base:]
+            f[0] = parent
         else:
-            err(f'非法二元运算符{op}')
-
+            # 与 eval 一致, 实参与形参个数不同时按较少的一方对应, 缺少的参数为空值
+            f = [parent] + stack[base + 1:base + 1 + min(args, params)]
+            f.extend([Null] * (params - args))
+        del stack[base:]
+        if nlocals:
+            f.extend([None] * nlocals)
+
+        key = None
+        if memo is not None:
+            key = cilly_memo.memo_key(f[1:params + 1])
+            if key is not None:
+                v = memo.get(key)
+                if v is not cilly_memo.MISSING:
+                    push(v)
+                    return pc
+
+        # 保存调用者的帧和栈高度, 返回时丢弃被调函数留在栈上的值; 记忆化的调用返回时把结果存入缓存
+        callStack.append((pc, frame, len(stack), memo, key))
+
+        frame = f
+        return proc_entry
+
+    def ret(a, b, _):
+        nonlocal frame
+        v = pop()
+        pc, frame, height, memo, key = callStack.pop()
+        del stack[height:]
         push(v)
+        # 只缓存不可变的数、字符串和布尔, 空值和函数是列表, 不缓存
+        if key is not None and type(v) in cilly_memo.KEY_TYPES:
+            memo.put(key, v)
+        return pc
+
+    def illegal(op):
+        def handler(a, b, pc):
+            err(f'非法指令{op}')
+        return handler
+
+    handlers = [illegal(op) for op in range(max(zl.values()) + 1)]
+    handlers[LOAD_CONST] = load_const
+    handlers[LOAD_TRUE] = load_true
+    handlers[LOAD_FALSE] = load_false
+    handlers[LOAD_NULL] = load_null
+    handlers[LOAD_VAR] = load_var
+    handlers[STORE_VAR] = store_var
+    handlers[LOAD_GLOBAL] = load_global
+    handlers[STORE_GLOBAL] = store_global
+    handlers[ENTER_SCOPE] = enter_scope
+    handlers[LEAVE_SCOPE] = leave_scope
+    handlers[BINOP_ADD] = binop_add
+    handlers[BINOP_SUB] = binop_sub
+    handlers[BINOP_MUL] = binop_mul
+    handlers[BINOP_DIV] = binop_div
+    handlers[BINOP_GT] = binop_gt
+    handlers[BINOP_GE] = binop_ge
+    handlers[BINOP_LT] = binop_lt
+    handlers[BINOP_LE] = binop_le
+    handlers[BINOP_EQ] = binop_eq
+    handlers[BINOP_NE] = binop_ne
+    handlers[UNIOP_NOT] = uniop_not
+    handlers[UNIOP_NEG] = uniop_neg
+    handlers[UNIOP_FRAC] = uniop_frac
+    handlers[BINOP_XOR] = binop_xor
+    handlers[JMP] = jmp
+    handlers[JMP_TRUE] = jmp_true
+    handlers[JMP_FALSE] = jmp_false
+    handlers[PRINT_ITEM] = print_item
+    handlers[PRINT_NEWLINE] = print_newline
+    handlers[POP] = pop_
+    handlers[MAKE_CLOSURE] = make_closure
+    handlers[CALL] = call
+    handlers[RET] = ret
 
     def run():
-        nonlocal scopes
-        init_stack()
-
         pc = 0
+        end = len(code)
+        while pc < end:
+            pc = handlers[code[pc]](code[pc + 1], code[pc + 2], pc + WORD)
 
-        while pc < len(code):
-            inst = code[pc]
+        return stack[-1]
 
-            pc = pc + 1
+    # 把 pc 处的指令译成闭包, 返回下一条要执行的指令序号
+    def decode(pc):
+        op, a, b = code[pc:pc + WORD]
+        nxt = pc // WORD + 1
 
-            if inst == LOAD_CONST:
-                index = code[pc]
-                pc = pc + 1
-                v = consts[index]
-                push(v)
-            elif inst == LOAD_TRUE:
-                push(T)
-
-            elif inst == MAKE_CLOSURE:
-                tag, proc_entry, params = pop()
-                if tag != 'compiled fun':
-                    err(f'非法函数定义{tag}')
-
-                push(['compiled closure', proc_entry, params, scopes])
-            elif inst == CALL:
-                args = code[pc]
-
-                enter_scope(args)
-                scope = current_scope()
-
-                for i in range(args):
-                    scope[-(i + 1)] = pop()
-
-                proc = pop()
-                tag, proc_entry, params, saved_scopes = proc
-
-                new_scopes = saved_scopes + [scope]
-
-                push_call_stack((pc + 1, scopes))
-
-                scopes = new_scopes
-                pc = proc_entry
-            elif inst == RET:
-                leave_scope()
-                pc, scopes = pop_call_stack()
-
-            elif inst == ENTER_SCOPE:
-                var_count = code[pc]
-                enter_scope(var_count)
-                pc = pc + 1
-            elif inst == LEAVE_SCOPE:
-                leave_scope()
-            elif inst == LOAD_VAR:
-                scope_i = code[pc]
-                i = code[pc + 1]
-                load_var(scope_i, i)
-                pc = pc + 2
-            elif inst == STORE_VAR:
-                scope_i = code[pc]
-                i = code[pc + 1]
-                store_var(scope_i, i)
-                pc = pc + 2
-            elif inst == LOAD_GLOBAL:
-                index = code[pc]
-                pc = pc + 1
-                v = globs[index]
+        if op == LOAD_CONST:
+            v = consts[a]
+
+            def load_const_():
                 push(v)
-            elif inst == STORE_GLOBAL:
-                index = code[pc]
-                pc = pc + 1
-                v = pop()
-                globs[index] = v
-
-            elif inst == LOAD_FALSE:
-                push(F)
-
-            elif inst == JMP:
-                target = code[pc]
-                pc = target
-
-            elif inst == JMP_TRUE:
-                target = code[pc]
-                v = pop()
-                if v == T:
-                    pc = target
-                else:
-                    pc = pc + 1
-            elif inst == JMP_FALSE:
-                target = code[pc]
-                v = pop()
-                if v == F:
-                    pc = target
-                else:
-                    pc = pc + 1
-
-            elif inst == LOAD_NULL:
-                push(Null)
-            elif inst == BINOP_ADD:
-                binop('+')
-            elif inst == BINOP_SUB:
-                binop('-')
-            elif inst == BINOP_MUL:
-                binop('*')
-            elif inst == BINOP_DIV:
-                binop('/')
-            elif inst == BINOP_GT:
-                binop('>')
-            elif inst == BINOP_GE:
-                binop('>=')
-            elif inst == BINOP_LT:
-                binop('<')
-            elif inst == BINOP_LE:
-                binop('<=')
-            elif inst == BINOP_GT:
-                binop('>')
-            elif inst == BINOP_GE:
-                binop('>=')
-            elif inst == BINOP_EQ:
-                binop('==')
-            elif inst == BINOP_NE:
-                binop('!=')
-
-            elif inst == PRINT_ITEM:
-                v = pop()
-                print(val(v), end=' ')
-            elif inst == PRINT_NEWLINE:
-                print('')
-
-            elif inst == POP:
-                pop()
-            elif inst == UNIOP_NOT:
-                v = pop()
-                if v == T:
-                    push(F)
-                else:
-                    push(T)
-            elif inst == UNIOP_NEG:
-                v = pop()
-                push(num(-val(v)))
-            else:
-                err(f'非法指令{inst}')
-
-        return top()
+                return nxt
+            return load_const_
+        if op == LOAD_GLOBAL:
+            def load_global_():
+                push(globs[a])
+                return nxt
+            return load_global_
+        if op == STORE_GLOBAL:
+            def store_global_():
+                globs[a] = stack[-1]
+                return nxt
+            return store_global_
+        # 局部变量按向外的层数展开, 不用循环
+        if op == LOAD_VAR and a == 0:
+            def load_local_():
+                push(frame[b])
+                return nxt
+            return load_local_
+        if op == STORE_VAR and a == 0:
+            def store_local_():
+                frame[b] = stack[-1]
+                return nxt
+            return store_local_
+        if op == LOAD_VAR and a == 1:
+            def load_outer_():
+                push(frame[0][b])
+                return nxt
+            return load_outer_
+        if op == POP:
+            def pop_():
+                del stack[-1]
+                return nxt
+            return pop_
+        if op == BINOP_ADD:
+            def binop_add_():
+                v2 = pop()
+                v1 = pop()
+                push(concat(v1, v2) if type(v1) is str else v1 + v2)
+                return nxt
+            return binop_add_
+        if op in ARITH:
+            f = ARITH[op]
+
+            def arith_():
+                v2 = pop()
+                push(f(pop(), v2))
+                return nxt
+            return arith_
+        if op in COMPARE:
+            f = COMPARE[op]
+
+            def compare_():
+                v2 = pop()
+                push(f(pop(), v2))
+                return nxt
+            return compare_
+        if op == JMP or op == JMP_TRUE or op == JMP_FALSE:
+            target = a // WORD
+            if op == JMP:
+                return lambda: target
+            if op == JMP_TRUE:
+                return lambda: target if pop() is True else nxt
+            return lambda: target if pop() is False else nxt
+
+        # 其余指令直接调用查表方式的处理函数, 它们返回的地址都是传入的 nxt、闭包入口或调用时保存的 nxt
+        if 0 <= op < len(handlers):
+            h = handlers[op]
+        else:
+            h = illegal(op)
+        return lambda: h(a, b, nxt)
+
+    def run_threaded():
+        ops = [decode(pc) for pc in range(0, len(code), WORD)]
+        pc = 0
+        end = len(ops)
+        while pc < end:
+            pc = ops[pc]()
 
+        return stack[-1]
+
+    if dispatch == 'threaded':
+        return run_threaded()
+    if dispatch != 'table':
+        err(f'未知的执行方式{dispatch}')
     return run()
 
 
@@ -251,35 +397,9 @@ if __name__ == '__main__':
         ast = parser(lexer(f.read()))
     print(ast)
 
-    code, consts, glob_syms = cilly_vm_compiler(ast, [],
-                                                [], [])
-
-    c = []
-    i = 0
-    while i < len(code):
-        for key, value in zl.items():
-            if code[i] == value:
-                st = ""
-                for x in c:
-                    st += x + '\t'
-                print(st)
-                c = []
-                c.append(f"{i}: {key}")
-                f = key
-                break
-        if f in ["LOAD_CONST", "ENTER_SCOPE", "JMP", "JMP_TRUE", "JMP_FALSE", "CALL"]:
-            c.append(f"{code[i + 1]}")
-            f = None
-            i += 1
-        elif f in ["LOAD_VAR", "STORE_VAR"]:
-            c.append(f"{code[i + 1]}")
-            c.append(f"{code[i + 2]}")
-            f = None
-            i += 2
-        i += 1
-
-    print(code)
+    code, consts, glob_syms = cilly_vm_compiler(ast, [], [], [])
+
+    print(disassemble(code))
     print(consts)
     print(glob_syms)
-    # cilly_vm(code, consts, [Null for _ in glob_syms])
-    cilly_vm(code, consts, glob_syms)
\ No newline at end of file
+    cilly_vm(code, consts, glob_syms)
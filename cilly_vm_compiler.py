@@ -1,65 +1,97 @@
-from cilly_parser import *
+from array import array
+from cilly_ast import *
 from consts import *
+import cilly_fold
+import cilly_memo
 
 
+# 不产生值的语句, 其余节点都是在栈上留下一个值的表达式
+STMT_KINDS = {N_PROGRAM, N_BLOCK, N_IF, N_WHILE, N_PRINT, N_RETURN, N_BREAK, N_CONTINUE, N_VAR, N_FUN, N_IMPORT}
+
+
+# ast 可以是节点, 也可以是 parser() 输出的列表形式语法树
+# code 为已有的字节码(通常为空), 返回的 code 是追加了新指令的 array('i')
 def cilly_vm_compiler(ast, code, consts, glob_syms):
+    code = array('i', code)
+
     def err(msg):
         error('cilly vm compiler', msg)
 
+    # 类型也相同才合用一个常量, 2 与 2.0 不合并
     def add_const(c):
         for i in range(len(consts)):
-            if consts[i] == c:
+            if type(consts[i]) is type(c) and consts[i] == c:
                 return i
 
         consts.append(c)
         return len(consts) - 1
 
-    scopes = [glob_syms]
+    # 运行时的帧: 第 0 层是全局变量列表 glob_syms, 用 LOAD_GLOBAL/STORE_GLOBAL 按下标访问;
+    # 其余每层是一个列表, 下标 0 为外层帧, 后面是各变量的槽位, 用 LOAD_VAR/STORE_VAR (向外的层数, 槽位) 访问
+    # 编译时记录每层帧各槽位的变量名, 帧的长度即列表长度
+    frames = [glob_syms]
 
-    def enter_scope():
-        nonlocal scopes
-        scope = []
-        scopes.append(scope)
+    # 编译时的作用域: (名字 -> 槽位, 所在帧的层数); 代码块是作用域, 但不一定有自己的帧
+    # 代码块中没有函数定义时, 它的变量放进外层帧的新槽位, 不生成 ENTER_SCOPE/LEAVE_SCOPE;
+    # 有函数定义时仍单独建帧, 循环每次执行都是新的帧, 闭包捕获的变量与不提升时相同
+    scopes = [({name: i for i, name in enumerate(glob_syms)}, 0)]
 
-    def leave_scope():
-        return scopes.pop()
+    def enter_scope(new_frame):
+        if new_frame:
+            frames.append([None])
+        scopes.append(({}, len(frames) - 1))
 
-    def current_scope():
-        return scopes[-1]
+    def leave_scope(new_frame):
+        scopes.pop()
+        if new_frame:
+            return frames.pop()
 
     def define_var(name):
-        scope = current_scope()
-        for i in range(len(scope)):
-            if scope[i] == name:
-                err(f'已定义变量{name}')
+        names, level = scopes[-1]
+        if name in names:
+            err(f'已定义变量{name}')
 
-        scope.append(name)
-
-        return len(scope) - 1
+        frame = frames[level]
+        frame.append(name)
+        names[name] = len(frame) - 1
+        return level, names[name]
 
+    # 返回 (变量所在帧的层数, 槽位)
     def resolve_var(name):
-        for scope_i in range(len(scopes)):
-            scope = scopes[-(scope_i + 1)]
-            for i in range(len(scope)):
-                if scope[i] == name:
-                    return scope_i, i
+        for names, level in reversed(scopes):
+            i = names.get(name)
+            if i is not None:
+                return level, i
 
         err(f'未定义变量{name}')
 
-    def define_global(name):
-        for i in range(len(glob_syms)):
-            if glob_syms[i] == name:
-                err(f'变量已定义{name}')
-
-        glob_syms.append(name)
-        return len(glob_syms) - 1
-
-    def lookup_global(name):
-        for i in range(len(glob_syms)):
-            if glob_syms[i] == name:
-                return i
+    def emit_load(level, i):
+        if level == 0:
+            emit(LOAD_GLOBAL, i)
+        else:
+            emit(LOAD_VAR, len(frames) - 1 - level, i)
 
-        err(f'未定义变量{name}')
+    def emit_store(level, i):
+        if level == 0:
+            emit(STORE_GLOBAL, i)
+        else:
+            emit(STORE_VAR, len(frames) - 1 - level, i)
+
+    # 子树中有函数定义
+    def has_fun(node):
+        if not isinstance(node, Node):
+            return False
+        if node.kind == N_FUN:
+            return True
+        for f in node.fields():
+            if isinstance(f, Node):
+                if has_fun(f):
+                    return True
+            elif type(f) is list:
+                for e in f:
+                    if has_fun(e):
+                        return True
+        return False
 
     while_stack = []
 
@@ -78,48 +110,46 @@ def cilly_vm_compiler(ast, code, consts, glob_syms):
     def back_patch(addr, value):
         code[addr + 1] = value
 
-    def emit(opcode, operand=None, operand2=None):
+    # 每条指令定长 WORD 个字, 缺省的操作数补 0
+    def emit(opcode, operand=0, operand2=0):
         addr = next_emit_addr()
         code.append(opcode)
-        if operand is not None:
-            code.append(operand)
-        if operand2 is not None:
-            code.append(operand2)
+        code.append(operand)
+        code.append(operand2)
         return addr
 
-    def compile_null(node):
-        emit(LOAD_NULL)
-
     def compile_bool(node):
-        _, value = node
-        if value == T:
+        if node.value:
             emit(LOAD_TRUE)
         else:
             emit(LOAD_FALSE)
 
-    def compile_literal(node):
-        index = add_const(node)
+    def compile_num(node):
+        index = add_const(node.value)
+        emit(LOAD_CONST, index)
+
+    def compile_str(node):
+        index = add_const(node.value)
         emit(LOAD_CONST, index)
 
     def compile_id(node):
-        _, name = node
-        scope_i, index = resolve_var(name)
-        emit(LOAD_VAR, scope_i, index)
+        emit_load(*resolve_var(node.name))
 
     def compile_uniop(node):
-        _, op, e = node
-        visit(e)
-        if op == '-':
+        visit(node.operand)
+        if node.op == '-':
             emit(UNIOP_NEG)
-        elif op == '!':
+        elif node.op == '!':
             emit(UNIOP_NOT)
+        elif node.op == 'frac':
+            emit(UNIOP_FRAC)
         else:
-            err(f'非法一元运算符号{op}')
+            err(f'非法一元运算符号{node.op}')
 
     def compile_binop(node):
-        _, op, e1, e2 = node
-        visit(e1)
-        visit(e2)
+        op = node.op
+        visit(node.left)
+        visit(node.right)
         if op == '+':
             emit(BINOP_ADD)
         elif op == '-':
@@ -140,56 +170,52 @@ def cilly_vm_compiler(ast, code, consts, glob_syms):
             emit(BINOP_EQ)
         elif op == '!=':
             emit(BINOP_NE)
+        elif op == '^':
+            emit(BINOP_XOR)
         else:
             err(f'非法二元运算符{op}')
 
     def compile_assign(node):
-        _, name, e = node
-        visit(e)
-        scope_i, i = resolve_var(tk_val(name))
-        emit(STORE_VAR, scope_i, i)
+        if node.target.kind != N_ID:
+            err(f'不支持的赋值目标{node.target}')
+        visit(node.value)
+        emit_store(*resolve_var(node.target.name))
 
     def compile_var(node):
-        _, id, e = node
-        if e is not None:
-            visit(e)
+        if node.init is not None:
+            visit(node.init)
         else:
             emit(LOAD_NULL)
 
-        # i = defineGlobal(id)
-        i = define_var(tk_val(id))
-
-        emit(STORE_VAR, 0, i)
+        emit_store(*define_var(node.name))
+        emit(POP)
 
+    # break/continue 先离开循环内新建的帧再跳转
     def compile_continue(node):
-        loop_addr, _, scope_depth = current_while_stack()
-        for i in range(len(scopes) - scope_depth):
+        loop_addr, _, level = current_while_stack()
+        for i in range(len(frames) - 1 - level):
             emit(LEAVE_SCOPE)
         emit(JMP, loop_addr)
 
     def compile_break(node):
-        _, q, scope_depth = current_while_stack()
+        _, q, level = current_while_stack()
+        for i in range(len(frames) - 1 - level):
+            emit(LEAVE_SCOPE)
         addr = emit(JMP, -1)
         q.append(addr)
 
-        for i in range(len(scopes) - scope_depth):
-            emit(LEAVE_SCOPE)
-
     def compile_return(node):
-        _, e = node
-        if e is not None:
-            visit(e)
+        if node.value is not None:
+            visit(node.value)
         else:
             emit(LOAD_NULL)
         emit(RET)
 
     def compile_print(node):
-        _, exprs = node
-        for e in exprs:
+        for e in node.args:
             visit(e)
             emit(PRINT_ITEM)
         emit(PRINT_NEWLINE)
-        emit(LOAD_NULL)
 
     # def compile_input(node):
     #     v = input()
@@ -197,16 +223,14 @@ def cilly_vm_compiler(ast, code, consts, glob_syms):
     #     emit(LOAD_CONST, index)
 
     def compile_while(node):
-        _, cond, body = node
-
         loop_addr = next_emit_addr()
 
-        push_while_stack((loop_addr, [], len(scopes)))
+        push_while_stack((loop_addr, [], len(frames) - 1))
 
-        visit(cond)
+        visit(node.cond)
         addr = emit(JMP_FALSE, -1)
 
-        visit(body)
+        compile_stmt(node.body)
         emit(JMP, loop_addr)
 
         back_patch(addr, next_emit_addr())
@@ -216,112 +240,128 @@ def cilly_vm_compiler(ast, code, consts, glob_syms):
             back_patch(a, next_emit_addr())
 
     def compile_if(node):
-        _, cond, true_s, false_s = node
-
-        visit(cond)
+        visit(node.cond)
         addr1 = emit(JMP_FALSE, -1)
 
-        visit(true_s)
-        addr2 = emit(JMP, -1)
+        compile_stmt(node.then)
 
-        back_patch(addr1, next_emit_addr())
-
-        if false_s is not None:
-            visit(false_s)
-        else:
-            emit(LOAD_NULL)
+        if node.orelse is None:
+            back_patch(addr1, next_emit_addr())
+            return
 
+        addr2 = emit(JMP, -1)
+        back_patch(addr1, next_emit_addr())
+        compile_stmt(node.orelse)
         back_patch(addr2, next_emit_addr())
 
-    def compile_block(node):
-        _, statements = node
-
-        enter_scope()
-        addr = emit(ENTER_SCOPE, -1)
+    # 当前帧中的代码是否在循环里, 即同一个帧中会多次执行
+    def in_loop():
+        return len(while_stack) > 0 and current_while_stack()[2] == len(frames) - 1
 
-        for s in statements:
-            visit(s)
+    # 只有在循环中且定义了函数的代码块才新建帧, 其余代码块的变量提升到外层帧
+    def compile_block(node):
+        new_frame = in_loop() and has_fun(node)
+        enter_scope(new_frame)
+        if new_frame:
+            addr = emit(ENTER_SCOPE, -1)
 
-        back_patch(addr, len(current_scope()))
+        for s in node.stmts:
+            compile_stmt(s)
 
-        leave_scope()
-        emit(LEAVE_SCOPE)
+        frame = leave_scope(new_frame)
+        if new_frame:
+            back_patch(addr, len(frame) - 1)
+            emit(LEAVE_SCOPE)
 
     def compile_call(node):
-        _, f, args = node
-
-        visit(f)
-        for a in args:
+        visit(node.fn)
+        for a in node.args:
             visit(a)
 
-        emit(CALL, len(args))
+        emit(CALL, len(node.args))
 
     def compile_fun(node):
-        _, name, params, body = node
+        params = node.params
 
-        i = define_var(name)
-        addr = emit(LOAD_CONST, -1)  # 函数常量，（函数入口地址，参数个数）
+        level, i = define_var(node.name)
+        addr = emit(LOAD_CONST, -1)  # 函数常量，（函数入口地址，参数个数，局部变量个数）
         emit(MAKE_CLOSURE)
-        emit(STORE_VAR, 0, i)  # 保存到以函数名命名的变量
+        emit_store(level, i)  # 保存到以函数名命名的变量
+        emit(POP)
         addr2 = emit(JMP, -1)
 
-        # 开始编译函数体
-        i = add_const(['compiled fun', next_emit_addr(), len(params)])
-        back_patch(addr, i)
+        # 开始编译函数体; 纯函数的常量带上函数名, 虚拟机在 -memo 时为它的闭包建缓存
+        memo_name = node.name if node in pure else None
+        fun = ['compiled fun', next_emit_addr(), len(params), 0, memo_name]
+        back_patch(addr, add_const(fun))
 
-        # 创建一个新的作用域用于存放参数
-        enter_scope()
+        # 函数帧: 参数依次占槽位 1..n, 函数体内(含代码块中)的变量接在后面
+        enter_scope(True)
         for p in params:
             define_var(p)
 
-        visit(body)
+        visit(node.body)
 
         emit(LOAD_NULL)
         emit(RET)
 
-        leave_scope()
+        frame = leave_scope(True)
+        fun[3] = len(frame) - 1 - len(params)
         back_patch(addr2, next_emit_addr())
 
+    # 语句执行前后栈的高度不变, 表达式语句的值用 POP 丢掉
+    def compile_stmt(node):
+        if node is None:
+            return
+        visit(node)
+        if node.kind not in STMT_KINDS:
+            emit(POP)
+
+    # 最后一条语句是表达式时它的值作为程序的结果, 否则结果为空值
     def compile_program(node):
-        _, statements = node
+        statements = [s for s in node.stmts if s is not None]
         for s in statements[0:-1]:
-            visit(s)
-            emit(POP)
-        visit(statements[-1])
-
-    visitors = {
-        'program': compile_program,
-        'fun': compile_fun,
-        'call': compile_call,
-        'block': compile_block,
-        'if': compile_if,
-        'while': compile_while,
-        'print': compile_print,
-        'return': compile_return,
-        'break': compile_break,
-        'continue': compile_continue,
-        'var': compile_var,
-        'assign': compile_assign,
-        'binop': compile_binop,
-        'uniop': compile_uniop,
-        'id': compile_id,
-        'num': compile_literal,
-        'str': compile_literal,
-        'true': compile_bool,
-        'false': compile_bool,
-        'null': compile_null,
-    }
+            compile_stmt(s)
+        if statements and statements[-1].kind not in STMT_KINDS:
+            visit(statements[-1])
+        else:
+            if statements:
+                compile_stmt(statements[-1])
+            emit(LOAD_NULL)
 
+    visitors = [None] * len(NODE_NAMES)
+    visitors[N_PROGRAM] = compile_program
+    visitors[N_FUN] = compile_fun
+    visitors[N_CALL] = compile_call
+    visitors[N_BLOCK] = compile_block
+    visitors[N_IF] = compile_if
+    visitors[N_WHILE] = compile_while
+    visitors[N_PRINT] = compile_print
+    visitors[N_RETURN] = compile_return
+    visitors[N_BREAK] = compile_break
+    visitors[N_CONTINUE] = compile_continue
+    visitors[N_VAR] = compile_var
+    visitors[N_ASSIGN] = compile_assign
+    visitors[N_BINOP] = compile_binop
+    visitors[N_UINOP] = compile_uniop
+    visitors[N_ID] = compile_id
+    visitors[N_NUM] = compile_num
+    visitors[N_STR] = compile_str
+    visitors[N_BOOL] = compile_bool
+
+    # 按节点种类查表分派
     def visit(node):
-        t = node_tag(node)
-        if t not in visitors:
+        v = visitors[node.kind]
+        if v is None:
             err(f'非法节点{node}')
 
-        v = visitors[t]
-        # print(v)
-
         return v(node)
 
+    if not isinstance(ast, Node):
+        ast = from_list(ast)
+    ast = cilly_fold.fold(ast)
+    pure = cilly_memo.analyze(ast)
+
     visit(ast)
 
     return code, consts, glob_syms
@@ -333,41 +373,9 @@ if __name__ == '__main__':
     with open(filename) as f:
         ast = parser(lexer(f.read()))
     print(ast)
-    #
-    # ast = ['program', [['fun', 'add', ['x', 'y'], ['block', [['return', ['binop', '+', ['id', 'x'], ['id', 'y']]]]]], ['var', ['id', 'a'], ['num', 1]], ['var', ['id', 'b'], ['num', 2]], ['print', [['call', ['id', 'add'], [['num', 1], ['num', 2]]]]]]]
-    # ast = ['program', [
-    #     ['fun', 'add', ['a', 'b'], ['block', [
-    #         ['return', ['binop', '+', ['id', 'a'], ['id', 'b']]]
-    #     ]]],
-    #     ['print', [['call', ['id', 'add'], [['num', 4], ['num', 4]]]]]
-    # ]]
 
     code, consts, glob_syms = cilly_vm_compiler(ast, [], [], [])
 
-    c = []
-    i = 0
-    while i < len(code):
-        for key, value in zl.items():
-            if code[i] == value:
-                st = ""
-                for x in c:
-                    st += x + '\t'
-                print(st)
-                c = []
-                c.append(f"{i}: {key}")
-                f = key
-                break
-        if f in ["LOAD_CONST", "ENTER_SCOPE", "JMP", "JMP_TRUE", "JMP_FALSE", "CALL"]:
-            c.append(f"{code[i + 1]}")
-            f = None
-            i += 1
-        elif f in ["LOAD_VAR", "STORE_VAR"]:
-            c.append(f"{code[i + 1]}")
-            c.append(f"{code[i + 2]}")
-            f = None
-            i += 2
-        i += 1
-
-    print(code)
+    print(disassemble(code))
     print(consts)
     print(glob_syms)
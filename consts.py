@@ -1,7 +1,11 @@
-T = ['bool', True]
-F = ['bool', False]
+# 虚拟机中的值: 数、字符串、布尔直接用 Python 的 int/float/str/bool, 运算不再分配 [标签, 值] 列表
+# 只有空值和函数带标签: 空值是唯一的 Null 列表, 用 is 判断; 函数是 ['compiled fun', ...] 常量和 ['compiled closure', ...]
 Null = ['null', None]
 
+# 字节码是 array('i'), 每条指令固定 WORD 个字: [操作码, 操作数1, 操作数2], 没用到的操作数为 0
+# 跳转目标和函数入口都是指令第一个字的下标
+WORD = 3
+
 LOAD_CONST = 30
 LOAD_TRUE = 31
 LOAD_FALSE = 32
@@ -26,6 +30,8 @@ BINOP_NE = 49
 
 UNIOP_NOT = 50
 UNIOP_NEG = 51
+UNIOP_FRAC = 52
+BINOP_XOR = 53
 
 JMP = 60
 JMP_TRUE = 61
@@ -63,6 +69,8 @@ zl = {
 
     "UNIOP_NOT": 50,
     "UNIOP_NEG": 51,
+    "UNIOP_FRAC": 52,
+    "BINOP_XOR": 53,
 
     "JMP": 60,
     "JMP_TRUE": 61,
@@ -73,4 +81,30 @@ zl = {
     "MAKE_CLOSURE": 66,
     "CALL": 67,
     "RET": 68,
-}
\ No newline at end of file
+}
+
+# 各指令实际使用的操作数个数, 反汇编时使用
+OPERANDS = {
+    LOAD_CONST: 1,
+    LOAD_VAR: 2,
+    STORE_VAR: 2,
+    LOAD_GLOBAL: 1,
+    STORE_GLOBAL: 1,
+    ENTER_SCOPE: 1,
+    JMP: 1,
+    JMP_TRUE: 1,
+    JMP_FALSE: 1,
+    CALL: 1,
+}
+
+OPCODE_NAMES = {v: k for k, v in zl.items()}
+
+
+# 每条指令一行: 地址、助记符和用到的操作数
+def disassemble(code):
+    lines = []
+    for pc in range(0, len(code), WORD):
+        op = code[pc]
+        operands = code[pc + 1:pc + 1 + OPERANDS.get(op, 0)]
+        lines.append('\t'.join([f'{pc}: {OPCODE_NAMES.get(op, op)}'] + [str(x) for x in operands]))
+    return '\n'.join(lines)
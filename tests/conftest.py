@@ -0,0 +1,38 @@
+import contextlib
+import io
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cilly_lexer import lexer
+from cilly_parser import parser
+from cilly_interpreter import eval
+from cilly_closure import execute
+from cilly_stack import execute_stack
+import cilly_array
+
+ENGINES = {
+    'eval': eval,
+    'closure': execute,
+    'stack': execute_stack,
+}
+
+
+# 用指定引擎执行源码, 返回 print 输出的值序列
+@pytest.fixture
+def run_cilly():
+    def run(src, engine='eval', lazy=False):
+        old = cilly_array.lazy_enabled
+        cilly_array.lazy_enabled = lazy
+        buf = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(buf):
+                ENGINES[engine](parser(lexer(src)), {})
+        finally:
+            cilly_array.lazy_enabled = old
+        return buf.getvalue().split()
+    return run
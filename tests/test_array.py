@@ -0,0 +1,10 @@
+import pytest
+
+
+# 写入不同类型的元素后数组变为 object dtype, 之后读元素不能再调用 .item()
+@pytest.mark.parametrize('lazy', [False, True])
+@pytest.mark.parametrize('engine', ['eval', 'closure', 'stack'])
+def test_read_after_mixed_type_write(run_cilly, engine, lazy):
+    src = 'var v = [1, 2] + [3, 4];\nv[0] = 0.5;\nprint(v[1], v[0]);\n' \
+          'var B = [[1, 2], [3, 4]] * [[1, 0], [0, 1]];\nB[0][1] = 2.5;\nprint(B[0][1], B[1][0]);\n'
+    assert run_cilly(src, engine, lazy) == ['6', '0.5', '2.5', '3']
@@ -0,0 +1,70 @@
+import contextlib
+import io
+
+import pytest
+
+from cilly_lexer import lexer
+from cilly_parser import parser
+from cilly_vm import cilly_vm, cilly_vm_compiler
+import cilly_fold
+
+# 条件是非布尔字面量的 if/while: 各引擎对它的判断不同, 折叠不能改变结果
+PROGRAMS = [
+    'if (2) print("t"); else print("f");\nprint("end");\n',
+    'if (0) print("t"); else print("f");\n',
+    'if (1) print("t");\nprint("end");\n',
+    'if ("s") print("t"); else print("f");\n',
+    'if (1 < 2) print("lt"); else print("ge");\nwhile (false) print("never");\nprint("end");\n',
+    # 非布尔值取反同样因引擎而异
+    'print(!1);\n',
+    'print(!"s");\n',
+    'print(2^3, 3!, !true);\n',
+]
+
+# 删除的分支中有声明: 名字仍在作用域中, 不能随分支一起删掉
+DECL_PROGRAMS = [
+    'var g = 1;\nfun f() { if (false) { var g = 2; } g = 5; return g; }\nprint(f());\nprint(g);\n',
+    'var g = 1;\nfun f() { if (true) g = 5; else var g = 2; return g; }\nprint(f());\nprint(g);\n',
+    'var g = 1;\nfun f() { while (false) var g = 2; g = 5; return g; }\nprint(f());\nprint(g);\n',
+]
+
+
+def run_vm(src, fold):
+    old = cilly_fold.fold_enabled
+    cilly_fold.fold_enabled = fold
+    try:
+        code, consts, glob_syms = cilly_vm_compiler(parser(lexer(src)), [], [], [])
+    finally:
+        cilly_fold.fold_enabled = old
+    buf = io.StringIO()
+    with contextlib.redirect_stdout(buf):
+        cilly_vm(code, consts, list(glob_syms))
+    return buf.getvalue().split()
+
+
+@pytest.mark.parametrize('src', PROGRAMS + DECL_PROGRAMS + ['if (false) var x = 1;\nx = 2;\nprint(x);\n'])
+def test_vm_output_same_with_and_without_fold(src):
+    assert run_vm(src, True) == run_vm(src, False)
+
+
+@pytest.mark.parametrize('src', PROGRAMS + ['var i = 0;\nwhile (0) { i = i + 1; }\nprint(i);\n'])
+def test_eval_output_same_with_and_without_fold(run_cilly, src):
+    old = cilly_fold.fold_enabled
+    try:
+        cilly_fold.fold_enabled = False
+        expected = run_cilly(src)
+    finally:
+        cilly_fold.fold_enabled = old
+    assert run_cilly(src) == expected
+
+
+@pytest.mark.parametrize('engine', ['eval', 'closure', 'stack'])
+@pytest.mark.parametrize('src', DECL_PROGRAMS)
+def test_declarations_in_pruned_branches(run_cilly, engine, src):
+    old = cilly_fold.fold_enabled
+    try:
+        cilly_fold.fold_enabled = False
+        expected = run_cilly(src, engine)
+    finally:
+        cilly_fold.fold_enabled = old
+    assert run_cilly(src, engine) == expected
@@ -0,0 +1,13 @@
+import pytest
+
+MODULE = 'var counter = 0;\nfun add() { counter = counter + 1; return counter; }\n'
+
+
+# 导入方与模块共用模块环境: 模块函数改写的模块变量、导入方对它的赋值, 双方都看到新值
+@pytest.mark.parametrize('engine', ['eval', 'closure', 'stack'])
+def test_module_globals_are_shared(run_cilly, engine, tmp_path, monkeypatch):
+    (tmp_path / 'counter.cilly').write_text(MODULE)
+    monkeypatch.chdir(tmp_path)
+    src = 'import "counter.cilly";\nadd();\nadd();\nprint(counter);\n' \
+          'counter = 10;\nprint(add());\nfun f() { return counter; }\nprint(f());\n'
+    assert run_cilly(src, engine) == ['2', '11', '11']
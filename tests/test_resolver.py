@@ -0,0 +1,25 @@
+import pytest
+
+# 函数中的变量在 var/fun 执行之前未定义, 与 eval 一样读写外层变量
+PROGRAMS = [
+    'var x = 1;\nfun f() { print(x); var x = 2; return x; }\nf();\n',
+    'var x = 1;\nfun f() { if (false) { var x = 2; } return x; }\nprint(f());\n',
+    'var x = 1;\nfun f() { x = 5; var x = 2; x = 3; return x; }\nprint(f());\nprint(x);\n',
+    'var x = 1;\nfun f() { var x = x + 1; return x; }\nprint(f());\nprint(x);\n',
+    # 缺少的参数未定义
+    'var n = 7;\nfun f(a, n) { return n; }\nprint(f(1));\n',
+    'var x = 1;\nfun f() { fun g() { return x; } var a = g(); var x = 2; return a + g(); }\nprint(f());\n',
+    'fun o() { fun a(n) { if (n < 1) return 0; return b(n - 1); } fun b(n) { return a(n); } return a(5); }\nprint(o());\n',
+]
+
+
+@pytest.mark.parametrize('engine', ['closure', 'stack'])
+@pytest.mark.parametrize('src', PROGRAMS)
+def test_same_as_eval(run_cilly, engine, src):
+    assert run_cilly(src, engine) == run_cilly(src)
+
+
+@pytest.mark.parametrize('engine', ['eval', 'closure', 'stack'])
+def test_undeclared_local_is_unbound(run_cilly, engine):
+    with pytest.raises(Exception, match='unbound variabley'):
+        run_cilly('fun f() { if (false) { var y = 2; } return y; }\nprint(f());\n', engine)
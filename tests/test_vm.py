@@ -0,0 +1,47 @@
+import gc
+import tracemalloc
+
+import pytest
+
+from cilly_lexer import lexer
+from cilly_parser import parser
+from cilly_vm import cilly_vm, cilly_vm_compiler
+import cilly_fold
+
+OPS = 300
+
+
+# 执行 OPS 个 a op b 并把结果存进全局变量, 返回每次运算在 cilly_vm.py 中新分配、执行后仍存活的内存块数
+def live_blocks_per_op(a, b, dispatch):
+    src = f'var a = {a};\nvar b = {b};\n' + ''.join('var r%d = a %s b;\n' % (i, '+-*'[i % 3]) for i in range(OPS))
+    old = cilly_fold.fold_enabled
+    cilly_fold.fold_enabled = False
+    try:
+        code, consts, glob_syms = cilly_vm_compiler(parser(lexer(src)), [], [], [])
+    finally:
+        cilly_fold.fold_enabled = old
+    globs = list(glob_syms)
+    only_vm = [tracemalloc.Filter(True, '*cilly_vm.py')]
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot().filter_traces(only_vm)
+        cilly_vm(code, consts, globs, dispatch)
+        gc.collect()
+        after = tracemalloc.take_snapshot().filter_traces(only_vm)
+    finally:
+        tracemalloc.stop()
+    return sum(d.count_diff for d in after.compare_to(before, 'filename')) / OPS
+
+
+# 结果在 CPython 的小整数缓存中: 不分配任何内存
+@pytest.mark.parametrize('dispatch', ['table', 'threaded'])
+def test_small_int_ops_allocate_nothing(dispatch):
+    assert live_blocks_per_op(7, 3, dispatch) == 0
+
+
+# 结果是新的 int 对象: 每次运算只有这一块, 没有包装它的 [标签, 值] 列表
+# float 有空闲链表, 会复用之前释放的对象, 块数不稳定, 不用来测
+@pytest.mark.parametrize('dispatch', ['table', 'threaded'])
+@pytest.mark.parametrize('a, b', [(100003, 7919), (1099511627777, 3)])
+def test_ops_allocate_no_wrapper(dispatch, a, b):
+    assert live_blocks_per_op(a, b, dispatch) == 1
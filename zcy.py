@@ -302,80 +302,81 @@ class VirtualMachineExecutor:
 
 
 
-# 示例代码
-vm = VirtualMachine()
+if __name__ == '__main__':
+    # 示例代码
+    vm = VirtualMachine()
 
 
-# 节点表示
+    # 节点表示
 
-c4= '''
+    c4= '''
 var x = 1;
 var y = x + 5;
 print(x+y);
 '''
 
-node = ['program', [
-    ['var', 'x', ['num', 1]],
-    ['var', 'y', ['binop', '+', ['id', 'x'], ['num', 5]]],
-    ['print', [['binop', '+', ['id', 'x'], ['id', 'y']]]]
-]]
+    node = ['program', [
+        ['var', 'x', ['num', 1]],
+        ['var', 'y', ['binop', '+', ['id', 'x'], ['num', 5]]],
+        ['print', [['binop', '+', ['id', 'x'], ['id', 'y']]]]
+    ]]
 
-c2 = '''
+    c2 = '''
 print(1,42, 2*3-5*4);
 '''
 
-node1 = ['program', [
-    ['print', [
-        ['num', 1],
-        ['num', 42],
-        ['binop', '-', ['binop', '*', ['num', 2], ['num', 3]], ['binop', '*', ['num', 5], ['num', 4]]]
+    node1 = ['program', [
+        ['print', [
+            ['num', 1],
+            ['num', 42],
+            ['binop', '-', ['binop', '*', ['num', 2], ['num', 3]], ['binop', '*', ['num', 5], ['num', 4]]]
+        ]]
     ]]
-]]
-
-node2 = ['program', [
-    ['fun', 'add', ['a', 'b'], ['block', [
-        ['return', ['binop', '+', ['id', 'a'], ['id', 'b']]]
-    ]]],
-    ['print', [['call', ['id', 'add'], [['num', 4], ['num', 4]]]]]
-]]
-
-node3 = ['program', [
-    ['var', 'x', ['num', 0]],
-    ['while', ['binop', '<', ['id', 'x'], ['num', 5]], [
-        ['print', [['id', 'x']]],
-        ['var', 'x', ['binop', '+', ['id', 'x'], ['num', 2]]]
+
+    node2 = ['program', [
+        ['fun', 'add', ['a', 'b'], ['block', [
+            ['return', ['binop', '+', ['id', 'a'], ['id', 'b']]]
+        ]]],
+        ['print', [['call', ['id', 'add'], [['num', 4], ['num', 4]]]]]
     ]]
-]]
-
-node4 = ['program', [
-    ['var', 'x', ['num', 10]],
-    ['if', 
-        ['binop', '<', ['id', 'x'], ['num', 5]], 
-        [['print', [['num', 1]]]], 
-        [['print', [['num', 2]]]]
-    ]
-]]
-
-node5 = [
-    'program', [
-        ['assign', 'sum', ['num', 0]],
-        ['assign', 'i', ['num', 1]],
-        ['while', ['binop', '<=', ['id', 'i'], ['num', 100]], [
-            ['block', [
-                ['assign', 'sum', ['binop', '+', ['id', 'sum'], ['id', 'i']]],
-                ['assign', 'i', ['binop', '+', ['id', 'i'], ['num', 1]]]
-            ]]
-        ]],
-        ['print', [['id', 'sum']]]
+
+    node3 = ['program', [
+        ['var', 'x', ['num', 0]],
+        ['while', ['binop', '<', ['id', 'x'], ['num', 5]], [
+            ['print', [['id', 'x']]],
+            ['var', 'x', ['binop', '+', ['id', 'x'], ['num', 2]]]
+        ]]
+    ]]
+
+    node4 = ['program', [
+        ['var', 'x', ['num', 10]],
+        ['if', 
+            ['binop', '<', ['id', 'x'], ['num', 5]], 
+            [['print', [['num', 1]]]], 
+            [['print', [['num', 2]]]]
+        ]
+    ]]
+
+    node5 = [
+        'program', [
+            ['assign', 'sum', ['num', 0]],
+            ['assign', 'i', ['num', 1]],
+            ['while', ['binop', '<=', ['id', 'i'], ['num', 100]], [
+                ['block', [
+                    ['assign', 'sum', ['binop', '+', ['id', 'sum'], ['id', 'i']]],
+                    ['assign', 'i', ['binop', '+', ['id', 'i'], ['num', 1]]]
+                ]]
+            ]],
+            ['print', [['id', 'sum']]]
+        ]
     ]
-]
 
-vm.visit(node5)
-# 输出生成的指令
-for i, instr in enumerate(vm.instructions):
-    print(f'{i}: {instr}')
-#print(vm.constants)
+    vm.visit(node5)
+    # 输出生成的指令
+    for i, instr in enumerate(vm.instructions):
+        print(f'{i}: {instr}')
+    #print(vm.constants)
 
-# 执行指令
-executor = VirtualMachineExecutor(vm.instructions, vm.constants)
-executor.run()
+    # 执行指令
+    executor = VirtualMachineExecutor(vm.instructions, vm.constants)
+    executor.run()